@@ -3,13 +3,24 @@ import cv2
 import time
 import psutil
 import logging
-import pandas as pd
 import numpy as np
 import multiprocessing as mp
+import threading
 from collections import Counter
-from deepface import DeepFace
+from contextlib import nullcontext
 import subprocess
 import config
+import analysis_cache
+import model_registry
+from checkpoint import AnalysisCheckpoint
+from metrics import Metrics
+from scheduler import FairScheduler
+from frame_buffer import SlotRef, create_ring_buffer, resolve_frame
+from video_reader import read_sampled_frames, select_changed_frames
+from emotion_engine import analyse_frames
+from face_tracker import assign_face_ids
+from postprocessing import build_results_dataframe, carry_forward_results, count_dominant_emotions
+import result_store
 
 # =============================================================================
 # Environment Setup & Global Variables
@@ -24,32 +35,45 @@ ANALYSIS_DIR = os.path.join(BASE_DIR, "analysis_sheets")  # Folder for CSV & Exc
 LOG_DIR = os.path.join(BASE_DIR, "logs")  # Folder for per-video log files
 CSV_DIR = os.path.join(ANALYSIS_DIR, "CSV") # Folder for the CSV files
 EXCEL_DIR = os.path.join(ANALYSIS_DIR, "Excel") # Folder for the Excel files
+PARQUET_DIR = os.path.join(ANALYSIS_DIR, config.PARQUET_DIR) # Folder for the Parquet result files
+CHECKPOINT_DIR = os.path.join(BASE_DIR, config.CHECKPOINT_DIR) # Folder for the checkpoints of running analyses
+METRICS_DIR = os.path.join(BASE_DIR, config.METRICS_DIR) # Folder for the metrics of each run
+COMBINED_FILE = os.path.join(PARQUET_DIR, "combined_emotional_analysis.parquet") # Results of all videos
 
-# Create directories if they don't exist yet.
-os.makedirs(VIDEO_DIR, exist_ok=True)
-os.makedirs(ANALYSIS_DIR, exist_ok=True)
-os.makedirs(LOG_DIR, exist_ok=True)
-os.makedirs(CSV_DIR, exist_ok=True)
-os.makedirs(EXCEL_DIR, exist_ok=True)
-
-# Build the DeepFace model (default is OpenFace).
-# Following models have been tested and work after the automated download of model weights: 
-# OpenFace, Facenet, VGG-Face, DeepID, ArcFace, GhostFaceNet.
-emotion_model = DeepFace.build_model("OpenFace")
-
-# Configuration of logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, "analysis.log")),
-        logging.StreamHandler()
-    ]
-)
+# Directories and the log file are only created once an analysis runs (see prepare_environment), so
+# importing this module stays cheap. DeepFace and the emotion model are loaded lazily by the
+# analysis processes (see model_registry).
+_environment_ready = False
+
+# Schedulers of the run_jobs calls in progress, so they can be stopped before a shared pool is terminated.
+_running_schedulers = set()
 
 # =============================================================================
 # Helper Functions
 # =============================================================================
+def prepare_environment():
+    """
+    Create the input and output folders if they don't exist yet and configure the logging.
+    Only the first call has an effect.
+    """
+    global _environment_ready
+    if _environment_ready:
+        return
+    for directory in (VIDEO_DIR, ANALYSIS_DIR, LOG_DIR, CSV_DIR, EXCEL_DIR, PARQUET_DIR):
+        os.makedirs(directory, exist_ok=True)
+
+    # Configuration of logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(os.path.join(LOG_DIR, "analysis.log")),
+            logging.StreamHandler()
+        ]
+    )
+    _environment_ready = True
+
+
 def get_num_processes():
     """
     Function to determine the number of physical cores and based on them make a balanced decision on the
@@ -61,307 +85,813 @@ def get_num_processes():
     return processes if processes else 4
 
 
-def analyse_video(video_path, frame_step=1):
+def results_file(source):
+    """Return the path of the Parquet result file of a video."""
+    return os.path.join(PARQUET_DIR, f"{source}_emotional_analysis.parquet")
+
+
+def video_frame_range(video_path, start=None, end=None):
     """
-    Wrapper function to process a single video file.
-    It extracts the 'source' identifier from the video's filename,
-    prepares the output CSV (and Excel) file path, and then calls
-    analyse_video_internal with the correct parameters.
+    Convert a time range of a video into frame numbers.
+    Args:
+        video_path (str): Full path to the video file.
+        start (float): Start of the range in seconds; None starts at the first frame.
+        end (float): End of the range in seconds; None ends with the last frame.
+    Returns:
+        tuple: (start_frame, end_frame); end_frame is exclusive and None for the end of the video.
+    """
+    cap = cv2.VideoCapture(video_path)
+    frame_rate = cap.get(cv2.CAP_PROP_FPS) or config.FRAME_RATE
+    cap.release()
+    start_frame = max(0, int(round(start * frame_rate))) if start else 0
+    end_frame = int(round(end * frame_rate)) if end is not None else None
+    return start_frame, end_frame
+
+
+def load_cached_analysis(video_path, source, cache_params):
+    """
+    Look up the cached results of a video and write its result file from them.
+    Args:
+        video_path (str): Full path to the video file.
+        source (str): Source identifier of the video.
+        cache_params (dict): Parameters from analysis_cache.analysis_parameters.
+    Returns:
+        DataFrame or None: The cached analysis DataFrame, or None on a cache miss.
+    """
+    try:
+        df = analysis_cache.load(video_path, cache_params)
+    except OSError as e:
+        logging.warning(f"Could not read the analysis cache for {video_path}: {e}")
+        return None
+    if df is not None:
+        logging.info(f"Loaded cached analysis of {video_path} ({len(df)} frames); skipping inference.")
+        # The same content may have been cached under a different file name.
+        df['source'] = source
+        result_store.write_results(df, results_file(source), df.attrs.get('video_info'))
+    return df
+
+
+def analyse_video(video_path, frame_step=1, use_cache=True, resume=False, adaptive=None, time_range=None, pool=None,
+                  metrics=None):
+    """
+    Wrapper function to process a single video file (see analyse_videos).
     Args:
         video_path (str): Full path to the video file.
         frame_step (int): Analyse every n-th frame.
+        use_cache (bool): Look up cached results; if False the video is analysed again and the
+            cache entry is refreshed.
+        resume (bool): Continue from the checkpoint of an interrupted analysis of this video.
+        adaptive (bool): Use adaptive sampling; defaults to ADAPTIVE_SAMPLING in config.py.
+        time_range (tuple): Optional (start, end) in seconds; only this part of the video is analysed.
+        pool (multiprocessing.Pool): Optional running pool of analysis processes (see run_jobs).
+        metrics (Metrics): Optional; receives the timings of the processing stages.
     Returns:
         DataFrame or None: The analysis DataFrame (with an added 'source' column) or None on failure.
     """
-    # Extract the base name of the video (without extension) to use as the source identifier.
-    source = os.path.splitext(os.path.basename(video_path))[0]
-    # Construct the output CSV file path in the analysis folder.
-    output_csv = os.path.join(CSV_DIR, f"{source}_emotional_analysis.csv")
-    excel_file = os.path.join(EXCEL_DIR, f"{source}_emotional_analysis.xlsx")
-    # Optionally, you might also want to create a per-video log file here if desired.
-    return analyse_video_internal(video_path, output_csv, excel_file, source, frame_step)
+    return analyse_videos([video_path], frame_step, use_cache, resume, adaptive, metrics=metrics, time_range=time_range,
+                          pool=pool).get(video_path)
 
 
-def get_dominant_emotion(emo):
+def analyse_videos(video_paths, frame_step=1, use_cache=True, resume=False, adaptive=None, metrics=None, time_range=None,
+                   pool=None):
+    """
+    Analyses several videos with one shared pool of worker processes.
+    Videos whose content was already analysed with the same settings are loaded from the cache.
+    The frames of the other videos are decoded by one producer thread per video and handed to the
+    pool by a FairScheduler, which interleaves the videos round-robin. The output files of each video
+    are written as soon as its last frame has been analysed.
+    Args:
+        video_paths (list): Full paths to the video files.
+        frame_step (int): Analyse every n-th frame.
+        use_cache (bool): Look up cached results; if False the videos are analysed again and the
+            cache entries are refreshed.
+        resume (bool): Continue interrupted analyses from their checkpoints.
+        adaptive (bool): Only analyse the frames where the picture has changed (see
+            video_reader.select_changed_frames); defaults to ADAPTIVE_SAMPLING in config.py.
+        metrics (Metrics): Optional; receives the timings of the processing stages.
+        time_range (tuple): Optional (start, end) in seconds, either may be None; only this part of
+            each video is analysed. The results of a range are not cached.
+        pool (multiprocessing.Pool): Optional running pool of analysis processes (see run_jobs).
+    Returns:
+        dict: The analysis DataFrame (or None on failure) of each video path.
     """
-    Return the dominant emotion if its confidence is ≥ 50, else a message that no dominant
-    emotion has been detected.
+    prepare_environment()
+    if metrics is None:
+        metrics = Metrics("analysis")
+    if adaptive is None:
+        adaptive = config.ADAPTIVE_SAMPLING
+    cache_params = analysis_cache.analysis_parameters(frame_step, adaptive=adaptive)
+    dfs = {}
+    jobs = {}
+    for video_path in video_paths:
+        # Extract the base name of the video (without extension) to use as the source identifier.
+        source = os.path.splitext(os.path.basename(video_path))[0]
+        frame_range = video_frame_range(video_path, *time_range) if time_range else None
+        if config.USE_ANALYSIS_CACHE and use_cache and frame_range is None:
+            with metrics.timer('cache_lookup'):
+                df = load_cached_analysis(video_path, source, cache_params)
+            if df is not None:
+                metrics.count('cached_videos')
+                dfs[video_path] = df
+                continue
+
+        # Finished frames are checkpointed, so an interrupted analysis can be resumed.
+        checkpoint = create_checkpoint(video_path, source, cache_params, frame_range)
+        jobs[video_path] = VideoAnalysis(video_path, source, frame_step, checkpoint, resume, adaptive, metrics, frame_range)
+    dfs.update(run_jobs(jobs, metrics, cache_params, pool))
+    return dfs
+
+
+def create_checkpoint(video_path, source, cache_params, frame_range=None):
+    """
+    Create the checkpoint of one video or frame range (see AnalysisCheckpoint).
     Args:
-        emo (dict): The emotions determined by DeepFace.
+        video_path (str): Full path to the video file.
+        source (str): Source identifier of the video.
+        cache_params (dict): Parameters from analysis_cache.analysis_parameters.
+        frame_range (tuple): Optional (start_frame, end_frame) of the analysed part.
     Returns:
-        str: The dominant emotion or a message indicating no dominant emotion detected.
+        AnalysisCheckpoint: The checkpoint; it only matches runs of the same video, settings and range.
     """
-    if not emo:
-        return 'no emotion detected'
-    dominant = max(emo, key=emo.get)
-    return dominant if emo[dominant] >= config.EMOTION_SCORE_THRESHOLD else 'no dominant emotion detected'
+    header = {'video_sha256': analysis_cache.hash_video(video_path), 'params': cache_params}
+    name = source
+    if frame_range is not None:
+        header['frame_range'] = list(frame_range)
+        name = f"{source}_{frame_range[0]}-{'end' if frame_range[1] is None else frame_range[1]}"
+    return AnalysisCheckpoint(os.path.join(CHECKPOINT_DIR, f"{name}.jsonl"), header,
+                              flush_every=config.CHECKPOINT_EVERY_N_FRAMES)
 
 
-# Global variable for the preloaded model
-global_model = None
+def create_pool(num_processes=None, ready=None):
+    """
+    Start a pool of analysis processes; each process loads the models once (see model_registry.init_worker).
+    Args:
+        num_processes (int): Number of processes; defaults to get_num_processes().
+        ready (multiprocessing.Queue): Optional; receives the id of each process once its models are loaded.
+    """
+    return mp.Pool(processes=num_processes or get_num_processes(), initializer=model_registry.init_worker,
+                   initargs=('opencv', ready))
 
-# Initialiser of each worker / subprocess
-def init_worker(backend_model):
-    """Initialize each worker with a preloaded model."""
-    global global_model
-    global_model = backend_model
+
+def run_jobs(jobs, metrics, cache_params=None, pool=None):
+    """
+    Analyse the frames of several VideoAnalysis jobs with one shared pool of worker processes.
+    The frames of the jobs are decoded by one producer thread per job and handed to the pool by a
+    FairScheduler, which interleaves the jobs round-robin. The output file of each job is written as
+    soon as its last frame has been analysed.
+    Args:
+        jobs (dict): VideoAnalysis per key; the key identifies the job in the scheduler.
+        metrics (Metrics): Receives the timings of the processing stages.
+        cache_params (dict): Parameters of the analysis cache; the results of whole videos are stored
+            under them if the cache is enabled.
+        pool (multiprocessing.Pool): Optional running pool from create_pool, e.g. of a long-running
+            service whose processes keep their models loaded. It may be shared by several threads
+            calling run_jobs and is left running. Without it, a pool is started for this call.
+    Returns:
+        dict: The analysis DataFrame (or None on failure) of each key.
+    """
+    dfs = {}
+    if not jobs:
+        return dfs
+    jobs = dict(jobs)
+
+    scheduler = FairScheduler(max_active=config.MAX_CONCURRENT_VIDEOS)
+    for key, job in jobs.items():
+        scheduler.submit(key, job.start)
+
+    # Use multiprocessing with one pool for all videos; each worker loads the models once.
+    num_processes = get_num_processes()
+    max_in_flight = max(1, config.MAX_IN_FLIGHT_FRAMES, config.EMOTION_BATCH_SIZE)
+    logging.info(
+        f"Using {num_processes} processes for {len(jobs)} video(s) or range(s) (at most {config.MAX_CONCURRENT_VIDEOS} "
+        f"decoded at a time with {max_in_flight} frames in flight each)."
+    )
+    if max_in_flight * min(len(jobs), config.MAX_CONCURRENT_VIDEOS) < num_processes * config.EMOTION_BATCH_SIZE:
+        logging.warning("MAX_IN_FLIGHT_FRAMES is smaller than POOL_SIZE * EMOTION_BATCH_SIZE; some processes will be idle.")
+
+    metrics.info['pool_size'] = num_processes
+    pool_start = time.perf_counter()
+    with create_pool(num_processes) if pool is None else nullcontext(pool) as pool:
+        _running_schedulers.add(scheduler)
+        try:
+            for key, batch_results, report in pool.imap_unordered(analyse_task, scheduler):
+                job = jobs[key]
+                if batch_results is None:
+                    job.decoded = True
+                else:
+                    job.add_results(batch_results, report)
+                # Queue depths: batches waiting for a worker, and frames decoded but not finished yet.
+                metrics.sample('queued_batches', scheduler.pending())
+                metrics.sample('frames_in_flight', sum(job.frames_in_flight() for job in jobs.values()))
+                if job.is_complete():
+                    # Write this video's results while the pool continues with the other videos.
+                    df = job.finish()
+                    # Results that depend on the scheduling are not stored: the cache would return them
+                    # as if every run gave the same.
+                    if (df is not None and config.USE_ANALYSIS_CACHE and cache_params is not None
+                            and job.frame_range is None and job.is_reproducible()):
+                        try:
+                            analysis_cache.store(job.video_path, cache_params, df)
+                        except OSError as e:
+                            logging.warning(f"Could not store the analysis of {job.video_path} in the cache: {e}")
+                    dfs[key] = df
+                    del jobs[key]
+        finally:
+            _running_schedulers.discard(scheduler)
+            scheduler.close()
+            for job in jobs.values():
+                job.stop()
+    # The pool's lifetime including the start of the workers, the basis of the worker utilisation.
+    metrics.record('pool', time.perf_counter() - pool_start)
+    return dfs
+
+
+def stop_running_jobs():
+    """
+    Stop handing out the frames of all run_jobs calls in progress. A shared pool can only be
+    terminated once its task handler is no longer waiting for the next frame of a running job.
+    """
+    for scheduler in list(_running_schedulers):
+        scheduler.close()
 
 
-def analyse_emotion_multiproc(args):
+def analyse_task(item):
     """
-    Analyse a single frame using the preloaded DeepFace model.
+    Worker entry point for a task of the FairScheduler.
     Args:
-        args (tuple): Contains (frame, frame_number, backend).
+        item (tuple): (key, task) with the key of the job and a task for analyse_emotion_multiproc, or
+            None at the end of a video.
     Returns:
-        tuple: (analysis_dict, candidate_dominant_emotion, error message)
+        tuple: (key, results of analyse_emotion_multiproc, report) or (key, None, None) at the end of
+        a video. The report has the process id, the first frame number of the batch,
+        the time the batch took ('busy') and the time of each stage ('timings').
     """
-    frame, frame_number, backend = args
-    # Check for an empty frame.
-    if frame is None or frame.size == 0 or frame.shape[0] == 0 or frame.shape[1] == 0:
-        return None, None, f'Invalid frame at frame number {frame_number}.'
+    key, task = item
+    if task is None:
+        return key, None, None
+    start = time.perf_counter()
+    timings = Counter()
+    results = analyse_emotion_multiproc(task, timings, cache_key=key)
+    frames = task[0]
+    report = {
+        'pid': os.getpid(),
+        'first_frame': frames[0][1] if frames else None,
+        'busy': time.perf_counter() - start,
+        'timings': dict(timings),
+    }
+    return key, results, report
+
+
+def analyse_emotion_multiproc(args, timings=None, cache_key=None):
+    """
+    Analyse a batch of consecutive frames with the batched emotion engine: the faces of all frames
+    are detected first and then classified with a single call of the emotion model.
+    Args:
+        args (tuple): Contains (frames, backend), where frames is a list of (frame, frame_number).
+            Each frame is either the ndarray itself or a SlotRef into the shared frame buffer.
+        timings (Counter): Optional; receives the seconds spent per stage (see analyse_frames).
+        cache_key: Identifies the video for the face crop cache, e.g. the job key.
+    Returns:
+        list: One tuple (analyses, candidate dominant emotions, error message, shared buffer slot or None)
+        per frame, where analyses has one analysis dict per face (see analyse_frames).
+    """
+    frames, backend = args
+    results = []
+    valid_frames = []
+    slots = {}
+    resolve_start = time.perf_counter()
+    for frame_ref, frame_number in frames:
+        # The slot is handed back with the result so the decoder can reuse it.
+        slots[frame_number] = frame_ref.slot if isinstance(frame_ref, SlotRef) else None
+        frame = resolve_frame(frame_ref)
+        # Check for an empty frame.
+        if frame is None or frame.size == 0 or frame.shape[0] == 0 or frame.shape[1] == 0:
+            results.append((None, None, f'Invalid frame at frame number {frame_number}.', slots[frame_number]))
+        else:
+            valid_frames.append((frame_number, frame))
+    if timings is not None:
+        timings['resolve_frames'] += time.perf_counter() - resolve_start
     try:
-        # Perform DeepFace analysis using the preloaded model.
-        analysis = DeepFace.analyze(
-            img_path=frame,
-            actions=['emotion'],
-            enforce_detection=False,
-            detector_backend=backend
-        )
-        emotions = analysis[0].get('emotion', {})
-        # Determine the candidate dominant emotion.
-        candidate = max(emotions, key=emotions.get)
-        # Attach frame_number and face_confidence for downstream use.
-        analysis[0]['frame_number'] = frame_number
-        # Return the analysis result and candidate; let get_dominant_emotion decide final output.
-        return analysis[0], candidate, None
+        outputs = analyse_frames(valid_frames, backend, timings, cache_key)
     except Exception as e:
-        logging.error(f'Error analysing frame {frame_number} with backend {backend}: {e}')
+        first, last = valid_frames[0][0], valid_frames[-1][0]
+        logging.error(f'Error analysing frames {first}-{last} with backend {backend}: {e}')
         error_counter['first_backend_error'] += 1
-        return None, None, f'Error in analysis in frame {frame_number} with {backend}'
+        return results + [
+            (None, None, f'Error in analysis in frame {frame_number} with {backend}', slots[frame_number])
+            for frame_number, _ in valid_frames
+        ]
+    for (frame_number, _), (analyses, error) in zip(valid_frames, outputs):
+        if analyses is None:
+            logging.error(error)
+            results.append((None, None, error, slots[frame_number]))
+        else:
+            # Return the analysis results and candidates; the post-processing decides the final output.
+            candidates = [analysis['dominant_emotion'] for analysis in analyses]
+            results.append((analyses, candidates, None, slots[frame_number]))
+    return results
+
+
+def produce_frames(cap, frame_step, put_task, in_flight, stop_event, stats, start_time, ring=None, skip_frames=frozenset(),
+                   adaptive=False, metrics=None, frame_range=None):
+    """
+    Producer of the streaming pipeline. Reads every n-th frame of the video (see read_sampled_frames),
+    groups consecutive frames into batches of EMOTION_BATCH_SIZE and hands them to put_task,
+    blocking while the maximum number of frames is in flight. With adaptive sampling, only the frames
+    where the picture has changed are handed on (see select_changed_frames).
+    Always finishes with put_task(None) so the consumer knows the stream has ended.
+    Args:
+        cap (cv2.VideoCapture): The opened video.
+        frame_step (int): Analyse every n-th frame.
+        put_task (function): Receives the ([(frame, frame_number), ...], backend) tasks.
+        in_flight (threading.BoundedSemaphore): Released by the consumer for each finished frame.
+        stop_event (threading.Event): Set by the consumer to abort decoding early.
+        stats (dict): Receives the number of decoded ('total_frames') and queued ('queued_frames') frames,
+            the (frame_number, carried_from) pairs of the frames carried forward ('carried_frames') and
+            the time each batch was handed on, keyed by its first frame number ('sent_at').
+        start_time (float): Start time of the video, used for the progress logging.
+        ring (FrameRingBuffer): Optional shared frame buffer. Frames are written into its slots and
+            only a SlotRef is queued; frames that do not fit a slot are queued as they are.
+        skip_frames (frozenset): Frame numbers that are already analysed (when resuming).
+        adaptive (bool): Use adaptive sampling.
+        metrics (Metrics): Optional; receives the time spent decoding ('decode'), waiting for room
+            in the pipeline ('producer_wait') and copying frames to the shared buffer ('frame_copy').
+        frame_range (tuple): Optional (start_frame, end_frame) of the part of the video to read.
+    """
+    if metrics is None:
+        metrics = Metrics("producer")
+    batch_size = max(1, config.EMOTION_BATCH_SIZE)
+    batch = []
+    frame_number = 0
+    start_frame, end_frame = frame_range if frame_range is not None else (0, None)
+    frames = metrics.timed(read_sampled_frames(cap, frame_step, stats, start_frame=start_frame, end_frame=end_frame), 'decode')
+    if adaptive:
+        # The decisions only depend on the video, so a resumed analysis makes the same ones.
+        frames = select_changed_frames(frames, config.SAMPLING_MIN_INTERVAL, config.SAMPLING_MAX_INTERVAL,
+                                       config.SAMPLING_CHANGE_THRESHOLD)
+    else:
+        frames = ((frame_number, frame, None) for frame_number, frame in frames)
+    try:
+        for frame_number, frame, carried_from in frames:
+            if stop_event.is_set():
+                break
+            if carried_from is not None:
+                stats['carried_frames'].append((frame_number, carried_from))
+                continue
+            if frame_number in skip_frames:
+                continue
+            # Backpressure: wait until the consumer has finished one of the frames in flight.
+            with metrics.timer('producer_wait'):
+                while not in_flight.acquire(timeout=0.5):
+                    if stop_event.is_set():
+                        return
+            # The ring has one slot per frame in flight, so a slot is always free at this point.
+            with metrics.timer('frame_copy'):
+                frame_ref = ring.write(ring.acquire(), frame) if ring is not None and ring.fits(frame) else frame
+            batch.append((frame_ref, frame_number))
+            if len(batch) == batch_size:
+                stats['sent_at'][batch[0][1]] = time.perf_counter()
+                put_task((batch, 'opencv'))
+                # Only frames that were handed on are counted, so the consumer knows how many results to expect.
+                stats['queued_frames'] += len(batch)
+                batch = []
+            if frame_number and frame_number // 1000 > (frame_number - frame_step) // 1000:
+                interim_time = time.time()
+                logging.info(f"Read frame {frame_number} of input video after {interim_time - start_time:.2f} seconds")
+        if batch and not stop_event.is_set():
+            stats['sent_at'][batch[0][1]] = time.perf_counter()
+            put_task((batch, 'opencv'))
+            stats['queued_frames'] += len(batch)
+    except Exception as e:
+        logging.error(f"Error while decoding frame {frame_number}: {e}")
+    finally:
+        cap.release()
+        put_task(None)
 
 
 # =============================================================================
 # Video Analysis Functions
 # =============================================================================
-def analyse_video_internal(video_path, output_csv, excel_file, source, frame_step):
+class VideoAnalysis:
     """
-    Processes one video file: opens the video, samples frames at the specified rate,
-    runs DeepFace analysis on each selected frame using multiprocessing,
-    builds a DataFrame with the results, and saves both CSV and Excel files.
+    One video while its frames are analysed by the shared pool: opens the video, samples frames at
+    the specified rate in a producer thread, collects the results of the pool and finally builds a
+    DataFrame with the results and saves it as Parquet file.
     Logs detailed timing information.
+    With a checkpoint, the finished frames are written to it periodically; with resume, the frames
+    of an earlier interrupted run are loaded from it and not analysed again.
+    With a frame range, only that part of the video is analysed.
     """
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        logging.error(f"Error: Could not open video {video_path}.")
-        return None
 
-    # Record the start time for this video.
-    start_time = time.time()
-    logging.info(f"Started processing video {video_path} at {time.ctime(start_time)}")
-
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_rate = int(cap.get(cv2.CAP_PROP_FPS))
-    tasks = []
-    frame_number = 0
-    total_frames = 0
-
-    # Collect frames for analysis based on the frame step.
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        total_frames += 1
-        if frame_number % frame_step == 0:
-            tasks.append((frame, frame_number, 'opencv'))
-        frame_number += 1
-        if frame_number % 1000 == 0:
-            interim_time = time.time()
-            logging.info(f"Read frame {frame_number} of input video after {interim_time - start_time:.2f} seconds")
-    cap.release()
-
-    logging.info(f"Video {video_path} has {total_frames} frames; frame step: {frame_step}; {len(tasks)} frames to analyse.")
-
-    # Use multiprocessing with progress tracking.
-    num_processes = get_num_processes()
-    logging.info(f"Using {num_processes} processes for processing.")
-    manager = mp.Manager()
-    progress_counter = manager.Value('i', 0)  # Shared progress counter
-    lock = manager.Lock()  # Explicit lock for synchronization
-    total_tasks = len(tasks)
-
-    def update_progress(result):
-        """Callback function to update progress."""
-        nonlocal progress_counter
-        with lock:  # Use the explicit lock
-            progress_counter.value += 1
-            current_progress = progress_counter.value
-            if current_progress % max(1, total_tasks // 10) == 0:  # Log every 10%
-                elapsed_time = time.time() - start_time
+    def __init__(self, video_path, source, frame_step, checkpoint=None, resume=False, adaptive=False, metrics=None,
+                 frame_range=None, output_file=None):
+        """
+        Args:
+            video_path (str): Full path to the video file.
+            source (str): Source identifier of the video, used for the output file names.
+            frame_step (int): Analyse every n-th frame.
+            checkpoint (AnalysisCheckpoint): Optional checkpoint of the finished frames.
+            resume (bool): Continue from the checkpoint of an interrupted analysis.
+            adaptive (bool): Use adaptive sampling.
+            metrics (Metrics): Optional; receives the timings of this video's processing stages.
+            frame_range (tuple): Optional (start_frame, end_frame) of the part to analyse; end_frame
+                is exclusive and may be None for the end of the video.
+            output_file (str): Path of the Parquet result file; defaults to the result file of the source.
+        """
+        self.video_path = video_path
+        self.source = source
+        self.output_file = output_file or results_file(source)
+        self.frame_range = frame_range
+        self.frame_step = frame_step
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.adaptive = adaptive
+        self.metrics = metrics if metrics is not None else Metrics("analysis")
+        self.results = []
+        self.reader_stats = {'total_frames': 0, 'queued_frames': 0, 'carried_frames': [], 'sent_at': {}}
+        self.received_frames = 0  # Frames whose result came back from the pool
+        self.decoded = False  # Set once the producer has handed on its last batch
+        self.analysed_frames = 0
+        self.unsuccessful_retries = 0
+        self.frame_count = 0
+        self.frame_rate = 0
+        self.total_tasks = 1
+        self.start_time = None
+        self.analysis_start_time = None
+        self.stop_event = threading.Event()
+        self.in_flight = None
+        self.ring = None
+        self.producer = None
+
+    def start(self, put_task):
+        """
+        Open the video and start the producer thread that hands its frame batches to put_task.
+        Called by the FairScheduler once the video may be decoded.
+        """
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            logging.error(f"Error: Could not open video {self.video_path}.")
+            put_task(None)
+            return
+
+        # Record the start time for this video.
+        self.start_time = time.time()
+        logging.info(f"Started processing video {self.video_path} at {time.ctime(self.start_time)}")
+
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Some containers do not report their frame rate; the default from the config is used then.
+        self.frame_rate = cap.get(cv2.CAP_PROP_FPS) or config.FRAME_RATE
+        # The exact number of frames is only known once the stream is decoded; the container metadata
+        # gives an estimate for the progress logging.
+        start_frame, end_frame = self.frame_range if self.frame_range is not None else (0, None)
+        last_frame = self.frame_count if end_frame is None else min(end_frame, self.frame_count)
+        self.total_tasks = max(1, -(-max(0, last_frame - start_frame) // self.frame_step))
+        range_text = f"; frames {start_frame}-{'end' if end_frame is None else end_frame}" if self.frame_range is not None else ""
+        logging.info(f"Video {self.video_path} reports {self.frame_count} frames{range_text}; frame step: {self.frame_step}; ~{self.total_tasks} frames to analyse.")
+
+        # Reload the frames an interrupted run has already analysed.
+        if self.checkpoint is not None:
+            if self.resume:
+                self.results = self.checkpoint.load()
+                if self.results:
+                    logging.info(f"Resuming {self.video_path}: {len(self.results)} faces were already analysed.")
+            self.checkpoint.start(self.results)
+        done_frames = frozenset(result['frame_number'] for result in self.results)
+        self.total_tasks = max(1, self.total_tasks - len(done_frames))
+        self.analysed_frames = len(done_frames)
+
+        # The semaphore limits the number of decoded frames of this video that are queued or being
+        # analysed, so the memory usage depends on MAX_IN_FLIGHT_FRAMES rather than on the length of
+        # the video. A whole batch has to fit.
+        max_in_flight = max(1, config.MAX_IN_FLIGHT_FRAMES, config.EMOTION_BATCH_SIZE)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        # Frames are handed to the workers through a shared memory ring buffer with one slot per frame in
+        # flight, so only a slot index is pickled per task instead of the whole frame.
+        if config.USE_SHARED_MEMORY:
+            frame_shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+            self.ring = create_ring_buffer(max_in_flight, frame_shape)
+
+        # Start timing the analysis phase
+        self.analysis_start_time = time.time()
+        self.producer = threading.Thread(
+            target=produce_frames,
+            args=(cap, self.frame_step, put_task, self.in_flight, self.stop_event, self.reader_stats,
+                  self.start_time, self.ring, done_frames, self.adaptive, self.metrics, self.frame_range),
+            name=f"frame-producer-{self.source}",
+            daemon=True
+        )
+        self.producer.start()
+
+    def add_results(self, batch_results, report=None):
+        """
+        Take the results of one analysed batch from the pool.
+        Args:
+            batch_results (list): Results of analyse_emotion_multiproc.
+            report (dict): Optional timing report of the worker (see analyse_task).
+        """
+        if report is not None:
+            self.metrics.add_worker_report(report)
+            sent_at = self.reader_stats['sent_at'].pop(report['first_frame'], None)
+            if sent_at is not None:
+                # Every frame of the batch waits for the whole batch; the time that is not spent in the
+                # worker is spent in the task queue and on the transfer between the processes.
+                latency = time.perf_counter() - sent_at
+                self.metrics.record('queue_and_transfer', max(0.0, latency - report['busy']))
+                for _ in batch_results:
+                    self.metrics.record('frame_latency', latency)
+        for analyses, emotions, error, slot in batch_results:
+            if slot is not None:
+                self.ring.release(slot)
+            self.in_flight.release()  # Frees room for the next decoded frame.
+            self.received_frames += 1
+            # Log the progress every 10%.
+            if self.received_frames % max(1, self.total_tasks // 10) == 0:
+                elapsed_time = time.time() - self.start_time
                 logging.info(
-                    f"Processed {current_progress}/{total_tasks} frames ({current_progress / total_tasks * 100:.1f}%), Elapsed Time: {elapsed_time:.1f}s"
+                    f"{self.source}: processed {self.received_frames}/~{self.total_tasks} frames ({min(self.received_frames / self.total_tasks, 1) * 100:.1f}%), Elapsed Time: {elapsed_time:.1f}s"
                 )
-
-    # Start timing the analysis phase
-    analysis_start_time = time.time()
-    results = []
-    analysed_frames = 0
-    unsuccessful_retries = 0
-
-    with mp.Pool(processes=num_processes, initializer=init_worker, initargs=(emotion_model,)) as pool:
-        for res in pool.imap_unordered(analyse_emotion_multiproc, tasks):
-            update_progress(res)  # Update progress
-            analysis_dict, emotion, error = res
-            if analysis_dict:
-                results.append(analysis_dict)
-                analysed_frames += 1
+            if analyses:
+                self.results.extend(analyses)
+                self.analysed_frames += 1
+                if self.checkpoint is not None:
+                    self.checkpoint.append(analyses)
             elif error:
                 logging.warning(error)
-                unsuccessful_retries += 1
-
-    # Record the end time for the analysis phase
-    analysis_end_time = time.time()
-    analysis_duration = analysis_end_time - analysis_start_time
-
-    # Record the overall end time for this video
-    end_time = time.time()
-    duration = end_time - start_time
-    logging.info(f"Finished processing video {video_path} at {time.ctime(end_time)}; Duration: {duration:.2f} seconds")
-    logging.info("Analysis phase took %.2f seconds with the model %s",
-                 analysis_duration, emotion_model.__class__.__name__)  # Log the model used
-
-    # Build DataFrame and save results.
-    if results:
-        df = pd.DataFrame(results)
-        if 'emotion' in df.columns:
-            df.rename(columns={'emotion': 'raw_output'}, inplace=True)
-
-        # Define the list of emotions.
-        emotions_list = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
-
-        # For each emotion column, if face_confidence is below the threshold, set the value to 0.
-        for emo in emotions_list:
-            df[emo] = df.apply(
-                lambda row: row['raw_output'].get(emo, 0) 
-                if row['face_confidence'] >= config.FACE_CONFIDENCE_THRESHOLD else 0, 
-                axis=1
-            )
-
-        # Add the dominant emotion column.
-        df['dominant_emotion'] = df.apply(
-            lambda row: 'no face detected' 
-            if row['face_confidence'] < config.FACE_CONFIDENCE_THRESHOLD 
-            else get_dominant_emotion(row['raw_output']), axis=1
-        )
-
-        # Base column ordering for individual files.
-        columns_order = ['frame_number', 'dominant_emotion'] + emotions_list + ['face_confidence', 'region', 'raw_output']
-        columns_order = [col for col in columns_order if col in df.columns]
-        df = df[columns_order]
-
-        # Add the source column.
-        df['source'] = source
-
-        # Sort by frame_number for individual file export.
-        df.sort_values(by="frame_number", inplace=True)
-
-        # Save as CSV.
-        df.to_csv(output_csv, index=False)
-        # Also save as Excel.
-        df.to_excel(excel_file, index=False)
+                self.unsuccessful_retries += 1
+
+    def frames_in_flight(self):
+        """Return the number of frames handed to the pool whose results are not back yet."""
+        return self.reader_stats['queued_frames'] - self.received_frames
+
+    def is_complete(self):
+        """Return True once the video is decoded and the results of all its frames are back."""
+        return self.decoded and self.received_frames >= self.reader_stats['queued_frames']
+
+    def is_reproducible(self):
+        """
+        Return False if scores of similar face crops were reused (CROP_CACHE_MAX_DISTANCE > 0): which
+        crop's scores a face takes over depends on which process analysed which frame before, so a
+        second run may give slightly different results.
+        """
+        if not config.USE_CROP_CACHE or config.CROP_CACHE_MAX_DISTANCE <= 0:
+            return True
+        return not any(result.get('emotion_cached') for result in self.results)
+
+    def stop(self):
+        """Stop the producer and release the frame buffer and the checkpoint file."""
+        self.stop_event.set()
+        if self.producer is not None:
+            self.producer.join()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+    def finish(self):
+        """
+        Build the DataFrame of the results and save it as Parquet file.
+        Returns:
+            DataFrame or None: The analysis DataFrame, or None if no frame could be analysed.
+        """
+        self.stop()
+        total_frames = self.reader_stats['total_frames']
+        if self.frame_range is not None and self.frame_range[1] is not None and total_frames >= self.frame_range[1]:
+            # The range ended before the video, so only the container metadata knows its length.
+            total_frames = max(total_frames, self.frame_count)
+        logging.info(f"Video {self.video_path} has {total_frames} frames; frame step: {self.frame_step}; {self.reader_stats['queued_frames']} frames analysed.")
+
+        # Record the end time for the analysis phase and the overall end time for this video.
+        end_time = time.time()
+        if self.start_time is not None:
+            logging.info(f"Finished processing video {self.video_path} at {time.ctime(end_time)}; Duration: {end_time - self.start_time:.2f} seconds")
+            logging.info("Analysis phase took %.2f seconds with the model %s",
+                         end_time - self.analysis_start_time, "Emotion")  # Log the model used
+
+        # Build DataFrame and save results.
+        if not self.results:
+            logging.error(f"No analysis results to process for {self.video_path}.")
+            return None
+
+        with self.metrics.timer('build_dataframe'):
+            # Emotion columns, threshold masking and dominant emotions are computed on the whole table at once.
+            df = build_results_dataframe(self.results)
+            # Every face keeps its ID across frames; the carried-forward frames take over the IDs.
+            df['face_id'] = assign_face_ids(df)
+            # Frames skipped by adaptive sampling take over the results of the last analysed frame.
+            df = carry_forward_results(df, self.reader_stats['carried_frames'])
+
+            # Add the source column.
+            df['source'] = self.source
+
+            # Typed columns in the order of the result files, sorted by frame_number and face_id.
+            df = result_store.to_result_frame(df)
+            df.sort_values(by=["frame_number", "face_id"], inplace=True, ignore_index=True)
+
+        # The visualisation needs the frame rate, the frame step and the real length of the video to
+        # place the sampled frames on the time axis. It is kept with the cached results as well.
+        video_info = {'fps': self.frame_rate, 'frame_step': self.frame_step, 'frame_count': total_frames}
+        if self.frame_range is not None:
+            video_info['start_frame'], video_info['end_frame'] = self.frame_range
+        df.attrs['video_info'] = video_info
+
+        # Save as compressed Parquet file; CSV and Excel are exported after the analysis.
+        with self.metrics.timer('write_parquet'):
+            result_store.write_results(df, self.output_file, video_info)
+        self.metrics.count('analysed_frames', self.analysed_frames)
+        self.metrics.count('carried_frames', len(self.reader_stats['carried_frames']))
+        # The results are saved, so the checkpoint is no longer needed.
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
 
         # Log a summary.
-        emotion_counts = {}
-        if 'dominant_emotion' in df.columns:
-            unique_emotions = df['dominant_emotion'].unique()
-            for e in unique_emotions:
-                emotion_counts[e] = df['dominant_emotion'].tolist().count(e)
+        emotion_counts = count_dominant_emotions(df)
 
         # Calculate combined count for failures (using both messages)
         no_dominant = emotion_counts.get('no dominant emotion detected', 0)
         no_face = emotion_counts.get('no face detected', 0)
         failures = no_dominant + no_face
 
-        logging.info("Emotion analysis results:")
+        logging.info(f"Emotion analysis results of {self.video_path}:")
         for emo, count in emotion_counts.items():
             logging.info(f"{emo}: {count} frames")
         logging.info(f"Total frames: {total_frames}")
-        logging.info(f"Frame count: {frame_count}")
-        logging.info(f"Frame rate: {frame_rate} FPS")
-        logging.info(f"Analysed frames: {analysed_frames}")
+        logging.info(f"Frame count: {self.frame_count}")
+        logging.info(f"Frame rate: {self.frame_rate:g} FPS")
+        logging.info(f"Analysed frames: {self.analysed_frames}")
+        if config.USE_CROP_CACHE and self.results:
+            reused = sum(1 for result in self.results if result.get('emotion_cached'))
+            logging.info(f"Face crop cache hits: {reused} of {len(self.results)} faces ({reused / len(self.results) * 100:.1f}%)")
+        if self.adaptive:
+            logging.info(f"Frames carried forward by adaptive sampling: {len(self.reader_stats['carried_frames'])}")
         logging.info(f"Frames with no dominant emotion detected (failure): {failures}")
-        logging.info(f"Unsuccessful retries: {unsuccessful_retries}")
+        logging.info(f"Unsuccessful retries: {self.unsuccessful_retries}")
         logging.info(f"Backend error {error_counter['first_backend_error']}")
         logging.info("Analysis completed.")
         return df
-    else:
-        logging.error("No analysis results to process.")
-        return None
-    
 
-def process_all_videos(frame_step=1):
+
+def export_results(result_file, export_formats, metrics=None):
     """
-    Searches the VIDEO_DIR for video files, processes each one with the specified frame step,
-    and then creates combined output files (CSV and Excel) with an added 'source' column.
-    Logs timestamps and total durations for each file and for the entire process.
+    Export a Parquet result file as CSV and/or Excel file with the same name.
     Args:
-        frame_step (int): Analyse every n-th frame.
+        result_file (str): Path of the Parquet result file.
+        export_formats (list): Any of 'csv' and 'excel'.
+        metrics (Metrics): Optional; receives the time of each export ('export_csv', 'export_excel').
     """
-    overall_start = time.time()
-    logging.info(f"Started processing all videos at {time.ctime(overall_start)}")
-
-    video_files = [
-        os.path.join(VIDEO_DIR, f)
-        for f in os.listdir(VIDEO_DIR)
+    if metrics is None:
+        metrics = Metrics("export")
+    base_name = os.path.splitext(os.path.basename(result_file))[0]
+    if 'csv' in export_formats:
+        csv_file = os.path.join(CSV_DIR, f"{base_name}.csv")
+        with metrics.timer('export_csv'):
+            result_store.export_csv(result_file, csv_file)
+        logging.info(f"Exported {csv_file}")
+    if 'excel' in export_formats:
+        excel_file = os.path.join(EXCEL_DIR, f"{base_name}.xlsx")
+        with metrics.timer('export_excel'):
+            result_store.export_excel(result_file, excel_file)
+        logging.info(f"Exported {excel_file}")
+
+
+def default_export_formats():
+    """Return the export formats enabled in config.py."""
+    return [fmt for fmt, enabled in (('csv', config.EXPORT_CSV), ('excel', config.EXPORT_EXCEL)) if enabled]
+
+
+def find_video_files(folder=None):
+    """Return the full paths of the video files in a folder (default VIDEO_DIR)."""
+    folder = folder or VIDEO_DIR
+    return [
+        os.path.join(folder, f)
+        for f in os.listdir(folder)
         if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv'))
     ]
 
-    if not video_files:
-        message = f"No video files found in the folder: {VIDEO_DIR}"
+
+def combine_and_export(sources, export_formats, metrics):
+    """
+    Combine the per-video result files into one file with all sources and export the files.
+    Args:
+        sources (list): Source identifiers of the videos whose result files exist.
+        export_formats (list): Any of 'csv' and 'excel'.
+        metrics (Metrics): Receives the timings of combining and exporting.
+    """
+    if not sources:
+        message = "No analysis data to combine."
         print(message)
         logging.info(message)
         return
+    # The combined file is assembled from the per-video files, sorted by source and frame_number.
+    partition_files = [results_file(source) for source in sorted(sources)]
+    with metrics.timer('combine'):
+        rows = result_store.combine_results(partition_files, COMBINED_FILE)
+    message = f"Combined analysis ({rows} frames) saved to: {COMBINED_FILE}"
+    print(message)
+    logging.info(message)
 
-    # Create a list of just the file names (without the full path)
-    file_names = [os.path.basename(f) for f in video_files]
-    message = f"Found {len(video_files)} video file(s): {file_names}"
+    # CSV and Excel files are optional exports of the result files.
+    for result_file in partition_files + [COMBINED_FILE]:
+        export_results(result_file, export_formats, metrics)
+
+
+def add_to_combined(source, export_formats, metrics):
+    """
+    Update the combined result file with the results of one video instead of combining all videos
+    again: the previous rows of the video are replaced by the rows of its per-video file, which are
+    appended at the end. The per-video and combined files are exported; the rows of a new video are
+    appended to the combined CSV file if it is up to date, otherwise it is exported again.
+    Args:
+        source (str): Source identifier of the video; its result file must exist.
+        export_formats (list): Any of 'csv' and 'excel'.
+        metrics (Metrics): Receives the timings of combining and exporting.
+    """
+    result_file = results_file(source)
+    previous = os.path.getmtime(COMBINED_FILE) if os.path.exists(COMBINED_FILE) else None
+    with metrics.timer('combine'):
+        rows, replaced = result_store.replace_source(COMBINED_FILE, result_file, source)
+    message = f"Added {source} to the combined analysis ({rows} frames): {COMBINED_FILE}"
     print(message)
     logging.info(message)
 
-    combined_dfs = []
-    for video in video_files:
-        print(f"Processing {video}...")
-        logging.info(f"Processing {video}...")
-        # Call the wrapper function that correctly prepares the arguments
-        df = analyse_video(video, frame_step=frame_step)
-        if df is not None:
-            combined_dfs.append(df)
+    export_results(result_file, export_formats, metrics)
+    combined_csv = os.path.join(CSV_DIR, f"{os.path.splitext(os.path.basename(COMBINED_FILE))[0]}.csv")
+    if ('csv' in export_formats and not replaced and previous is not None and os.path.exists(combined_csv)
+            and os.path.getmtime(combined_csv) >= previous):
+        with metrics.timer('export_csv'):
+            result_store.append_csv(result_file, combined_csv)
+        logging.info(f"Appended {source} to {combined_csv}")
+        export_formats = [fmt for fmt in export_formats if fmt != 'csv']
+    export_results(COMBINED_FILE, export_formats, metrics)
 
-    if combined_dfs:
-        combined_df = pd.concat(combined_dfs, ignore_index=True)
 
-        # Sort the combined DataFrame by source first and then by frame_number.
-        combined_df.sort_values(by=["source", "frame_number"], inplace=True)
+def remove_from_combined(source, export_formats, metrics):
+    """
+    Remove the rows of a video from the combined result file, e.g. after the video was deleted, and
+    export the combined file again. The per-video result files are kept.
+    Args:
+        source (str): Source identifier of the video.
+        export_formats (list): Any of 'csv' and 'excel'.
+        metrics (Metrics): Receives the timings of combining and exporting.
+    """
+    with metrics.timer('combine'):
+        rows, removed = result_store.replace_source(COMBINED_FILE, None, source)
+    if not removed:
+        return
+    message = f"Removed {source} from the combined analysis ({rows} frames left): {COMBINED_FILE}"
+    print(message)
+    logging.info(message)
+    export_results(COMBINED_FILE, export_formats, metrics)
 
-        # Define a standard ordering for the combined file columns.
-        emotions_list = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
-        combined_columns = ["frame_number", "source", "dominant_emotion"] + emotions_list + ["face_confidence", "region", "raw_output"]
 
-        # Only keep columns that are present.
-        combined_columns = [col for col in combined_columns if col in combined_df.columns]
-        combined_df = combined_df[combined_columns]
+def process_all_videos(frame_step=1, use_cache=True, resume=False, export_formats=None, adaptive=None, time_range=None):
+    """
+    Searches the VIDEO_DIR for video files, processes them with the specified frame step,
+    and then creates a combined result file with an added 'source' column.
+    Logs timestamps and total durations for each file and for the entire process, and writes the
+    timings of the processing stages to a JSON file in METRICS_DIR.
+    Args:
+        frame_step (int): Analyse every n-th frame.
+        use_cache (bool): Reuse cached results of unchanged videos.
+        resume (bool): Continue interrupted analyses from their checkpoints.
+        export_formats (list): Also export the result files as 'csv' and/or 'excel'; defaults to
+            EXPORT_CSV and EXPORT_EXCEL in config.py.
+        adaptive (bool): Use adaptive sampling; defaults to ADAPTIVE_SAMPLING in config.py.
+        time_range (tuple): Optional (start, end) in seconds; only this part of each video is analysed.
+    """
+    if export_formats is None:
+        export_formats = default_export_formats()
+    prepare_environment()
+    overall_start = time.time()
+    logging.info(f"Started processing all videos at {time.ctime(overall_start)}")
+    metrics = Metrics("analysis")
+    metrics.info.update({'frame_step': frame_step, 'adaptive': config.ADAPTIVE_SAMPLING if adaptive is None else adaptive})
+    if time_range:
+        metrics.info['time_range'] = list(time_range)
 
-        combined_csv = os.path.join(CSV_DIR, "combined_emotional_analysis.csv")
-        combined_excel = os.path.join(EXCEL_DIR, "combined_emotional_analysis.xlsx")
-        combined_df.to_csv(combined_csv, index=False)
-        combined_df.to_excel(combined_excel, index=False)
+    video_files = find_video_files()
 
-        message = f"Combined analysis saved to:\n  CSV: {combined_csv}\n  Excel: {combined_excel}"
-        print(message)
-        logging.info(message)
-    else:
-        message = "No analysis data to combine."
+    if not video_files:
+        message = f"No video files found in the folder: {VIDEO_DIR}"
         print(message)
         logging.info(message)
+        return
+
+    # Create a list of just the file names (without the full path)
+    file_names = [os.path.basename(f) for f in video_files]
+    message = f"Found {len(video_files)} video file(s): {file_names}"
+    print(message)
+    logging.info(message)
+
+    # All videos share one pool; each video's result file is written as soon as it is finished.
+    dfs = analyse_videos(video_files, frame_step=frame_step, use_cache=use_cache, resume=resume, adaptive=adaptive,
+                         metrics=metrics, time_range=time_range)
+    sources = sorted(
+        os.path.splitext(os.path.basename(video))[0] for video in video_files if dfs.get(video) is not None
+    )
+    del dfs
+    combine_and_export(sources, export_formats, metrics)
 
     overall_end = time.time()
     overall_duration = overall_end - overall_start
@@ -371,16 +901,27 @@ def process_all_videos(frame_step=1):
     print(
         f"Total processing time with {get_num_processes()} Processes for all videos: {overall_duration:.2f} seconds (started at {time.ctime(overall_start)}, finished at {time.ctime(overall_end)})."
     )
+    metrics.info['videos'] = len(video_files)
+    metrics.log_summary()
+    metrics_file = metrics.write(METRICS_DIR)
+    print(f"Metrics saved to: {metrics_file}")
 
 
-def run_analysis(frame_step=1):
+def run_analysis(frame_step=1, use_cache=True, resume=False, export_formats=None, adaptive=None, start=None, end=None):
     """
     Runs the analysis for all videos found in the 'videos' folder,
     using the specified frame step.
     Args:
         frame_step (int): Analyse every n-th frame.
+        use_cache (bool): Reuse cached results of unchanged videos.
+        resume (bool): Continue interrupted analyses from their checkpoints.
+        export_formats (list): Also export the result files as 'csv' and/or 'excel'.
+        adaptive (bool): Use adaptive sampling; defaults to ADAPTIVE_SAMPLING in config.py.
+        start (float): Only analyse each video from this time in seconds on.
+        end (float): Only analyse each video up to this time in seconds.
     """
-    process_all_videos(frame_step)
+    time_range = (start, end) if start is not None or end is not None else None
+    process_all_videos(frame_step, use_cache, resume, export_formats, adaptive, time_range)
 
 
 if __name__ == '__main__':
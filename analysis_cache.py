@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import pandas as pd
+import config
+
+# =============================================================================
+# Persistent Analysis Cache
+# =============================================================================
+# The analysis results of a video are stored on disk under a key made of the hash of the video's
+# content and every parameter that changes the results. Re-running the analysis on an unchanged
+# video with unchanged settings loads the stored results instead of running the inference again.
+# The cache is limited to CACHE_MAX_SIZE_MB; the least recently used entries are evicted first.
+
+CACHE_DIR = os.path.join(os.getcwd(), config.CACHE_DIR)
+INDEX_FILE = os.path.join(CACHE_DIR, "index.json")
+
+# Bump when the stored results change format or meaning, so old entries are no longer used.
+CACHE_VERSION = 7
+
+# Serialises the read-modify-write cycles of the index between threads, e.g. the jobs of the service
+# (see daemon.py) that analyse several videos in one process.
+_index_lock = threading.RLock()
+
+
+def _load_index():
+    """Read the cache index; an unreadable index is treated as empty."""
+    try:
+        with open(INDEX_FILE, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        index = {}
+    index.setdefault("entries", {})
+    index.setdefault("hashes", {})
+    return index
+
+
+def _save_index(index):
+    """Write the cache index atomically so an interrupted run cannot corrupt it."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_file = f"{INDEX_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_file, INDEX_FILE)
+
+
+def hash_video(video_path, index=None):
+    """
+    Return the SHA-256 hash of a video's content.
+    Hashes are remembered per path together with the file's size and modification time, so an
+    unchanged video is only read once.
+    Args:
+        video_path (str): Path to the video file.
+        index (dict): Loaded cache index; loaded and saved here if not given.
+    Returns:
+        str: The hex digest.
+    """
+    own_index = index is None
+    if own_index:
+        with _index_lock:
+            index = _load_index()
+    stat = os.stat(video_path)
+    path_key = os.path.abspath(video_path)
+    known = index["hashes"].get(path_key)
+    if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+        return known["sha256"]
+
+    digest = hashlib.sha256()
+    with open(video_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    if own_index:
+        with _index_lock:
+            # Other threads may have changed the index while the video was read.
+            index = _load_index()
+            index["hashes"][path_key] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+            _save_index(index)
+    else:
+        index["hashes"][path_key] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def analysis_parameters(frame_step, backend='opencv', adaptive=False):
+    """
+    Collect every setting that changes the analysis results of a video.
+    Args:
+        frame_step (int): Analyse every n-th frame.
+        backend (str): DeepFace detector backend.
+        adaptive (bool): Whether adaptive sampling is used.
+    Returns:
+        dict: The parameters that are part of the cache key.
+    """
+    return {
+        "cache_version": CACHE_VERSION,
+        "frame_step": frame_step,
+        "detector_backend": backend,
+        "model": "Emotion",
+        "face_confidence_threshold": config.FACE_CONFIDENCE_THRESHOLD,
+        "emotion_score_threshold": config.EMOTION_SCORE_THRESHOLD,
+        "detect_every_n_frames": config.DETECT_EVERY_N_FRAMES,
+        "tracker_min_confidence": config.TRACKER_MIN_CONFIDENCE,
+        "tracker_search_margin": config.TRACKER_SEARCH_MARGIN,
+        "max_faces": config.MAX_FACES,
+        "face_ids": {
+            "min_iou": config.FACE_ID_MIN_IOU,
+            "max_gap": config.FACE_ID_MAX_GAP,
+        } if config.MAX_FACES != 1 else None,
+        "detection_downscale": {
+            "short_side": config.DETECT_SHORT_SIDE,
+            "scale": config.DETECT_SCALE,
+        } if config.DETECT_SHORT_SIDE or config.DETECT_SCALE else None,
+        "crop_cache_max_distance": config.CROP_CACHE_MAX_DISTANCE if config.USE_CROP_CACHE else None,
+        "adaptive_sampling": {
+            "min_interval": config.SAMPLING_MIN_INTERVAL,
+            "max_interval": config.SAMPLING_MAX_INTERVAL,
+            "change_threshold": config.SAMPLING_CHANGE_THRESHOLD,
+        } if adaptive else None,
+    }
+
+
+def cache_key(video_hash, params):
+    """Combine the video hash and the analysis parameters into one key."""
+    payload = json.dumps({"video": video_hash, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.pkl")
+
+
+def load(video_path, params):
+    """
+    Look up the stored results of a video.
+    Args:
+        video_path (str): Path to the video file.
+        params (dict): Parameters from analysis_parameters.
+    Returns:
+        DataFrame or None: The cached per-frame results, or None on a cache miss.
+    """
+    key = cache_key(hash_video(video_path), params)
+    with _index_lock:
+        index = _load_index()
+        entry = index["entries"].get(key)
+        df = None
+        if entry is not None:
+            try:
+                df = pd.read_pickle(_entry_path(key))
+                entry["last_used"] = time.time()
+            except Exception as e:
+                logging.warning(f"Dropping unreadable cache entry for {video_path}: {e}")
+                del index["entries"][key]
+        _save_index(index)
+    return df
+
+
+def store(video_path, params, df):
+    """
+    Store the results of a video and evict the least recently used entries above the size limit.
+    Args:
+        video_path (str): Path to the video file.
+        params (dict): Parameters from analysis_parameters.
+        df (DataFrame): The per-frame results.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = cache_key(hash_video(video_path), params)
+    path = _entry_path(key)
+    with _index_lock:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        index = _load_index()
+        index["entries"][key] = {
+            "video": os.path.basename(video_path),
+            "params": params,
+            "size": os.path.getsize(path),
+            "last_used": time.time(),
+        }
+        _evict(index, max_bytes=config.CACHE_MAX_SIZE_MB * 1024 * 1024)
+        _save_index(index)
+
+
+def _evict(index, max_bytes):
+    """Remove the least recently used entries until the cache fits into max_bytes."""
+    entries = index["entries"]
+    total = sum(entry["size"] for entry in entries.values())
+    for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+        if total <= max_bytes:
+            break
+        total -= entries[key]["size"]
+        logging.info(f"Evicting cached analysis of {entries[key]['video']} ({entries[key]['size'] / 1e6:.1f} MB)")
+        del entries[key]
+        try:
+            os.remove(_entry_path(key))
+        except FileNotFoundError:
+            pass
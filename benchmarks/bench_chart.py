@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+# Make the project modules importable when running this file directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import visualisation
+from visualisation import FRAME_RATE, create_timeline_figure
+from bench_render import synthetic_results
+
+
+def draw_chart(df, duration, aggregation):
+    """
+    Builds and rasterises the animation chart with the given CHART_AGGREGATION.
+    Returns:
+        tuple: (seconds, peak traced memory in MB, number of drawn patches and collections)
+    """
+    visualisation.CHART_AGGREGATION = aggregation
+    tracemalloc.start()
+    start = time.perf_counter()
+    fig, ax = create_timeline_figure(df, "benchmark", duration)
+    fig.canvas.draw()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    primitives = len(ax.patches) + len(ax.collections)
+    plt.close(fig)
+    return elapsed, peak / 1e6, primitives
+
+
+def main():
+    """
+    Compares the time and memory needed to draw the chart of videos of growing length with one bar
+    per analysed frame and with the frames combined into pixel-wide bins.
+    """
+    parser = argparse.ArgumentParser(description="Chart drawing speed for long videos")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 5, 20, 60],
+                        help="Video lengths in minutes, analysed at every frame (default: 1 5 20 60).")
+    parser.add_argument("--max_bar_minutes", type=float, default=20,
+                        help="Skip drawing one bar per frame for longer videos, as it takes very long (default: 20).")
+    args = parser.parse_args()
+
+    print(f"{'minutes':>8} {'frames':>9} {'mode':>6} {'seconds':>9} {'peak MB':>9} {'primitives':>11}")
+    for minutes in args.minutes:
+        total_frames = int(minutes * 60 * FRAME_RATE)
+        df = synthetic_results(total_frames)
+        duration = total_frames / FRAME_RATE
+        for aggregation in ("none", "max", "mean"):
+            if aggregation == "none" and minutes > args.max_bar_minutes:
+                continue
+            elapsed, peak, primitives = draw_chart(df, duration, aggregation)
+            print(f"{minutes:>8g} {total_frames:>9} {aggregation:>6} {elapsed:>9.2f} {peak:>9.1f} {primitives:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import argparse
+import cv2
+import numpy as np
+
+# Make the project modules importable when running this file directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crop_cache import hamming_distance, perceptual_hash
+from emotion_engine import EMOTION_LABELS, classify_faces, detect_face, preprocess_face
+from bench_detect import load_scene
+
+
+def perturb(frame, rng, noise, shift, brightness):
+    """
+    Returns a copy of a frame as the next frame of a static camera might look: moved by a sub-pixel
+    offset, with sensor noise and a small change of brightness.
+    """
+    dx, dy = rng.uniform(-shift, shift, 2)
+    moved = cv2.warpAffine(frame, np.float32([[1, 0, dx], [0, 1, dy]]), (frame.shape[1], frame.shape[0]),
+                           flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+    changed = moved.astype(np.float32) + rng.uniform(-brightness, brightness) + rng.normal(0, noise, frame.shape)
+    return np.clip(changed, 0, 255).astype(np.uint8)
+
+
+def main():
+    """
+    Measures how much the emotion scores of two face crops can differ for each Hamming distance of
+    their perceptual hashes, i.e. the error of reusing cached scores up to CROP_CACHE_MAX_DISTANCE.
+    The crops are detected and cut out of perturbed copies of one picture, like consecutive frames
+    of a static camera; every pair of crops is compared.
+    """
+    parser = argparse.ArgumentParser(description="Emotion score differences per perceptual hash distance of face crops")
+    parser.add_argument("--input", type=str, default=None,
+                        help="Video or image with a face (default: the astronaut picture of scikit-image, or a synthetic face).")
+    parser.add_argument("--samples", type=int, default=200, help="Number of perturbed copies (default: 200).")
+    parser.add_argument("--noise", type=float, default=3.0, help="Standard deviation of the sensor noise (default: 3).")
+    parser.add_argument("--shift", type=float, default=1.5, help="Largest offset in pixels (default: 1.5).")
+    parser.add_argument("--brightness", type=float, default=4.0, help="Largest change of brightness (default: 4).")
+    parser.add_argument("--max_distance", type=int, default=6, help="Largest distance to report (default: 6).")
+    args = parser.parse_args()
+
+    scene = None
+    if args.input is None:
+        try:
+            from skimage import data
+            scene = cv2.imread(os.path.join(data.data_dir, "astronaut.png"))
+        except ImportError:
+            pass
+    if scene is None:
+        scene = load_scene(args.input)
+    if scene is None:
+        print(f"Could not read {args.input} (is it a Git LFS pointer?)")
+        return
+
+    rng = np.random.default_rng(0)
+    hashes, crops = [], []
+    for _ in range(args.samples):
+        face_obj = detect_face(perturb(scene, rng, args.noise, args.shift, args.brightness), 'opencv')
+        if face_obj is None or face_obj['confidence'] <= 0:
+            continue
+        crop = preprocess_face(face_obj['face'])
+        crops.append(crop)
+        hashes.append(perceptual_hash(crop))
+    if len(crops) < 2:
+        print("No face was found in the picture.")
+        return
+    scores = np.array([[emotions[label] for label in EMOTION_LABELS] for emotions in classify_faces(crops)])
+    dominant = scores.argmax(axis=1)
+
+    per_distance = {}
+    for i in range(len(crops)):
+        for j in range(i + 1, len(crops)):
+            distance = hamming_distance(hashes[i], hashes[j])
+            if distance <= args.max_distance:
+                per_distance.setdefault(distance, []).append(
+                    (np.abs(scores[i] - scores[j]).max(), dominant[i] == dominant[j]))
+
+    print(f"{len(crops)} face crops, {len(set(hashes))} distinct hashes")
+    print(f"{'distance':>8} {'pairs':>7} {'p50 diff':>9} {'p95 diff':>9} {'max diff':>9} {'same dominant':>14}")
+    for distance in range(args.max_distance + 1):
+        pairs = per_distance.get(distance)
+        if not pairs:
+            print(f"{distance:>8} {0:>7}")
+            continue
+        diffs = np.array([diff for diff, _ in pairs])
+        same = np.mean([same for _, same in pairs]) * 100
+        print(f"{distance:>8} {len(pairs):>7} {np.percentile(diffs, 50):>9.2f} {np.percentile(diffs, 95):>9.2f} "
+              f"{diffs.max():>9.2f} {same:>13.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import argparse
+import cv2
+
+# Make the project modules importable when running this file directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from video_reader import read_sampled_frames
+
+VIDEO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), config.VIDEO_PATH)
+
+
+def read_all(cap, frame_step, stats):
+    """The previous reader: decode every frame with read() and keep every n-th one."""
+    frame_number = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        stats['total_frames'] = frame_number + 1
+        if frame_number % frame_step == 0:
+            yield frame_number, frame
+        frame_number += 1
+
+
+def time_reader(video_path, frame_step, method):
+    """
+    Reads one video with the given method.
+    Returns:
+        tuple: (number of sampled frames, number of frames in the video, seconds)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    stats = {'total_frames': 0}
+    if method == "read":
+        frames = read_all(cap, frame_step, stats)
+    elif method == "grab":
+        frames = read_sampled_frames(cap, frame_step, stats, seek_step=0)
+    else:
+        frames = read_sampled_frames(cap, frame_step, stats, seek_step=1)
+    start = time.perf_counter()
+    sampled = sum(1 for _ in frames)
+    elapsed = time.perf_counter() - start
+    cap.release()
+    return sampled, stats['total_frames'], elapsed
+
+
+def main():
+    """
+    Compares the decode throughput of read() on every frame, grab()/retrieve() and seeking for a
+    range of frame steps, using the videos in the videos folder unless other files are given.
+    """
+    parser = argparse.ArgumentParser(description="Decode throughput per frame step and reading method")
+    parser.add_argument("videos", nargs="*", help="Video files to read (default: all videos in the videos folder).")
+    parser.add_argument("--frame_steps", type=int, nargs="+", default=[1, 5, 30, 300],
+                        help="Frame steps to compare (default: 1 5 30 300).")
+    parser.add_argument("--methods", nargs="+", choices=["read", "grab", "seek"], default=["read", "grab", "seek"],
+                        help="Reading methods to compare (default: all).")
+    args = parser.parse_args()
+
+    videos = args.videos or sorted(
+        os.path.join(VIDEO_DIR, f) for f in os.listdir(VIDEO_DIR)
+        if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv'))
+    )
+    print(f"{'video':<24} {'step':>6} {'method':>6} {'sampled':>8} {'frames':>8} {'seconds':>8} {'frames/s':>10} {'speedup':>8}")
+    for video in videos:
+        name = os.path.basename(video)
+        for frame_step in args.frame_steps:
+            baseline = None
+            for method in args.methods:
+                result = time_reader(video, frame_step, method)
+                if result is None:
+                    print(f"{name:<24} could not be opened (is it a Git LFS pointer?)")
+                    break
+                sampled, total_frames, elapsed = result
+                fps = total_frames / elapsed if elapsed else float('inf')
+                if baseline is None:
+                    baseline = elapsed
+                speedup = baseline / elapsed if elapsed else float('inf')
+                print(f"{name:<24} {frame_step:>6} {method:>6} {sampled:>8} {total_frames:>8} {elapsed:>8.2f} {fps:>10.1f} {speedup:>7.2f}x")
+            else:
+                continue
+            break
+
+
+if __name__ == '__main__':
+    main()
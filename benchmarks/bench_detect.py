@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+# Make the project modules importable when running this file directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from emotion_engine import classify_faces, detect_face, preprocess_face
+from bench_suite import draw_face
+
+RESOLUTIONS = {"360p": (640, 360), "720p": (1280, 720), "1080p": (1920, 1080), "1440p": (2560, 1440), "4k": (3840, 2160)}
+
+
+def load_scene(path=None):
+    """
+    Returns a BGR picture with a face: the first frame of a video, an image file, or a 1080p frame
+    with a synthetic face (see bench_suite.draw_face).
+    """
+    if path is None:
+        rng = np.random.default_rng(0)
+        scene = rng.integers(60, 120, size=(1080, 1920, 3), dtype=np.uint8)
+        scene = cv2.GaussianBlur(scene, (0, 0), 3)
+        draw_face(scene, (960, 540), 420, 0.5)
+        return scene
+    if path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
+        cap = cv2.VideoCapture(path)
+        ok, frame = cap.read()
+        cap.release()
+        return frame if ok else None
+    return cv2.imread(path)
+
+
+def time_detection(frame, short_side, repeats):
+    """
+    Detects the face of a frame with the given DETECT_SHORT_SIDE.
+    Returns:
+        tuple: (face object of the last run, median seconds per detection)
+    """
+    config.DETECT_SHORT_SIDE = short_side
+    config.DETECT_SCALE = 0
+    times = []
+    face_obj = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        face_obj = detect_face(frame, 'opencv')
+        times.append(time.perf_counter() - start)
+    return face_obj, float(np.median(times))
+
+
+def region_iou(a, b):
+    """Intersection over union of two face regions."""
+    x0, y0 = max(a['x'], b['x']), max(a['y'], b['y'])
+    x1, y1 = min(a['x'] + a['w'], b['x'] + b['w']), min(a['y'] + a['h'], b['y'] + b['h'])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a['w'] * a['h'] + b['w'] * b['h'] - inter
+    return inter / union if union else 0.0
+
+
+def main():
+    """
+    Compares the face detection on full-resolution frames with the detection on a scaled-down copy
+    (DETECT_SHORT_SIDE) for several resolutions of the same picture, and checks that the region and
+    the emotion scores stay the same.
+    """
+    parser = argparse.ArgumentParser(description="Face detection time per resolution with and without downscaling")
+    parser.add_argument("--input", type=str, default=None,
+                        help="Video or image with a face (default: a synthetic face).")
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS), default=["720p", "1080p", "4k"],
+                        help="Resolutions to compare (default: 720p 1080p 4k).")
+    parser.add_argument("--short_sides", type=int, nargs="+", default=[360, 480, 720],
+                        help="Values of DETECT_SHORT_SIDE to compare with the full frame (default: 360 480 720).")
+    parser.add_argument("--repeats", type=int, default=5, help="Detections per measurement; the median is reported (default: 5).")
+    args = parser.parse_args()
+
+    scene = load_scene(args.input)
+    if scene is None:
+        print(f"Could not read {args.input} (is it a Git LFS pointer?)")
+        return
+    print(f"{'resolution':<11} {'short side':>10} {'ms/frame':>9} {'speedup':>8} {'region IoU':>11} {'max score diff':>15} {'dominant':>9}")
+    for resolution in args.resolutions:
+        frame = cv2.resize(scene, RESOLUTIONS[resolution], interpolation=cv2.INTER_CUBIC)
+        detect_face(frame, 'opencv')  # Loads the detector outside of the measurement.
+        full, full_seconds = time_detection(frame, 0, args.repeats)
+        full_scores = classify_faces([preprocess_face(full['face'])])[0] if full is not None else None
+        print(f"{resolution:<11} {'full':>10} {full_seconds * 1000:>9.1f} {1:>7.2f}x {'':>11} {'':>15} {'':>9}")
+        for short_side in args.short_sides:
+            if short_side >= min(frame.shape[:2]):
+                continue
+            face_obj, seconds = time_detection(frame, short_side, args.repeats)
+            if face_obj is None or full is None:
+                iou, diff, same = "-", "-", "-"
+            else:
+                scores = classify_faces([preprocess_face(face_obj['face'])])[0]
+                iou = f"{region_iou(full['facial_area'], face_obj['facial_area']):.3f}"
+                diff = f"{max(abs(scores[label] - full_scores[label]) for label in scores):.2f}"
+                same = "yes" if max(scores, key=scores.get) == max(full_scores, key=full_scores.get) else "no"
+            print(f"{resolution:<11} {short_side:>10} {seconds * 1000:>9.1f} {full_seconds / seconds:>7.2f}x {iou:>11} {diff:>15} {same:>9}")
+
+
+if __name__ == "__main__":
+    main()
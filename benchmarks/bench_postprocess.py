@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+# Make the project modules importable when running this file directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from postprocessing import EMOTIONS_LIST, build_results_dataframe, count_dominant_emotions
+
+
+def synthetic_results(rows, seed=0):
+    """
+    Build analysis results like the ones of the emotion engine: random emotion scores that sum to
+    100 and face confidences of which about a tenth are below the threshold.
+    """
+    rng = np.random.default_rng(seed)
+    scores = rng.dirichlet(np.full(len(EMOTIONS_LIST), 0.5), size=rows) * 100
+    confidences = np.where(rng.random(rows) < 0.1, 0.0, rng.uniform(0.7, 1.0, rows))
+    return [
+        {
+            'emotion': dict(zip(EMOTIONS_LIST, row.tolist())),
+            'face_confidence': float(confidence),
+            'frame_number': i,
+        }
+        for i, (row, confidence) in enumerate(zip(scores, confidences))
+    ]
+
+
+def rowwise_postprocess(results):
+    """The previous post-processing: one row-wise DataFrame.apply per column and list.count per label."""
+    def get_dominant_emotion(emo):
+        if not emo:
+            return 'no emotion detected'
+        dominant = max(emo, key=emo.get)
+        return dominant if emo[dominant] >= config.EMOTION_SCORE_THRESHOLD else 'no dominant emotion detected'
+
+    df = pd.DataFrame(results)
+    df.rename(columns={'emotion': 'raw_output'}, inplace=True)
+    for emo in EMOTIONS_LIST:
+        df[emo] = df.apply(
+            lambda row: row['raw_output'].get(emo, 0)
+            if row['face_confidence'] >= config.FACE_CONFIDENCE_THRESHOLD else 0,
+            axis=1
+        )
+    df['dominant_emotion'] = df.apply(
+        lambda row: 'no face detected'
+        if row['face_confidence'] < config.FACE_CONFIDENCE_THRESHOLD
+        else get_dominant_emotion(row['raw_output']), axis=1
+    )
+    emotion_counts = {}
+    for e in df['dominant_emotion'].unique():
+        emotion_counts[e] = df['dominant_emotion'].tolist().count(e)
+    return df, emotion_counts
+
+
+def vectorised_postprocess(results):
+    """The current post-processing from postprocessing.py."""
+    df = build_results_dataframe(results)
+    return df, count_dominant_emotions(df)
+
+
+def main():
+    """
+    Times the row-wise and the vectorised post-processing on the same synthetic results and checks
+    that both produce the same table.
+    """
+    parser = argparse.ArgumentParser(description="Post-processing time of the analysis results")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of synthetic frames (default: 1000000).")
+    parser.add_argument("--skip_rowwise", action="store_true", help="Only time the vectorised post-processing.")
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows} synthetic results...")
+    results = synthetic_results(args.rows)
+
+    timings = {}
+    outputs = {}
+    methods = [("vectorised", vectorised_postprocess)]
+    if not args.skip_rowwise:
+        methods.insert(0, ("row-wise", rowwise_postprocess))
+    for name, method in methods:
+        start = time.perf_counter()
+        outputs[name] = method(results)
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>10}: {timings[name]:8.2f} seconds")
+
+    if "row-wise" in outputs:
+        (old_df, old_counts), (new_df, new_counts) = outputs["row-wise"], outputs["vectorised"]
+        columns = EMOTIONS_LIST + ['dominant_emotion']
+        same = old_df[columns].equals(new_df[columns].astype(old_df[columns].dtypes.to_dict())) and old_counts == new_counts
+        print(f"   speedup: {timings['row-wise'] / timings['vectorised']:8.1f}x (identical results: {same})")
+
+
+if __name__ == '__main__':
+    main()
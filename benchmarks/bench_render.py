@@ -0,0 +1,115 @@
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+
+# Make the project modules importable when running this file directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import visualisation
+from visualisation import FRAME_RATE, create_timeline_figure
+from timeline_renderer import CursorRenderer, open_ffmpeg_pipe
+
+ENCODER_ARGS = ['-preset', 'fast', '-pix_fmt', 'yuv420p', '-crf', '23']
+
+
+def synthetic_results(total_frames, seed=0):
+    """Emotion scores of a video with total_frames frames; every emotion is above the threshold now and then."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'frame_number': np.arange(total_frames)})
+    for emo in visualisation.emotions_colors:
+        df[emo] = rng.uniform(0, 100, total_frames)
+    df['time_sec'] = df['frame_number'] / FRAME_RATE
+    return df
+
+
+def render_matplotlib(df, duration, frames, path):
+    """The previous renderer: blit the cursor line in Matplotlib and grab every frame with FFMpegWriter."""
+    fig, ax = create_timeline_figure(df, "benchmark", duration)
+    vline = ax.axvline(frames[0] / FRAME_RATE, color='black', linestyle='--', linewidth=1.5)
+    writer = animation.FFMpegWriter(fps=FRAME_RATE, codec="libx264", bitrate=1500, extra_args=ENCODER_ARGS)
+    with writer.saving(fig, path, dpi=100):
+        fig.canvas.draw()
+        background = fig.canvas.copy_from_bbox(fig.bbox)
+        for frame in frames:
+            t = frame / FRAME_RATE
+            vline.set_xdata([t, t])
+            fig.canvas.restore_region(background)
+            ax.draw_artist(vline)
+            fig.canvas.blit(fig.bbox)
+            writer.grab_frame()
+    plt.close(fig)
+
+
+def render_fast(df, duration, frames, path):
+    """The current renderer: stamp the cursor into the pre-rendered chart and pipe raw frames to ffmpeg."""
+    fig, ax = create_timeline_figure(df, "benchmark", duration)
+    renderer = CursorRenderer(fig, ax, dpi=100, color='black', linestyle='--', linewidth=1.5)
+    process = open_ffmpeg_pipe(path, renderer.width, renderer.height, FRAME_RATE, bitrate=1500, extra_args=ENCODER_ARGS)
+    for frame in frames:
+        process.stdin.write(renderer.render(frame / FRAME_RATE).data)
+    process.stdin.close()
+    process.wait()
+    plt.close(fig)
+
+
+def compare_frames(df, duration, sample_frames):
+    """
+    Compares single frames of both renderers before encoding.
+    Returns:
+        tuple: (largest difference of a pixel channel, share of pixels that differ by more than 8)
+    """
+    fig, ax = create_timeline_figure(df, "benchmark", duration)
+    renderer = CursorRenderer(fig, ax, dpi=100, color='black', linestyle='--', linewidth=1.5)
+    vline = ax.axvline(0, color='black', linestyle='--', linewidth=1.5)
+    worst, differing = 0, 0.0
+    for frame in sample_frames:
+        t = frame / FRAME_RATE
+        vline.set_xdata([t, t])
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='rgba', dpi=100)
+        width, height = fig.canvas.get_width_height()
+        reference = np.frombuffer(buffer.getvalue(), dtype=np.uint8).reshape(height, width, 4)[:renderer.height, :renderer.width, :3]
+        difference = np.abs(reference.astype(int) - renderer.render(t).astype(int))
+        worst = max(worst, int(difference.max()))
+        differing = max(differing, float((difference.max(axis=2) > 8).mean()))
+    plt.close(fig)
+    return worst, differing
+
+
+def main():
+    """
+    Times the rendering of one animation segment with the previous Matplotlib renderer and the
+    current raw-frame renderer, and checks that the frames look the same.
+    """
+    parser = argparse.ArgumentParser(description="Animation rendering speed")
+    parser.add_argument("--frames", type=int, default=900, help="Number of frames to render (default: 900, 30 s at 30 FPS).")
+    parser.add_argument("--video_frames", type=int, default=9000, help="Length of the synthetic analysis in frames (default: 9000).")
+    args = parser.parse_args()
+
+    df = synthetic_results(args.video_frames)
+    frames = np.arange(args.frames)
+    timings = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, render in (("matplotlib", render_matplotlib), ("raw frames", render_fast)):
+            path = os.path.join(work_dir, f"{name.replace(' ', '_')}.mp4")
+            start = time.perf_counter()
+            render(df, args.video_frames / FRAME_RATE, frames, path)
+            timings[name] = time.perf_counter() - start
+            print(f"{name:>11}: {timings[name]:7.2f} seconds, {args.frames / timings[name]:8.1f} frames/s, {os.path.getsize(path) / 1e6:.2f} MB")
+    print(f"    speedup: {timings['matplotlib'] / timings['raw frames']:7.1f}x")
+
+    sample_frames = np.linspace(0, args.video_frames - 1, 7).astype(int)
+    worst, differing = compare_frames(df, args.video_frames / FRAME_RATE, sample_frames)
+    print(f"Largest pixel difference to Matplotlib: {worst}; pixels differing by more than 8: {differing * 100:.3f}%")
+
+
+if __name__ == '__main__':
+    main()
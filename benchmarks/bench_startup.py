@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose import dominates the startup time.
+HEAVY_MODULES = ["tensorflow", "deepface", "cv2", "matplotlib", "pandas"]
+
+# Runs in a fresh interpreter: imports main, loads the command and reports the time it took and the
+# heavy modules that were imported on the way.
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import main
+command = {command!r}
+if command:
+    main.load_command(command)
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(command, repeats):
+    """
+    Start a fresh interpreter per repetition and time how long it takes until the command can run.
+    Returns:
+        tuple: (median seconds to load the command, median wall time of the process, loaded heavy
+        modules, folders created in the working directory)
+    """
+    load_times, wall_times, loaded = [], [], []
+    # An empty working directory shows that no output folders are created on import.
+    with tempfile.TemporaryDirectory() as work_dir:
+        for _ in range(repeats):
+            probe = PROBE.format(repo=REPO_DIR, command=command, heavy=HEAVY_MODULES)
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", probe], cwd=work_dir, capture_output=True, text=True, check=True)
+            wall_times.append(time.perf_counter() - start)
+            report = json.loads(output.stdout.strip().splitlines()[-1])
+            load_times.append(report["seconds"])
+            loaded = report["loaded"]
+        created = sorted(os.listdir(work_dir))
+    return statistics.median(load_times), statistics.median(wall_times), loaded, created
+
+
+def main():
+    """
+    Measures the startup time of each subcommand of main.py: the time from starting the interpreter
+    until the command's entry function is imported, without running the analysis or visualisation.
+    """
+    parser = argparse.ArgumentParser(description="Startup time of the main.py subcommands")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of fresh interpreters per command (default: 5).")
+    args = parser.parse_args()
+
+    print(f"{'command':<14} {'import [s]':>10} {'process [s]':>11}  heavy modules loaded / folders created")
+    for command in ["", "analysis", "visualisation"]:
+        load_time, wall_time, loaded, created = measure(command, args.repeats)
+        name = command or "(main only)"
+        print(f"{name:<14} {load_time:>10.3f} {wall_time:>11.3f}  {', '.join(loaded) or '-'} / {', '.join(created) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import subprocess
+import cv2
+import numpy as np
+import psutil
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(REPO_DIR, "benchmarks", "baselines")
+
+# Make the project modules importable when running this file directly.
+sys.path.insert(0, REPO_DIR)
+import config
+from metrics import LATENCY_STAGES
+from model_registry import STUB_EMOTION_MODEL_VARIABLE
+
+# Runs the analysis or visualisation in a fresh interpreter inside the benchmark's working folder,
+# so every run starts cold and writes its outputs and metrics there.
+PROBE = """
+import sys
+sys.path.insert(0, {repo!r})
+import config
+config.USE_ANALYSIS_CACHE = False
+if {processes!r}:
+    config.POOL_SIZE = {processes!r}
+    config.NUM_SEGMENTS = 2 * {processes!r}
+if {command!r} == "analysis":
+    from analysis import run_analysis
+    run_analysis(frame_step={frame_step!r}, use_cache=False, export_formats=[])
+else:
+    from visualisation import run_visualisation
+    run_visualisation(fps={fps!r})
+"""
+
+# Headline figures and whether higher values are better.
+HEADLINE = {
+    'analysis_fps': True,
+    'visualisation_fps': True,
+    'analysis_latency_p95': False,
+    'analysis_peak_rss_mb': False,
+    'visualisation_peak_rss_mb': False,
+}
+
+
+###############################################################################
+# SYNTHETIC VIDEOS
+###############################################################################
+def draw_face(frame, center, size, expression):
+    """
+    Draws a simple cartoon face: skin-coloured head, eyes, eyebrows and a mouth whose curve follows
+    the expression (-1 sad .. 1 happy).
+    """
+    cx, cy = center
+    w, h = int(size * 0.8), size
+    cv2.ellipse(frame, (cx, cy), (w // 2, h // 2), 0, 0, 360, (150, 180, 225), -1)
+    for side in (-1, 1):
+        eye = (cx + side * w // 5, cy - h // 8)
+        cv2.ellipse(frame, eye, (w // 10, h // 20), 0, 0, 360, (255, 255, 255), -1)
+        cv2.circle(frame, eye, max(1, h // 30), (40, 30, 20), -1)
+        brow_y = eye[1] - h // 10 - int(expression * h / 40)
+        cv2.line(frame, (eye[0] - w // 9, brow_y + side * int(expression * 3)), (eye[0] + w // 9, brow_y), (40, 40, 60), max(1, h // 60))
+    cv2.line(frame, (cx, cy - h // 20), (cx, cy + h // 12), (110, 140, 190), max(1, h // 80))
+    mouth = (cx, cy + h // 4)
+    axes = (w // 5, max(1, int(abs(expression) * h / 12)))
+    start, end = (0, 180) if expression >= 0 else (180, 360)
+    cv2.ellipse(frame, mouth, axes, 0, start, end, (60, 50, 160), max(1, h // 60))
+
+
+def create_synthetic_video(path, width, height, seconds, faces, fps=30, seed=0):
+    """
+    Writes a video with a textured background and the given number of slowly moving faces whose
+    expressions change over time.
+    Args:
+        path (str): Output file (.mp4).
+        width, height (int): Resolution.
+        seconds (float): Length of the video.
+        faces (int): Number of faces in the picture.
+        fps (int): Frame rate.
+        seed (int): Seed of the background noise and the face positions.
+    Returns:
+        int: Number of frames written.
+    """
+    rng = np.random.default_rng(seed)
+    background = np.clip(
+        np.linspace(60, 160, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+        + rng.normal(0, 12, (height, width, 3)), 0, 255
+    ).astype(np.uint8)
+    size = int(min(height * 0.6, width * 0.6 / max(1, faces)))
+    centers = [(int(width * (i + 0.5) / max(1, faces)), height // 2) for i in range(faces)]
+    phases = rng.uniform(0, 2 * np.pi, faces)
+    total_frames = max(1, int(round(seconds * fps)))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Cannot write {path}")
+    for frame_number in range(total_frames):
+        t = frame_number / fps
+        frame = background.copy()
+        for (cx, cy), phase in zip(centers, phases):
+            offset = (int(size * 0.05 * np.sin(0.7 * t + phase)), int(size * 0.03 * np.cos(0.5 * t + phase)))
+            draw_face(frame, (cx + offset[0], cy + offset[1]), size, np.sin(0.8 * t + phase))
+        writer.write(frame)
+    writer.release()
+    return total_frames
+
+
+###############################################################################
+# RUNNING THE BENCHMARK
+###############################################################################
+def weights_cached():
+    """Return whether the weights of DeepFace's emotion model have already been downloaded."""
+    home = os.environ.get("DEEPFACE_HOME", os.path.expanduser("~"))
+    return os.path.isfile(os.path.join(home, ".deepface", "weights", "facial_expression_model_weights.h5"))
+
+
+def run_probe(command, work_dir, stub, args):
+    """
+    Runs one command in a fresh interpreter and samples the memory of its process tree.
+    Returns:
+        tuple: (wall time in seconds, peak RSS of the process and its children in MB, metrics summary)
+    """
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3")
+    env.pop(STUB_EMOTION_MODEL_VARIABLE, None)
+    if stub:
+        env[STUB_EMOTION_MODEL_VARIABLE] = "1"
+    probe = PROBE.format(repo=REPO_DIR, command=command, processes=args.processes, frame_step=args.frame_step, fps=args.fps)
+    start = time.perf_counter()
+    process = psutil.Popen([sys.executable, "-c", probe], cwd=work_dir, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    peak = 0
+    done = threading.Event()
+
+    def sample_memory():
+        nonlocal peak
+        while not done.is_set():
+            try:
+                rss = process.memory_info().rss + sum(child.memory_info().rss for child in process.children(recursive=True))
+                peak = max(peak, rss)
+            except psutil.Error:
+                pass
+            done.wait(0.1)
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    _, stderr = process.communicate()
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"{command} failed with code {process.returncode}:\n{stderr[-2000:]}")
+    metrics_files = sorted(glob.glob(os.path.join(work_dir, config.METRICS_DIR, f"metrics_{command}_*.json")), key=os.path.getmtime)
+    if not metrics_files:
+        raise RuntimeError(f"{command} wrote no metrics file")
+    with open(metrics_files[-1], encoding="utf-8") as f:
+        summary = json.load(f)
+    return elapsed, peak / 1e6, summary
+
+
+def run_once(work_dir, stub, args):
+    """
+    Runs the analysis and the visualisation of the videos in work_dir/videos once.
+    Returns:
+        dict: Throughput, peak memory and the total time of each stage of both commands.
+    """
+    for folder in (config.ANALYSIS_DIR, config.ANIMATIONS_DIR, config.PLOTS_DIR, config.METRICS_DIR, config.CHECKPOINT_DIR):
+        shutil.rmtree(os.path.join(work_dir, folder), ignore_errors=True)
+    result = {}
+    for command, counter in (("analysis", "analysed_frames"), ("visualisation", "animation_frames")):
+        if command == "visualisation" and args.skip_visualisation:
+            continue
+        elapsed, peak_mb, summary = run_probe(command, work_dir, stub, args)
+        frames = summary['counters'].get(counter, 0)
+        result[f'{command}_seconds'] = elapsed
+        result[f'{command}_frames'] = frames
+        result[f'{command}_fps'] = frames / elapsed if elapsed > 0 else 0.0
+        result[f'{command}_peak_rss_mb'] = peak_mb
+        result[f'{command}_stages'] = {
+            stage: stats['total'] for stage, stats in summary['stages'].items() if stage not in LATENCY_STAGES
+        }
+        if 'frame_latency' in summary['stages']:
+            result[f'{command}_latency_p95'] = summary['stages']['frame_latency']['p95']
+        if 'worker_utilisation' in summary:
+            result[f'{command}_worker_utilisation'] = summary['worker_utilisation']
+    return result
+
+
+def median_run(runs):
+    """Return the run with the median analysis throughput, so all its figures belong together."""
+    ordered = sorted(runs, key=lambda run: run['analysis_fps'])
+    return ordered[len(ordered) // 2]
+
+
+def run_suite(args):
+    """Prepares the videos, runs the benchmark for each model and writes the results as JSON."""
+    models = args.models
+    if "real" in models and not weights_cached():
+        print("The weights of the emotion model are not cached; skipping the real model (it would download them).")
+        models = [model for model in models if model != "real"]
+    if not models:
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix="bench_suite_") as work_dir:
+        video_dir = os.path.join(work_dir, config.VIDEO_PATH)
+        os.makedirs(video_dir)
+        if args.repo_videos:
+            workload = {'videos': 'repository'}
+            for video in glob.glob(os.path.join(REPO_DIR, config.VIDEO_PATH, "*")):
+                shutil.copy(video, video_dir)
+        else:
+            workload = {'videos': 'synthetic', 'width': args.width, 'height': args.height,
+                        'seconds': args.seconds, 'faces': args.faces, 'count': args.count}
+            for i in range(args.count):
+                create_synthetic_video(os.path.join(video_dir, f"synthetic_{i + 1}.mp4"),
+                                       args.width, args.height, args.seconds, args.faces, seed=i)
+        workload.update({'frame_step': args.frame_step, 'fps': args.fps, 'processes': args.processes})
+
+        results = {
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                        'cpus': os.cpu_count(), 'memory_gb': round(psutil.virtual_memory().total / 1e9, 1)},
+            'workload': workload,
+            'models': {},
+        }
+        for model in models:
+            runs = []
+            for repeat in range(args.repeats):
+                print(f"Running {model} model, repetition {repeat + 1}/{args.repeats}...")
+                runs.append(run_once(work_dir, model == "stub", args))
+            results['models'][model] = median_run(runs)
+
+    print_results(results)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results saved to: {args.output}")
+    return 0
+
+
+def print_results(results):
+    """Prints the headline figures and the slowest stages of each model."""
+    for model, result in results['models'].items():
+        print(f"\n{model} model")
+        for key in HEADLINE:
+            if key in result:
+                print(f"  {key:<28} {result[key]:>10.2f}")
+        for command in ("analysis", "visualisation"):
+            stages = sorted(result.get(f'{command}_stages', {}).items(), key=lambda item: -item[1])
+            for stage, seconds in stages[:6]:
+                print(f"  {command} {stage:<{27 - len(command)}} {seconds:>9.2f}s")
+
+
+###############################################################################
+# COMPARISON WITH A BASELINE
+###############################################################################
+def compare(baseline, current, threshold, min_seconds):
+    """
+    Compares two result files.
+    Args:
+        baseline, current (dict): Results of run_suite.
+        threshold (float): Relative change in percent that counts as a regression.
+        min_seconds (float): Stages shorter than this in the baseline are too noisy to compare.
+    Returns:
+        list: (model, figure, baseline value, current value, change in percent, regression) rows.
+    """
+    rows = []
+    for model, base in baseline['models'].items():
+        result = current['models'].get(model)
+        if result is None:
+            continue
+        figures = [(key, higher_is_better) for key, higher_is_better in HEADLINE.items() if key in base and key in result]
+        for command in ("analysis", "visualisation"):
+            base_stages = base.get(f'{command}_stages', {})
+            stages = result.get(f'{command}_stages', {})
+            for stage, seconds in base_stages.items():
+                if stage in stages and seconds >= min_seconds:
+                    figures.append((f'{command}_stages.{stage}', False))
+        for key, higher_is_better in figures:
+            if '.' in key:
+                group, stage = key.split('.', 1)
+                old, new = base[group][stage], result[group][stage]
+            else:
+                old, new = base[key], result[key]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = -change if higher_is_better else change
+            rows.append((model, key, old, new, change, worse > threshold))
+    return rows
+
+
+def compare_command(args):
+    """Prints the comparison of a result file with a baseline; returns 1 if anything regressed."""
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    if baseline.get('workload') != current.get('workload'):
+        print(f"Warning: the workloads differ:\n  baseline {baseline.get('workload')}\n  current  {current.get('workload')}")
+    rows = compare(baseline, current, args.threshold, args.min_seconds)
+    print(f"{'model':<6} {'figure':<44} {'baseline':>10} {'current':>10} {'change':>8}")
+    for model, key, old, new, change, regression in rows:
+        flag = "  REGRESSION" if regression else ""
+        print(f"{model:<6} {key:<44} {old:>10.2f} {new:>10.2f} {change:>+7.1f}%{flag}")
+    regressions = sum(row[-1] for row in rows)
+    print(f"\n{regressions} regression(s) above {args.threshold:g}%.")
+    return 1 if regressions else 0
+
+
+def main():
+    """
+    End-to-end benchmark of the analysis and the visualisation on synthetic or bundled videos.
+    'run' measures the throughput (frames per second), the peak memory of all processes and the time
+    of each stage (from the metrics of the run) and saves them as JSON; 'compare' compares such a
+    file with a baseline and exits with code 1 if a figure got worse by more than the threshold.
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmark suite with regression baselines")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    run = subparsers.add_parser("run", help="Run the benchmark and save the results.")
+    run.add_argument("--models", nargs="+", choices=["stub", "real"], default=["stub", "real"],
+                     help="Emotion models to benchmark: 'stub' needs no weights, 'real' only runs if the weights are cached (default: both).")
+    run.add_argument("--repo_videos", action="store_true", help="Use the videos of the videos folder instead of synthetic videos.")
+    run.add_argument("--width", type=int, default=1280, help="Width of the synthetic videos (default: 1280).")
+    run.add_argument("--height", type=int, default=720, help="Height of the synthetic videos (default: 720).")
+    run.add_argument("--seconds", type=float, default=10, help="Length of the synthetic videos in seconds (default: 10).")
+    run.add_argument("--faces", type=int, default=1, help="Number of faces in the synthetic videos (default: 1).")
+    run.add_argument("--count", type=int, default=2, help="Number of synthetic videos (default: 2).")
+    run.add_argument("--frame_step", type=int, default=1, help="Frame step of the analysis (default: 1).")
+    run.add_argument("--fps", type=float, default=10, help="Frame rate of the animations (default: 10).")
+    run.add_argument("--processes", type=int, default=None, help="Pool size; defaults to POOL_SIZE in config.py.")
+    run.add_argument("--repeats", type=int, default=3, help="Repetitions per model; the median run is kept (default: 3).")
+    run.add_argument("--skip_visualisation", action="store_true", help="Only benchmark the analysis.")
+    run.add_argument("--output", default=os.path.join(BASELINE_DIR, "latest.json"),
+                     help="Result file (default: benchmarks/baselines/latest.json).")
+
+    comp = subparsers.add_parser("compare", help="Compare results with a baseline.")
+    comp.add_argument("baseline", help="Baseline result file.")
+    comp.add_argument("current", nargs="?", default=os.path.join(BASELINE_DIR, "latest.json"),
+                      help="Result file to check (default: benchmarks/baselines/latest.json).")
+    comp.add_argument("--threshold", type=float, default=10, help="Regression threshold in percent (default: 10).")
+    comp.add_argument("--min_seconds", type=float, default=0.5,
+                      help="Ignore stages that took less than this in the baseline (default: 0.5).")
+
+    args = parser.parse_args()
+    if args.action == "run":
+        return run_suite(args)
+    return compare_command(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import os
+import json
+import logging
+import numpy as np
+
+# =============================================================================
+# Resumable Analysis Checkpoints
+# =============================================================================
+# While a video is analysed, the finished frame results are appended to a JSON lines file. The first
+# line identifies the video content and the analysis settings; every further line holds the list of
+# result dicts of one frame, one per face, so a frame is always written with all its faces or not at
+# all. If the analysis is interrupted, a resumed run reloads these results and only analyses the
+# remaining frames. The file is removed once the video has been analysed completely.
+
+# Bump when the lines change format, so checkpoints of older versions are not resumed.
+CHECKPOINT_FORMAT = 2
+
+
+def _to_builtin(value):
+    """JSON fallback for the NumPy scalars and arrays that appear in DeepFace results."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _restore_region(result):
+    """JSON turns the eye coordinate tuples of a region into lists; turn them back."""
+    region = result.get('region')
+    if isinstance(region, dict):
+        for eye in ('left_eye', 'right_eye'):
+            if isinstance(region.get(eye), list):
+                region[eye] = tuple(region[eye])
+    return result
+
+
+class AnalysisCheckpoint:
+    """
+    Append-only checkpoint file of the face results of one video, one line per frame.
+    """
+
+    def __init__(self, path, header, flush_every=200):
+        """
+        Args:
+            path (str): Path of the checkpoint file.
+            header (dict): Identifies the video and settings; a checkpoint with a different header
+                is not resumed.
+            flush_every (int): Number of frames after which the buffered frames are written.
+        """
+        self.path = path
+        self.header = {**header, 'checkpoint_format': CHECKPOINT_FORMAT}
+        self.flush_every = max(1, flush_every)
+        self._buffer = []
+        self._file = None
+
+    def load(self):
+        """
+        Read the results of an earlier, interrupted run.
+        Returns:
+            list: The result dicts of all faces of the complete frames, or an empty list if there is
+            no matching checkpoint.
+        """
+        results = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                first_line = f.readline()
+                if not first_line or json.loads(first_line) != self.header:
+                    logging.info(f"Checkpoint {self.path} belongs to another video or other settings; starting from the beginning.")
+                    return []
+                for line in f:
+                    try:
+                        frame_results = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line may be incomplete if the process was killed while writing it;
+                        # its frame is analysed again.
+                        break
+                    results.extend(_restore_region(result) for result in frame_results)
+        except FileNotFoundError:
+            return []
+        except json.JSONDecodeError:
+            logging.warning(f"Checkpoint {self.path} is unreadable; starting from the beginning.")
+            return []
+        return results
+
+    def start(self, results=()):
+        """
+        Open a fresh checkpoint file that already holds the given (resumed) results.
+        Args:
+            results (list): Result dicts to keep from an earlier run; they are grouped by frame_number.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Rewrite instead of appending, so a partially written last line of the old file is dropped.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self.header, default=_to_builtin) + "\n")
+            frames = {}
+            for result in results:
+                frames.setdefault(result['frame_number'], []).append(result)
+            for frame_results in frames.values():
+                f.write(json.dumps(frame_results, default=_to_builtin) + "\n")
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, frame_results):
+        """Buffer the result dicts of all faces of one frame; the buffer is written every flush_every frames."""
+        self._buffer.append(list(frame_results))
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered results and make sure they reach the disk."""
+        if self._file is None or not self._buffer:
+            return
+        self._file.write("".join(json.dumps(frame_results, default=_to_builtin) + "\n" for frame_results in self._buffer))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def close(self):
+        """Write the remaining results and close the file."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Delete the checkpoint once the video has been analysed completely."""
+        self._buffer = []
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
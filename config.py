@@ -2,13 +2,22 @@ import psutil
 
 # Analysis and video input/output settings.
 FRAME_STEP = 1 # Analyse every n-th frame. The input through the terminal with sampling_rate can override this.
+SEEK_FRAME_STEP = 250 # From this frame step on, the reader seeks to the next sampled frame instead of skipping the frames in between one by one. 0 disables seeking.
 REQUIREMENTS_PATH = "requirements.txt" #Infor where the requirements file is located.
 VIDEO_PATH = "videos"              # Folder with the input video files to be analysed.
 ANALYSIS_DIR = "analysis_sheets"   # Folder where analysis CSV/Excel files are saved.
 CSV_DIR = "CSV"                    # Folder where the CSV files are saved.
 EXCEL_DIR = "Excel"                # Folder where the Excel files are saved.
+PARQUET_DIR = "Parquet"            # Folder where the Parquet result files are saved.
+PARQUET_COMPRESSION = "zstd"       # Compression of the Parquet result files ("zstd", "snappy", "gzip" or "none").
+EXPORT_CSV = True                  # Also export the results as CSV files after the analysis.
+EXPORT_EXCEL = False               # Also export the results as Excel files after the analysis (slow for long videos).
 PLOTS_DIR = "plots"                # Folder where the Plots files are saved.
 ANIMATIONS_DIR = "animations"             # Folder where the animation files and segments are saved.
+CACHE_DIR = "cache"                # Folder where analysis results are cached between runs.
+CHECKPOINT_DIR = "checkpoints"     # Folder where the results of running analyses are checkpointed.
+METRICS_DIR = "logs"               # Folder where the metrics and profiles of each run are saved.
+SHARD_DIR = "shards"               # Folder where the shard manifest and the results of the shards are saved.
 
 # Threshholds
 FACE_CONFIDENCE_THRESHOLD = 0.9   # Confidence threshold for face detection.
@@ -19,9 +28,66 @@ CONFIDENCE_THRESHOLD = 80 # Chose confidence threshold for emotion detection
 CPU_CORES = psutil.cpu_count(logical=False)  # You can also use a fixed value.
 POOL_SIZE = (CPU_CORES * 2) // 3 # We set the pool size to two thirds the number of CPU cores.
 NUM_SEGMENTS = POOL_SIZE * 2 # Number of segments to divide the video into for parallel processing. This will eleviate the load on the CPU and especially the RAM.
+MAX_IN_FLIGHT_FRAMES = 64 # Maximum number of decoded frames waiting for or undergoing analysis. Bounds the RAM usage independent of the video length.
+USE_SHARED_MEMORY = True # Hand the frames to the worker processes through shared memory instead of copying each frame.
+EMOTION_BATCH_SIZE = 8 # Number of consecutive frames whose faces are classified together in one call of the emotion model.
+MAX_CONCURRENT_VIDEOS = 4 # Number of videos decoded at the same time; their frames share the worker processes round-robin.
+
+# Face tracking settings
+DETECT_EVERY_N_FRAMES = 1 # Run the face detector on every n-th analysed frame and track the face in between. 1 runs the detector on every frame. The tracking continues across batches only while one process analyses consecutive batches of a video.
+TRACKER_MIN_CONFIDENCE = 0.6 # Minimum template match score (0-1) of the tracker; below it the detector runs again.
+TRACKER_SEARCH_MARGIN = 0.5 # Size of the search window around the last face region, relative to the face size.
+DETECT_SHORT_SIDE = 0 # Detect faces on a copy of the frame scaled down to this short side (e.g. 720 for 1080p or 4K videos); the face is still cut out of the full-resolution frame. 0 detects on the full frame.
+DETECT_SCALE = 0 # Fixed factor (e.g. 0.5) by which the frames are scaled down for the face detector, instead of DETECT_SHORT_SIDE. 0 uses DETECT_SHORT_SIDE.
+
+# Multiple faces settings
+MAX_FACES = 1 # Number of faces analysed per frame. 1 analyses the first face found, as before; 0 analyses all faces.
+FACE_ID_MIN_IOU = 0.3 # Minimum overlap (intersection over union, 0-1) of a face with its region in earlier frames to keep its face ID.
+FACE_ID_MAX_GAP = 30 # Number of analysed frames a face may be missing before it gets a new face ID when it comes back.
+
+# Face crop cache settings
+USE_CROP_CACHE = True # Reuse the emotion scores of (nearly) identical face crops instead of running the emotion model on them again.
+CROP_CACHE_SIZE = 256 # Number of face crops each analysis process remembers per video.
+CROP_CACHE_MAX_DISTANCE = 0 # Number of differing bits (of 64) of the perceptual hashes up to which two face crops count as identical. 0 only reuses crops with identical hashes; above 0 the results depend on which process analysed which frame and are not stored in the analysis cache.
+
+# Adaptive sampling settings
+ADAPTIVE_SAMPLING = False # Analyse a frame only once the picture has changed; the frames in between take over the results of the last analysed frame. The --adaptive option enables it for one run.
+SAMPLING_MIN_INTERVAL = 1 # Minimum distance in frames between two analysed frames with adaptive sampling.
+SAMPLING_MAX_INTERVAL = 30 # Maximum distance in frames between two analysed frames with adaptive sampling, even if the picture does not change.
+SAMPLING_CHANGE_THRESHOLD = 2.0 # Mean grayscale difference (0-255) to the last analysed frame from which a frame is analysed again.
+
+# Analysis cache settings
+USE_ANALYSIS_CACHE = True # Reuse the results of videos that were already analysed with the same settings.
+CACHE_MAX_SIZE_MB = 2048 # Maximum size of the analysis cache; the least recently used results are removed first.
+CHECKPOINT_EVERY_N_FRAMES = 100 # Number of analysed frames after which the results are written to the checkpoint.
+
+# Service settings (python main.py serve)
+DAEMON_HOST = "127.0.0.1" # Address the job API listens on; 127.0.0.1 only accepts requests from this computer.
+DAEMON_PORT = 8765 # Port of the job API.
+DAEMON_MAX_ANALYSIS_JOBS = 2 # Number of analysis jobs running at the same time; they share the analysis processes.
+DAEMON_MAX_VISUALISATION_JOBS = 1 # Number of visualisation jobs running at the same time; each starts POOL_SIZE render processes.
+DAEMON_QUEUE_FILE = "jobs.json" # File where the job queue of the service is kept between restarts.
+DAEMON_KEEP_FINISHED_JOBS = 500 # Number of finished jobs kept in the job queue file.
+
+# Watch mode settings (python main.py watch)
+WATCH_POLL_SECONDS = 5 # Seconds between two scans of the videos folder.
+WATCH_STABLE_CHECKS = 2 # Number of scans in a row in which a new or changed video must keep its size and modification time before it is analysed, so videos that are still being copied are not read.
+WATCH_VISUALISE = True # Create the plot and animation of each video after its analysis.
+
+# Live stream settings (python main.py stream)
+STREAM_DIR = "streams" # Folder of the result chunks and the live status file of each stream.
+STREAM_LATENCY_BUDGET = 2.0 # Maximum time in seconds from reading a frame to its result; frames that would take longer are dropped.
+STREAM_CHUNK_SECONDS = 60 # A new result file (chunk) is started every this many seconds.
+STREAM_KEEP_CHUNKS = 0 # Number of chunks kept per stream; older chunks are deleted. 0 keeps all chunks.
+STREAM_WINDOW_FRAMES = 300 # Number of recent results in the live status file.
+STREAM_STATUS_SECONDS = 1.0 # Interval in seconds in which the live status file is written.
+STREAM_IDLE_TIMEOUT = 10 # Seconds without a new frame after which the stream counts as ended.
+STREAM_PACE_FILES = True # Read video files at their frame rate, as a stand-in for a camera.
 
 # Frame and plot settings.
 FRAME_RATE = 30                    # Default frame rate (if not read from video).
+ANIMATION_FPS = 30                 # Frame rate of the animations. Lower values render faster, e.g. for previews.
 PLOT_WIDTH = 19.2                   # Width of the static plot (in inches).
 PLOT_HEIGHT = 5.4                   # Height of the static plot (in inches).
-PLOT_DPI = 100                      # Pixels per inch (dots per inch)
\ No newline at end of file
+PLOT_DPI = 100                      # Pixels per inch (dots per inch)
+CHART_AGGREGATION = "max"          # How the analysed frames within one pixel of a chart are combined: "max", "mean", or "none" to draw one bar per frame (slow for long videos).
\ No newline at end of file
@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+from collections import OrderedDict
+import config
+
+# =============================================================================
+# Near-Duplicate Face Crop Cache
+# =============================================================================
+# With a static camera, the face crops of consecutive frames are often (nearly) identical, and the
+# emotion model would compute the same scores for them again. Each analysis process therefore keeps
+# the scores of the most recent crops of each video, keyed by a 64-bit perceptual hash of the
+# preprocessed crop. A crop whose hash differs from a cached one in at most CROP_CACHE_MAX_DISTANCE
+# bits reuses its scores.
+
+
+def perceptual_hash(crop):
+    """
+    Compute the perceptual hash (pHash) of a face crop: the signs of the lowest 8x8 frequencies of
+    its discrete cosine transform, compared with their median.
+    Args:
+        crop (np.ndarray): Grayscale crop, e.g. the (48, 48) input of the emotion model.
+    Returns:
+        int: The 64-bit hash.
+    """
+    small = cv2.resize(crop.astype(np.float32), (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # The DC coefficient only reflects the overall brightness and is left out of the median.
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a, b):
+    """Number of differing bits of two hashes."""
+    return bin(a ^ b).count("1")
+
+
+class CropCache:
+    """
+    Least recently used cache of emotion scores keyed by the perceptual hash of the face crop.
+    """
+
+    def __init__(self, max_size=None, max_distance=None):
+        """
+        Args:
+            max_size (int): Number of crops kept; defaults to CROP_CACHE_SIZE.
+            max_distance (int): Largest Hamming distance of two hashes that counts as the same crop;
+                defaults to CROP_CACHE_MAX_DISTANCE.
+        """
+        self.max_size = config.CROP_CACHE_SIZE if max_size is None else max_size
+        self.max_distance = config.CROP_CACHE_MAX_DISTANCE if max_distance is None else max_distance
+        self._entries = OrderedDict()  # hash -> emotion scores, least recently used first
+
+    def find(self, crop_hash):
+        """
+        Look up the scores of a crop.
+        Args:
+            crop_hash (int): Hash of the crop from perceptual_hash.
+        Returns:
+            dict or None: The cached scores, or None if no cached crop is close enough.
+        """
+        key = crop_hash if crop_hash in self._entries else None
+        if key is None and self.max_distance > 0:
+            # The most recent crops are the most likely matches.
+            for cached in reversed(self._entries):
+                if hamming_distance(crop_hash, cached) <= self.max_distance:
+                    key = cached
+                    break
+        if key is None:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def add(self, crop_hash, emotions):
+        """Store the scores of a crop, evicting the least recently used crop if the cache is full."""
+        if self.max_size <= 0:
+            return
+        self._entries[crop_hash] = emotions
+        self._entries.move_to_end(crop_hash)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
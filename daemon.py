@@ -0,0 +1,457 @@
+import os
+import json
+import math
+import time
+import signal
+import asyncio
+import logging
+import threading
+from collections import Counter
+import config
+import analysis
+from metrics import LATENCY_STAGES, Metrics
+
+# =============================================================================
+# Analysis Service
+# =============================================================================
+# Every run of main.py pays for starting the interpreter, importing TensorFlow and building the models
+# before the first frame is analysed. The service starts the pool of analysis processes once and keeps
+# it, with the models loaded, for all jobs. Jobs (an analysis of one video or a visualisation) are
+# submitted and polled through a small JSON HTTP API, wait in a queue that is kept on disk and are
+# started by priority, with a limit on the number of jobs of each type that run at the same time. The
+# job bodies are analyse_video and run_visualisation, run in threads of the service.
+#
+#   POST   /jobs        Submit a job, e.g. {"type": "analysis", "video": "videos/clip.mp4", "priority": 5}
+#   GET    /jobs        List all jobs
+#   GET    /jobs/<id>   Status and result of one job
+#   DELETE /jobs/<id>   Cancel a queued job
+#   GET    /health      Pool size and number of jobs per status
+
+JOB_TYPES = ("analysis", "visualisation")
+MAX_REQUEST_BYTES = 1 << 20
+
+BASE_DIR = os.getcwd()
+QUEUE_FILE = os.path.join(BASE_DIR, config.DAEMON_QUEUE_FILE)  # Persistent job queue
+
+
+class JobQueue:
+    """
+    The jobs of the service, saved to a JSON file after every change so queued jobs survive a restart.
+    Jobs that were running when the service stopped are queued again and resume from their checkpoints.
+    Only used from the thread of the event loop.
+    """
+
+    def __init__(self, path, keep_finished=None):
+        """
+        Args:
+            path (str): Path of the JSON file.
+            keep_finished (int): Number of finished jobs kept in the file; defaults to DAEMON_KEEP_FINISHED_JOBS.
+        """
+        self.path = path
+        self.keep_finished = config.DAEMON_KEEP_FINISHED_JOBS if keep_finished is None else keep_finished
+        self.jobs = {}  # Job id -> job
+        self._next_id = 1
+        self._load()
+
+    def _load(self):
+        """Read the jobs of an earlier run of the service."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                jobs = json.load(f)["jobs"]
+        except FileNotFoundError:
+            return
+        except (json.JSONDecodeError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable job queue {self.path}: {e}")
+            return
+        for job in jobs:
+            if job['status'] == 'running':
+                logging.info(f"Job {job['id']} was interrupted; it is queued again.")
+                job['status'] = 'queued'
+                if job['type'] == 'analysis':
+                    job['params']['resume'] = True
+            self.jobs[job['id']] = job
+        self._next_id = max(self.jobs, default=0) + 1
+
+    def save(self):
+        """Write the jobs atomically, dropping the oldest finished jobs above keep_finished."""
+        finished = sorted((job for job in self.jobs.values() if job['status'] in ('done', 'failed', 'cancelled')),
+                          key=lambda job: job['id'])
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job['id']]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'jobs': list(self.jobs.values())}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def submit(self, job_type, params, priority=0):
+        """Queue a new job and return it."""
+        job = {
+            'id': self._next_id,
+            'type': job_type,
+            'params': params,
+            'priority': priority,
+            'status': 'queued',
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+            'result': None,
+            'error': None,
+        }
+        self._next_id += 1
+        self.jobs[job['id']] = job
+        self.save()
+        return job
+
+    def update(self, job, **changes):
+        """Change fields of a job and save the queue."""
+        job.update(changes)
+        self.save()
+
+    def next_job(self, job_types, busy_videos=()):
+        """
+        Return the queued job to start next: the highest priority first, then the oldest.
+        Args:
+            job_types (list): Types of which another job may start.
+            busy_videos (set): Videos being analysed; a second analysis of the same video has to wait,
+                as both would write the same result and checkpoint files.
+        Returns:
+            dict or None: The job, or None if no job can start.
+        """
+        candidates = [
+            job for job in self.jobs.values()
+            if job['status'] == 'queued' and job['type'] in job_types
+            and not (job['type'] == 'analysis' and job['params']['video'] in busy_videos)
+        ]
+        return min(candidates, key=lambda job: (-job['priority'], job['id']), default=None)
+
+    def counts(self):
+        """Return the number of jobs per status."""
+        return dict(Counter(job['status'] for job in self.jobs.values()))
+
+
+# =============================================================================
+# Job Bodies
+# =============================================================================
+def job_number(body, field, kind, default=None):
+    """
+    Read an optional number of a submitted job.
+    Args:
+        body (dict): The JSON body of POST /jobs.
+        field (str): Name of the field.
+        kind (type): int or float.
+        default: Value if the field is missing or null.
+    Returns:
+        int or float: The number, or default.
+    Raises:
+        ValueError: If the field is not a JSON number of the given kind: an integer for int, any
+            finite number for float. Strings such as "5" are not converted.
+    """
+    value = body.get(field)
+    if value is None:
+        return default
+    accepted = (int,) if kind is int else (int, float)
+    # JSON true and false are parsed as bool, which would otherwise count as 1 and 0.
+    if isinstance(value, bool) or not isinstance(value, accepted):
+        raise ValueError(f"'{field}' must be {'an integer' if kind is int else 'a number'}, not {value!r}.")
+    try:
+        number = kind(value)
+        if not math.isfinite(number):
+            raise ValueError
+    except (ValueError, OverflowError):
+        raise ValueError(f"'{field}' must be a finite number, not {value!r}.") from None
+    return number
+
+
+def job_bool(body, field, default=None):
+    """
+    Read an optional flag of a submitted job.
+    Args:
+        body (dict): The JSON body of POST /jobs.
+        field (str): Name of the field.
+        default: Value if the field is missing or null.
+    Returns:
+        bool: The flag, or default.
+    Raises:
+        ValueError: If the field is not JSON true, false or null; strings such as "false" are not converted.
+    """
+    value = body.get(field)
+    if value is None:
+        return default
+    if not isinstance(value, bool):
+        raise ValueError(f"'{field}' must be true or false, not {value!r}.")
+    return value
+
+
+def parse_job(body):
+    """
+    Check a submitted job and fill in the defaults.
+    Args:
+        body (dict): The JSON body of POST /jobs.
+    Returns:
+        tuple: (job type, parameters, priority)
+    Raises:
+        ValueError: If the job is invalid.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("The job must be a JSON object.")
+    job_type = body.get('type')
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"'type' must be one of {list(JOB_TYPES)}.")
+    priority = job_number(body, 'priority', int, 0)
+    video = body.get('video')
+    if video is not None and not isinstance(video, str):
+        raise ValueError(f"'video' must be a path, not {video!r}.")
+    if job_type == 'analysis':
+        if not video:
+            raise ValueError("An analysis job needs a 'video'.")
+        video = video if os.path.isabs(video) else os.path.join(BASE_DIR, video)
+        if not os.path.isfile(video):
+            raise ValueError(f"Video not found: {video}")
+        params = {
+            'video': video,
+            'frame_step': job_number(body, 'frame_step', int, config.FRAME_STEP),
+            'use_cache': job_bool(body, 'use_cache', True),
+            'adaptive': job_bool(body, 'adaptive'),
+            'start': job_number(body, 'start', float),
+            'end': job_number(body, 'end', float),
+            'resume': job_bool(body, 'resume', False),
+        }
+        if params['frame_step'] < 1:
+            raise ValueError("'frame_step' must be at least 1.")
+        if params['start'] is not None and params['start'] < 0:
+            raise ValueError("'start' must not be negative.")
+        if params['end'] is not None and params['end'] <= (params['start'] or 0):
+            raise ValueError("'end' must be after 'start'." if params['start'] else "'end' must be greater than 0.")
+    else:
+        sheet = body.get('sheet') or ""
+        if not isinstance(sheet, str):
+            raise ValueError(f"'sheet' must be a file name, not {sheet!r}.")
+        if not sheet and video:
+            sheet = f"{os.path.splitext(os.path.basename(video))[0]}_emotional_analysis.parquet"
+        params = {'sheet': sheet, 'fps': job_number(body, 'fps', float)}
+        if params['fps'] is not None and params['fps'] <= 0:
+            raise ValueError("'fps' must be greater than 0.")
+    return job_type, params, priority
+
+
+def run_analysis_job(params, pool):
+    """
+    Analyse one video with the service's pool and export its result file.
+    Returns:
+        dict: The result file, the number of frames, the duration, the time of each stage and the
+        median and 95th percentile of the latencies.
+    """
+    start = time.perf_counter()
+    metrics = Metrics("job")
+    time_range = (params['start'], params['end']) if params['start'] is not None or params['end'] is not None else None
+    df = analysis.analyse_video(params['video'], params['frame_step'], params['use_cache'], params['resume'],
+                                params['adaptive'], time_range, pool=pool, metrics=metrics)
+    if df is None:
+        raise RuntimeError("No frame of the video could be analysed; see the log.")
+    source = os.path.splitext(os.path.basename(params['video']))[0]
+    result_file = analysis.results_file(source)
+    analysis.export_results(result_file, analysis.default_export_formats(), metrics)
+    stages = metrics.summary()['stages']
+    return {
+        'output': result_file,
+        'frames': len(df),
+        'seconds': round(time.perf_counter() - start, 3),
+        'stages': {stage: round(stats['total'], 3) for stage, stats in stages.items() if stage not in LATENCY_STAGES},
+        'latencies': {stage: {'p50': round(stats['p50'], 3), 'p95': round(stats['p95'], 3)}
+                      for stage, stats in stages.items() if stage in LATENCY_STAGES},
+    }
+
+
+def run_visualisation_job(params):
+    """
+    Create the plot and animation of one result file, or of all per-video files without a sheet.
+    Returns:
+        dict: The animation files that were written (one per face for files with several faces) and
+        the duration.
+    """
+    import visualisation
+    start_time = time.time()
+    animations = visualisation.run_visualisation(sheet=params['sheet'], fps=params['fps'])
+    # run_visualisation reports its errors by printing them, so the written animations are the proof of success.
+    if params['sheet'] and not animations:
+        raise RuntimeError("The animation was not created; see the output of the service.")
+    return {'outputs': animations, 'seconds': round(time.time() - start_time, 3)}
+
+
+# =============================================================================
+# Service
+# =============================================================================
+class AnalysisService:
+    """
+    Starts the queued jobs within the concurrency limits and answers the HTTP requests.
+    """
+
+    def __init__(self, queue, pool):
+        """
+        Args:
+            queue (JobQueue): The persistent job queue.
+            pool (multiprocessing.Pool): The running pool of analysis processes from analysis.create_pool.
+        """
+        self.queue = queue
+        self.pool = pool
+        self.limits = {'analysis': config.DAEMON_MAX_ANALYSIS_JOBS, 'visualisation': config.DAEMON_MAX_VISUALISATION_JOBS}
+        self.running = Counter()
+        self.busy_videos = set()
+        self.wakeup = None
+
+    async def dispatch(self):
+        """Start queued jobs whenever a job was submitted or a running job finished."""
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while True:
+                free_types = [job_type for job_type in JOB_TYPES if self.running[job_type] < self.limits[job_type]]
+                job = self.queue.next_job(free_types, self.busy_videos)
+                if job is None:
+                    break
+                self.start_job(job)
+
+    def start_job(self, job):
+        """
+        Run a job in its own thread. The threads are daemon threads, so a job that is running when the
+        service stops does not keep the process alive; it is queued again at the next start.
+        """
+        self.running[job['type']] += 1
+        if job['type'] == 'analysis':
+            self.busy_videos.add(job['params']['video'])
+        self.queue.update(job, status='running', started=time.time())
+        logging.info(f"Starting job {job['id']} ({job['type']}, priority {job['priority']}).")
+        if job['type'] == 'analysis':
+            body, args = run_analysis_job, (dict(job['params']), self.pool)
+        else:
+            body, args = run_visualisation_job, (dict(job['params']),)
+        loop = asyncio.get_running_loop()
+
+        def run():
+            try:
+                result, error = body(*args), None
+            except Exception as e:
+                result, error = None, e
+            try:
+                loop.call_soon_threadsafe(self.finish_job, job, result, error)
+            except RuntimeError:
+                pass  # The service has stopped.
+
+        threading.Thread(target=run, name=f"job-{job['id']}", daemon=True).start()
+
+    def finish_job(self, job, result, error):
+        """Record the result or error of a job and start the next one."""
+        self.running[job['type']] -= 1
+        self.busy_videos.discard(job['params'].get('video'))
+        if error is None:
+            self.queue.update(job, status='done', finished=time.time(), result=result)
+            logging.info(f"Job {job['id']} finished in {job['finished'] - job['started']:.2f} seconds.")
+        else:
+            self.queue.update(job, status='failed', finished=time.time(), error=str(error))
+            logging.error(f"Job {job['id']} failed: {error}")
+        self.wakeup.set()
+
+    def handle(self, method, path, body):
+        """
+        Answer one API request.
+        Returns:
+            tuple: (HTTP status code, JSON-serialisable response)
+        """
+        parts = [part for part in path.split("?")[0].split("/") if part]
+        if parts == ["health"] and method == "GET":
+            return 200, {'status': 'ok', 'pool_size': analysis.get_num_processes(), 'jobs': self.queue.counts()}
+        if parts == ["jobs"] and method == "GET":
+            return 200, {'jobs': list(self.queue.jobs.values())}
+        if parts == ["jobs"] and method == "POST":
+            try:
+                job_type, params, priority = parse_job(json.loads(body or b"{}"))
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            job = self.queue.submit(job_type, params, priority)
+            self.wakeup.set()
+            return 201, job
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self.queue.jobs.get(int(parts[1])) if parts[1].isdigit() else None
+            if job is None:
+                return 404, {'error': f"No job {parts[1]}."}
+            if method == "GET":
+                return 200, job
+            if method == "DELETE":
+                if job['status'] != 'queued':
+                    return 409, {'error': f"Job {job['id']} is {job['status']}; only queued jobs can be cancelled."}
+                self.queue.update(job, status='cancelled', finished=time.time())
+                return 200, job
+        return 404, {'error': f"Unknown request {method} {path}."}
+
+    async def handle_connection(self, reader, writer):
+        """Read one HTTP request, answer it and close the connection."""
+        status, response = 400, {'error': "Bad request."}
+        try:
+            header = await reader.readuntil(b"\r\n\r\n")
+            request_line, *header_lines = header.decode("latin-1").split("\r\n")
+            method, path, _ = request_line.split(" ", 2)
+            headers = dict(line.split(":", 1) for line in header_lines if ":" in line)
+            length = int({key.strip().lower(): value for key, value in headers.items()}.get("content-length", 0))
+            if length > MAX_REQUEST_BYTES:
+                status, response = 413, {'error': "Request too large."}
+            else:
+                body = await reader.readexactly(length) if length else b""
+                status, response = self.handle(method.upper(), path, body)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, UnicodeDecodeError):
+            pass
+        except Exception as e:
+            logging.error(f"Error while answering a request: {e}")
+            status, response = 500, {'error': str(e)}
+        payload = json.dumps(response, indent=1).encode("utf-8")
+        reason = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 409: "Conflict",
+                  413: "Payload Too Large", 500: "Internal Server Error"}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve_forever(service, host, port):
+    """Run the HTTP server and the dispatcher until the process is stopped."""
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    logging.info(f"Service listening on http://{host}:{port} with {analysis.get_num_processes()} analysis processes.")
+    print(f"Service listening on http://{host}:{port} (stop with Ctrl+C).")
+    async with server:
+        serving = asyncio.gather(server.serve_forever(), service.dispatch())
+        # SIGTERM (e.g. from a process manager) stops the service the same way as Ctrl+C.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+
+
+def run_daemon(host=None, port=None):
+    """
+    Start the analysis processes and serve the job API until interrupted.
+    Jobs that are running when the service stops are queued again at the next start.
+    Args:
+        host (str): Address to listen on; defaults to DAEMON_HOST.
+        port (int): Port to listen on; defaults to DAEMON_PORT.
+    """
+    analysis.prepare_environment()
+    queue = JobQueue(QUEUE_FILE)
+    # The processes load the models in their initializer, before the first job arrives.
+    pool = analysis.create_pool()
+    service = AnalysisService(queue, pool)
+    try:
+        asyncio.run(serve_forever(service, host or config.DAEMON_HOST, port or config.DAEMON_PORT))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Service stopped.")
+        analysis.stop_running_jobs()
+        pool.terminate()
+        pool.join()
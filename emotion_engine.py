@@ -0,0 +1,372 @@
+import cv2
+import time
+import numpy as np
+from collections import OrderedDict
+import config
+import model_registry
+from crop_cache import CropCache, hamming_distance, perceptual_hash
+from face_tracker import crop_aligned_face, start_track, track_face
+
+# =============================================================================
+# Batched Emotion Inference
+# =============================================================================
+# DeepFace.analyze runs face detection and the emotion CNN for one image at a time. This engine
+# splits both steps: the faces of a whole batch of frames are detected and preprocessed first,
+# then all crops are classified with a single call of the emotion model. The preprocessing
+# mirrors DeepFace.analyze, so the results are the same as calling it once per frame.
+# Optionally, the detector searches a scaled-down copy of each frame (see DETECT_SHORT_SIDE and
+# DETECT_SCALE); the region is scaled back and the face is cut out of the full-resolution frame, so the
+# emotion model gets the same crop quality while the detector scans far fewer pixels.
+# Up to MAX_FACES faces are analysed per frame; the crops of all faces of all frames of a batch are
+# classified together.
+
+# Labels in the order of the emotion model's outputs.
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+# Emotion scores of recent face crops of this process (see crop_cache), one cache per video, created
+# on first use and kept for the most recently analysed videos.
+_crop_caches = OrderedDict()
+
+# Face tracks of the last batch this process analysed of each video (see analyse_frames), so the
+# tracking continues into the next batch instead of starting with a detection.
+_track_states = OrderedDict()
+
+
+def get_emotion_model():
+    """
+    Return the Keras model behind DeepFace's emotion client.
+    The model is built on first use and kept by the model registry, so the weights are loaded once
+    per process.
+    """
+    return model_registry.get_model("Emotion", "facial_attribute").model
+
+
+def detection_scale(frame_shape):
+    """
+    Return the factor by which a frame is scaled down for the face detector.
+    Args:
+        frame_shape (tuple): Shape of the frame.
+    Returns:
+        float: DETECT_SCALE, or the factor that scales the short side to DETECT_SHORT_SIDE; 1.0 if
+        neither is set or the frame is already small enough.
+    """
+    if config.DETECT_SCALE:
+        scale = config.DETECT_SCALE
+    elif config.DETECT_SHORT_SIDE:
+        scale = config.DETECT_SHORT_SIDE / min(frame_shape[:2])
+    else:
+        return 1.0
+    return min(1.0, scale)
+
+
+def rescale_region(facial_area, scale, frame_shape):
+    """
+    Map a face region found on a scaled-down copy back to the full-resolution frame.
+    Args:
+        facial_area (dict): Region with 'x', 'y', 'w', 'h', 'left_eye' and 'right_eye' on the copy.
+        scale (float): Factor by which the copy was scaled down.
+        frame_shape (tuple): Shape of the full-resolution frame.
+    Returns:
+        dict: The region on the full-resolution frame, with the same border handling as DeepFace.extract_faces.
+    """
+    height, width = frame_shape[:2]
+    x = max(0, int(round(facial_area['x'] / scale)))
+    y = max(0, int(round(facial_area['y'] / scale)))
+    eyes = {
+        eye: None if facial_area.get(eye) is None else (int(round(facial_area[eye][0] / scale)), int(round(facial_area[eye][1] / scale)))
+        for eye in ('left_eye', 'right_eye')
+    }
+    return {
+        'x': x,
+        'y': y,
+        'w': min(width - x - 1, int(round(facial_area['w'] / scale))),
+        'h': min(height - y - 1, int(round(facial_area['h'] / scale))),
+        **eyes,
+    }
+
+
+def detect_faces(frame, backend, max_faces=None):
+    """
+    Detect and align the faces of a frame, as DeepFace.analyze does.
+    If no face is found, the whole frame is returned as the only face with a confidence of 0.
+    With DETECT_SHORT_SIDE or DETECT_SCALE, the detector runs on a scaled-down copy of the frame and
+    the aligned faces are cut out of the full-resolution frame.
+    Args:
+        frame (np.ndarray): BGR frame.
+        backend (str): DeepFace detector backend.
+        max_faces (int): Maximum number of faces, in the detector's order; defaults to MAX_FACES.
+            0 returns all faces.
+    Returns:
+        list: DeepFace face objects with 'face' (RGB, 0..1), 'facial_area' and 'confidence'; empty
+        faces are left out.
+    """
+    # DeepFace (and with it TensorFlow) is only imported by the processes that analyse frames.
+    from deepface import DeepFace
+    if max_faces is None:
+        max_faces = config.MAX_FACES
+    faces = []
+    scale = detection_scale(frame.shape)
+    if scale < 1.0:
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # The copy is not aligned: only its region and eyes are used, the face is aligned on the full frame.
+        face_objs = DeepFace.extract_faces(
+            img_path=small,
+            detector_backend=backend,
+            enforce_detection=False,
+            align=False
+        )
+        for face_obj in face_objs:
+            area = rescale_region(face_obj['facial_area'], scale, frame.shape)
+            if area['w'] > 0 and area['h'] > 0:
+                faces.append({'face': crop_aligned_face(frame, area), 'facial_area': area, 'confidence': face_obj['confidence']})
+            if max_faces and len(faces) >= max_faces:
+                break
+        return faces
+    face_objs = DeepFace.extract_faces(
+        img_path=frame,
+        detector_backend=backend,
+        enforce_detection=False,
+        align=True
+    )
+    for face_obj in face_objs:
+        if face_obj['face'].shape[0] > 0 and face_obj['face'].shape[1] > 0:
+            faces.append(face_obj)
+        if max_faces and len(faces) >= max_faces:
+            break
+    return faces
+
+
+def detect_face(frame, backend):
+    """
+    Detect and align the first face of a frame (see detect_faces).
+    Returns:
+        dict: DeepFace face object, or None if the detected face is empty.
+    """
+    faces = detect_faces(frame, backend, max_faces=1)
+    return faces[0] if faces else None
+
+
+def preprocess_face(face):
+    """
+    Turn a detected RGB face crop into the 48x48 grayscale input of the emotion model.
+    Args:
+        face (np.ndarray): RGB face crop with values in 0..1, as returned by DeepFace.extract_faces.
+    Returns:
+        np.ndarray: Array of shape (48, 48).
+    """
+    from deepface.modules import preprocessing
+    # Same steps as DeepFace.analyze followed by the emotion client's predict.
+    img = preprocessing.resize_image(img=face[:, :, ::-1], target_size=(224, 224))
+    img_gray = cv2.cvtColor(img[0], cv2.COLOR_BGR2GRAY)
+    return cv2.resize(img_gray, (48, 48))
+
+
+def classify_faces(crops, model=None):
+    """
+    Classify a batch of preprocessed face crops in one model call.
+    Args:
+        crops (list): Arrays of shape (48, 48) from preprocess_face.
+        model: The emotion model; defaults to get_emotion_model().
+    Returns:
+        list: One dict per crop mapping each emotion label to its score in percent.
+    """
+    if not crops:
+        return []
+    if model is None:
+        model = get_emotion_model()
+    batch = np.stack(crops).astype(np.float32)[..., np.newaxis]
+    # Calling the model directly, like DeepFace's emotion client does, instead of predict(): it has
+    # less overhead per call and does not hang in worker processes forked after TensorFlow was loaded.
+    predictions = model(batch, training=False).numpy()
+    predictions = 100 * predictions / predictions.sum(axis=1, keepdims=True)
+    return [
+        {label: float(score) for label, score in zip(EMOTION_LABELS, row)}
+        for row in predictions
+    ]
+
+
+def get_crop_cache(key=None):
+    """
+    Return the face crop cache of one video in this process, or None if USE_CROP_CACHE is off.
+    Scores are only reused within a video: the pool is shared by several videos, and a similar face
+    in another video would otherwise take over scores that depend on which process analysed it.
+    The caches of the MAX_CONCURRENT_VIDEOS most recently analysed videos are kept.
+    Args:
+        key: Identifies the video, e.g. the job key of the scheduler.
+    """
+    if not config.USE_CROP_CACHE:
+        return None
+    cache = _crop_caches.pop(key, None)
+    if cache is None:
+        cache = CropCache()
+    _crop_caches[key] = cache
+    while len(_crop_caches) > max(1, config.MAX_CONCURRENT_VIDEOS):
+        _crop_caches.popitem(last=False)
+    return cache
+
+
+def classify_faces_cached(crops, cache=None):
+    """
+    Classify a batch of preprocessed face crops, reusing the scores of near-duplicate crops.
+    Crops that match a cached crop, or an earlier crop of the same batch, are not passed to the model.
+    Args:
+        crops (list): Arrays of shape (48, 48) from preprocess_face.
+        cache (CropCache): Cache of earlier crops; without a cache every crop is classified.
+    Returns:
+        tuple: (one dict of scores per crop, one flag per crop that is True if its scores were reused)
+    """
+    if cache is None:
+        return classify_faces(crops), [False] * len(crops)
+    hashes = [perceptual_hash(crop) for crop in crops]
+    emotions = [None] * len(crops)
+    reused = [False] * len(crops)
+    misses = []
+    duplicates = {}  # Index of a crop -> index of the earlier crop of this batch it duplicates
+    for i, crop_hash in enumerate(hashes):
+        cached = cache.find(crop_hash)
+        if cached is not None:
+            emotions[i], reused[i] = cached, True
+            continue
+        match = next((j for j in misses if hamming_distance(crop_hash, hashes[j]) <= cache.max_distance), None)
+        if match is None:
+            misses.append(i)
+        else:
+            duplicates[i] = match
+    for i, scores in zip(misses, classify_faces([crops[i] for i in misses])):
+        emotions[i] = scores
+        cache.add(hashes[i], scores)
+    for i, j in duplicates.items():
+        emotions[i], reused[i] = emotions[j], True
+    return emotions, reused
+
+
+def track_faces(frame, tracks):
+    """
+    Find all tracked faces in the next frame.
+    Returns:
+        list or None: One face object per track (see face_tracker.track_face), or None if any face was lost.
+    """
+    face_objs = []
+    for track in tracks:
+        face_obj = track_face(frame, track)
+        if face_obj is None:
+            return None
+        face_objs.append(face_obj)
+    return face_objs
+
+
+def continue_tracks(cache_key, frames):
+    """
+    Take the face tracks this process left at the end of its last batch of a video, if the batch
+    continues that batch directly: its first frame is at most the largest frame distance of the last
+    batch after the last frame. Otherwise another process analysed the frames in between and the
+    faces may have moved, so the detector runs first.
+    Args:
+        cache_key: Identifies the video, e.g. the job key of the scheduler; None never continues.
+        frames (list): (frame_number, frame) pairs of the new batch.
+    Returns:
+        tuple: (tracks or None, number of frames since the last detection)
+    """
+    state = _track_states.pop(cache_key, None)
+    if state is None or cache_key is None or not frames:
+        return None, 0
+    if not 0 < frames[0][0] - state['last_frame'] <= state['max_step']:
+        return None, 0
+    return state['tracks'], state['frames_since_detection']
+
+
+def keep_tracks(cache_key, frames, tracks, frames_since_detection):
+    """Remember the face tracks at the end of a batch for the next batch of the video (see continue_tracks)."""
+    if cache_key is None or tracks is None or not frames:
+        return
+    frame_numbers = [frame_number for frame_number, _ in frames]
+    steps = [b - a for a, b in zip(frame_numbers, frame_numbers[1:])]
+    _track_states[cache_key] = {
+        'tracks': tracks,
+        'frames_since_detection': frames_since_detection,
+        'last_frame': frame_numbers[-1],
+        'max_step': max(steps, default=1),
+    }
+    while len(_track_states) > max(1, config.MAX_CONCURRENT_VIDEOS):
+        _track_states.popitem(last=False)
+
+
+def analyse_frames(frames, backend, timings=None, cache_key=None):
+    """
+    Analyse a batch of consecutive frames: find up to MAX_FACES faces per frame, then classify the
+    faces of all frames together.
+    The detector runs every DETECT_EVERY_N_FRAMES frames or when the tracker loses one of the faces;
+    in between, the faces are tracked (see face_tracker). The tracks continue from the previous batch
+    of the video if this process analysed it (see continue_tracks); otherwise the detector runs on
+    the first frame of the batch.
+    Args:
+        frames (list): (frame_number, frame) pairs in frame order.
+        backend (str): DeepFace detector backend.
+        timings (Counter): Optional; receives the seconds spent on 'detect' (detection and tracking),
+            'preprocess' and 'classify'.
+        cache_key: Identifies the video for the face crop cache and the face tracks (see get_crop_cache).
+    Returns:
+        list: One (analyses, error) pair per frame in input order. analyses is a list with one dict
+        per face, with the keys of DeepFace.analyze ('emotion', 'dominant_emotion', 'region',
+        'face_confidence') plus 'frame_number', 'region_source' ('detector' or 'tracker') and
+        'emotion_cached' (True if the scores were reused from a near-duplicate face crop); it is None
+        and error is a message if the frame could not be analysed.
+    """
+    detect_every = max(1, config.DETECT_EVERY_N_FRAMES)
+    outputs = [None] * len(frames)
+    crops = []
+    pending = []
+    tracks, frames_since_detection = continue_tracks(cache_key, frames) if detect_every > 1 else (None, 0)
+    detect_time = preprocess_time = 0.0
+    for i, (frame_number, frame) in enumerate(frames):
+        stage_start = time.perf_counter()
+        face_objs = None
+        region_source = 'tracker'
+        if tracks is not None and frames_since_detection < detect_every:
+            face_objs = track_faces(frame, tracks)
+        if face_objs is None:
+            region_source = 'detector'
+            try:
+                face_objs = detect_faces(frame, backend)
+            except Exception as e:
+                outputs[i] = (None, f'Error in face detection in frame {frame_number} with {backend}: {e}')
+                tracks = None
+                detect_time += time.perf_counter() - stage_start
+                continue
+            frames_since_detection = 0
+            tracks = None
+            if face_objs and detect_every > 1:
+                tracks = [start_track(frame, face_obj) for face_obj in face_objs]
+                # Frames without a usable face are detected again.
+                if None in tracks:
+                    tracks = None
+        frames_since_detection += 1
+        detected = time.perf_counter()
+        detect_time += detected - stage_start
+        if not face_objs:
+            outputs[i] = (None, f'No face region in frame {frame_number}.')
+            continue
+        outputs[i] = ([], None)
+        for face_obj in face_objs:
+            crops.append(preprocess_face(face_obj['face']))
+            pending.append((i, frame_number, face_obj, region_source))
+        preprocess_time += time.perf_counter() - detected
+    keep_tracks(cache_key, frames, tracks, frames_since_detection)
+
+    classify_start = time.perf_counter()
+    emotions_per_crop, reused = classify_faces_cached(crops, get_crop_cache(cache_key))
+    if timings is not None:
+        timings['detect'] += detect_time
+        timings['preprocess'] += preprocess_time
+        timings['classify'] += time.perf_counter() - classify_start
+    for (i, frame_number, face_obj, region_source), emotions, cached in zip(pending, emotions_per_crop, reused):
+        outputs[i][0].append({
+            'emotion': emotions,
+            'dominant_emotion': max(emotions, key=emotions.get),
+            'region': face_obj['facial_area'],
+            'face_confidence': face_obj['confidence'],
+            'region_source': region_source,
+            'emotion_cached': cached,
+            'frame_number': frame_number
+        })
+    return outputs
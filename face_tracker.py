@@ -0,0 +1,227 @@
+import cv2
+import numpy as np
+import config
+
+# =============================================================================
+# Face Tracking Between Detections
+# =============================================================================
+# The subject of a pitch video barely moves, so the face detector does not have to run on every
+# frame. After a detection, the face is followed through the next frames by matching its grayscale
+# template inside a small search window around the previous region. The detector runs again after
+# DETECT_EVERY_N_FRAMES sampled frames or as soon as the match score drops below
+# TRACKER_MIN_CONFIDENCE.
+# With several faces per frame (MAX_FACES), every face gets an ID that stays the same across frames:
+# a face continues the face of the previous frames whose region overlaps it most (intersection over
+# union of at least FACE_ID_MIN_IOU). A face that has not been seen for FACE_ID_MAX_GAP analysed
+# frames is forgotten, and a face that matches no earlier face gets a new ID.
+
+# Face ID of the rows of frames in which no face was found.
+NO_FACE_ID = -1
+
+
+def start_track(frame, face_obj):
+    """
+    Start tracking a detected face.
+    Args:
+        frame (np.ndarray): BGR frame the face was detected in.
+        face_obj (dict): DeepFace face object with 'facial_area' and 'confidence'.
+    Returns:
+        dict or None: Tracking state, or None if there is no usable face to track.
+    """
+    area = face_obj['facial_area']
+    x, y, w, h = area['x'], area['y'], area['w'], area['h']
+    # A confidence of 0 means that no face was found and the region is the whole frame.
+    if face_obj['confidence'] <= 0 or w <= 0 or h <= 0:
+        return None
+    template = cv2.cvtColor(frame[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+    if template.size == 0:
+        return None
+    return {'template': template, 'facial_area': dict(area), 'confidence': face_obj['confidence']}
+
+
+def track_face(frame, track):
+    """
+    Find the tracked face in the next frame.
+    Args:
+        frame (np.ndarray): BGR frame.
+        track (dict): Tracking state from start_track; its region is updated on success.
+    Returns:
+        dict or None: Face object like the detector's ('face', 'facial_area', 'confidence' of the
+        last detection) plus 'tracking_score', or None if the face was lost.
+    """
+    area = track['facial_area']
+    x, y, w, h = area['x'], area['y'], area['w'], area['h']
+    height, width = frame.shape[:2]
+    margin = int(max(w, h) * config.TRACKER_SEARCH_MARGIN)
+    x0, y0 = max(0, x - margin), max(0, y - margin)
+    x1, y1 = min(width, x + w + margin), min(height, y + h + margin)
+    if x1 - x0 < w or y1 - y0 < h:
+        return None
+
+    window = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    scores = cv2.matchTemplate(window, track['template'], cv2.TM_CCOEFF_NORMED)
+    _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+    if score < config.TRACKER_MIN_CONFIDENCE:
+        return None
+
+    # Move the region and the eyes by the same offset.
+    shift_x, shift_y = x0 + dx - x, y0 + dy - y
+    new_area = {
+        'x': x + shift_x,
+        'y': y + shift_y,
+        # Same border handling as DeepFace.extract_faces.
+        'w': min(width - (x + shift_x) - 1, w),
+        'h': min(height - (y + shift_y) - 1, h),
+        'left_eye': None if area['left_eye'] is None else (area['left_eye'][0] + shift_x, area['left_eye'][1] + shift_y),
+        'right_eye': None if area['right_eye'] is None else (area['right_eye'][0] + shift_x, area['right_eye'][1] + shift_y),
+    }
+    track['facial_area'] = new_area
+    return {
+        'face': crop_aligned_face(frame, new_area),
+        'facial_area': new_area,
+        'confidence': track['confidence'],
+        'tracking_score': float(score),
+    }
+
+
+def crop_aligned_face(frame, facial_area):
+    """
+    Cut a face out of a frame the way DeepFace.extract_faces does: rotated so that the eyes are
+    level, in RGB with values in 0..1. Only a patch around the face is rotated, not the whole frame.
+    Args:
+        frame (np.ndarray): BGR frame.
+        facial_area (dict): Region with 'x', 'y', 'w', 'h', 'left_eye' and 'right_eye'.
+    Returns:
+        np.ndarray: The face crop.
+    """
+    x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
+    left_eye, right_eye = facial_area['left_eye'], facial_area['right_eye']
+    if left_eye is None or right_eye is None:
+        face = frame[y:y + h, x:x + w]
+    else:
+        angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+        # Square patch around the face centre that contains the face at any rotation; parts outside
+        # the frame are black, like the border DeepFace adds before aligning.
+        radius = int(np.ceil(np.hypot(w, h) / 2)) + 1
+        cx, cy = x + w // 2, y + h // 2
+        patch = np.zeros((2 * radius, 2 * radius, 3), dtype=frame.dtype)
+        fx0, fy0 = max(0, cx - radius), max(0, cy - radius)
+        fx1, fy1 = min(frame.shape[1], cx + radius), min(frame.shape[0], cy + radius)
+        patch[fy0 - (cy - radius):fy1 - (cy - radius), fx0 - (cx - radius):fx1 - (cx - radius)] = frame[fy0:fy1, fx0:fx1]
+        rotation = cv2.getRotationMatrix2D((radius, radius), angle, 1.0)
+        patch = cv2.warpAffine(patch, rotation, (2 * radius, 2 * radius), flags=cv2.INTER_CUBIC)
+        face = patch[radius - h // 2:radius - h // 2 + h, radius - w // 2:radius - w // 2 + w]
+    return face[:, :, ::-1] / 255
+
+
+def region_iou(a, b):
+    """
+    Intersection over union of two face regions.
+    Args:
+        a, b (tuple): Regions as (x, y, w, h).
+    Returns:
+        float: The overlap from 0 (disjoint) to 1 (identical).
+    """
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class FaceIdTracker:
+    """
+    Assigns stable IDs to the faces of consecutive analysed frames by the overlap of their regions.
+    """
+
+    def __init__(self, min_iou=None, max_gap=None):
+        """
+        Args:
+            min_iou (float): Minimum intersection over union for a face to continue an earlier face;
+                defaults to FACE_ID_MIN_IOU.
+            max_gap (int): Number of analysed frames after which a face that was not seen is forgotten;
+                defaults to FACE_ID_MAX_GAP.
+        """
+        self.min_iou = config.FACE_ID_MIN_IOU if min_iou is None else min_iou
+        self.max_gap = config.FACE_ID_MAX_GAP if max_gap is None else max_gap
+        self.faces = {}  # Face ID -> (last region, number of the analysed frame it was last seen in)
+        self.next_id = 0
+        self.frame_index = 0
+
+    def update(self, regions):
+        """
+        Assign the IDs of the faces of the next analysed frame.
+        Args:
+            regions (list): One region (x, y, w, h) per face, or None for a row without a face.
+        Returns:
+            list: The face ID of each region; NO_FACE_ID for None.
+        """
+        self.frame_index += 1
+        for face_id in [face_id for face_id, (_, seen) in self.faces.items() if self.frame_index - seen > self.max_gap]:
+            del self.faces[face_id]
+        # Greedy matching: the pairs with the largest overlap are matched first.
+        pairs = sorted(
+            ((region_iou(region, last), i, face_id)
+             for i, region in enumerate(regions) if region is not None
+             for face_id, (last, _) in self.faces.items()),
+            reverse=True
+        )
+        ids = [NO_FACE_ID] * len(regions)
+        matched = set()
+        for iou, i, face_id in pairs:
+            if iou < self.min_iou:
+                break
+            if ids[i] == NO_FACE_ID and face_id not in matched:
+                ids[i] = face_id
+                matched.add(face_id)
+        for i, region in enumerate(regions):
+            if region is None:
+                continue
+            if ids[i] == NO_FACE_ID:
+                ids[i] = self.next_id
+                self.next_id += 1
+            self.faces[ids[i]] = (region, self.frame_index)
+        return ids
+
+
+def face_regions(df):
+    """
+    Read the face regions of result rows.
+    Args:
+        df (DataFrame): Results with 'face_confidence' and the region columns.
+    Returns:
+        list: (x, y, w, h) per row, or None for rows without a detected face.
+    """
+    columns = ['region_x', 'region_y', 'region_w', 'region_h']
+    values = df[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    confidence = df['face_confidence'].to_numpy(dtype=np.float64, na_value=np.nan)
+    # A confidence of 0 means that no face was found and the region is the whole frame.
+    valid = (confidence > 0) & ~np.isnan(values).any(axis=1) & (values[:, 2] > 0) & (values[:, 3] > 0)
+    return [tuple(row) if ok else None for row, ok in zip(values.tolist(), valid)]
+
+
+def assign_face_ids(df, tracker=None):
+    """
+    Assign a face ID to every result row, in frame order.
+    Rows without a detected face get NO_FACE_ID in every mode. With MAX_FACES = 1 there is at most
+    one face per frame, and every face gets the ID 0.
+    Args:
+        df (DataFrame): Results with 'frame_number', 'face_confidence' and the region columns.
+        tracker (FaceIdTracker): Tracker to continue, e.g. of a live stream; a new one by default.
+    Returns:
+        np.ndarray: The face ID of each row, in the order of df; NO_FACE_ID for rows without a face.
+    """
+    if df.empty:
+        return np.zeros(0, dtype=np.int32)
+    regions = face_regions(df)
+    if config.MAX_FACES == 1:
+        return np.array([NO_FACE_ID if region is None else 0 for region in regions], dtype=np.int32)
+    ids = np.full(len(df), NO_FACE_ID, dtype=np.int32)
+    tracker = tracker or FaceIdTracker()
+    frame_numbers = df['frame_number'].to_numpy()
+    order = np.argsort(frame_numbers, kind='stable')
+    # The rows of one frame are consecutive in frame order.
+    boundaries = np.flatnonzero(np.diff(frame_numbers[order])) + 1
+    for rows in np.split(order, boundaries):
+        ids[rows] = tracker.update([regions[row] for row in rows])
+    return ids
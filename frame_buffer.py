@@ -0,0 +1,156 @@
+import os
+import sys
+import queue
+import shutil
+import logging
+import numpy as np
+from collections import OrderedDict, namedtuple
+from multiprocessing import resource_tracker, shared_memory
+import config
+
+# =============================================================================
+# Shared-Memory Frame Ring Buffer
+# =============================================================================
+# Instead of pickling every decoded frame into the worker processes, the decoder writes the frames
+# into fixed slots of one shared memory block. The workers only receive a small SlotRef (block name,
+# frame shape and slot index), read the frame in place and hand the slot index back with their result.
+
+# Number of shared memory blocks a worker keeps attached: one per video that is decoded at the same
+# time, plus room for the next ones. Older blocks belong to videos that have already finished and
+# are detached to free their mapping.
+MAX_ATTACHED_BLOCKS = config.MAX_CONCURRENT_VIDEOS + 2
+
+# Shared memory blocks attached by this (worker) process, keyed by block name.
+_attached_blocks = OrderedDict()
+
+
+# Picklable reference to one frame slot of a FrameRingBuffer.
+SlotRef = namedtuple("SlotRef", ["name", "shape", "slot"])
+
+
+class FrameRingBuffer:
+    """
+    Fixed number of uint8 frame slots in one shared memory block.
+    The free slots are kept in a queue: acquire() blocks until a slot is free, which gives the
+    decoder its backpressure, and release() hands a slot back once a worker is done with it.
+    """
+
+    def __init__(self, num_slots, frame_shape):
+        """
+        Args:
+            num_slots (int): Number of frames that can be in flight at the same time.
+            frame_shape (tuple): Shape of the decoded frames, e.g. (1080, 1920, 3).
+        """
+        self.num_slots = num_slots
+        self.frame_shape = tuple(frame_shape)
+        self.slot_nbytes = int(np.prod(self.frame_shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.slot_nbytes)
+        self.free_slots = queue.Queue()
+        for slot in range(self.num_slots):
+            self.free_slots.put(slot)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def fits(self, frame):
+        """Return True if the frame can be stored in a slot of this buffer."""
+        return frame.dtype == np.uint8 and frame.shape == self.frame_shape
+
+    def acquire(self, stop_event=None, timeout=0.5):
+        """
+        Wait for a free slot.
+        Args:
+            stop_event (threading.Event): Optional event that aborts the wait.
+            timeout (float): Interval in seconds in which the stop event is checked.
+        Returns:
+            int or None: The slot index, or None if the wait was aborted.
+        """
+        while True:
+            try:
+                return self.free_slots.get(timeout=timeout)
+            except queue.Empty:
+                if stop_event is not None and stop_event.is_set():
+                    return None
+
+    def release(self, slot):
+        """Hand a slot back to the decoder."""
+        self.free_slots.put(slot)
+
+    def write(self, slot, frame):
+        """
+        Copy a frame into a slot.
+        Returns:
+            SlotRef: The reference to send to the worker instead of the frame.
+        """
+        view = np.ndarray(self.frame_shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_nbytes)
+        view[...] = frame
+        del view
+        return SlotRef(self.name, self.frame_shape, slot)
+
+    def close(self):
+        """Release and remove the shared memory block."""
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def create_ring_buffer(num_slots, frame_shape):
+    """
+    Create a FrameRingBuffer if the platform has room for it.
+    On Linux the shared memory lives in /dev/shm, which is small in many containers; writing past
+    its size crashes the process, so the free space is checked first.
+    Args:
+        num_slots (int): Number of frame slots.
+        frame_shape (tuple): Shape of the decoded frames.
+    Returns:
+        FrameRingBuffer or None: The buffer, or None if the frames have to be pickled instead.
+    """
+    required = num_slots * int(np.prod(frame_shape))
+    if required <= 0:
+        return None
+    if sys.platform.startswith("linux") and os.path.isdir("/dev/shm"):
+        free = shutil.disk_usage("/dev/shm").free
+        if free < required:
+            logging.warning(
+                f"Not enough space in /dev/shm for the frame buffer ({required / 1e6:.0f} MB needed, "
+                f"{free / 1e6:.0f} MB free); frames are copied to the workers instead."
+            )
+            return None
+    try:
+        return FrameRingBuffer(num_slots, frame_shape)
+    except OSError as e:
+        logging.warning(f"Could not create the shared frame buffer ({e}); frames are copied to the workers instead.")
+        return None
+
+
+def resolve_frame(frame_ref):
+    """
+    Worker side: turn a task's frame reference into an ndarray.
+    Args:
+        frame_ref (np.ndarray or SlotRef): Either the frame itself or a reference to a buffer slot.
+    Returns:
+        np.ndarray: The frame. For a SlotRef this is a view on the shared memory, valid until the
+        slot has been handed back.
+    """
+    if not isinstance(frame_ref, SlotRef):
+        return frame_ref
+    shm = _attached_blocks.get(frame_ref.name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=frame_ref.name)
+        # Attaching registers the block with the resource tracker as if this process owned it, which
+        # makes the tracker try to remove it again at shutdown. The decoder owns and removes it.
+        resource_tracker.unregister(shm._name, "shared_memory")
+        _attached_blocks[frame_ref.name] = shm
+        while len(_attached_blocks) > MAX_ATTACHED_BLOCKS:
+            _, old = _attached_blocks.popitem(last=False)
+            try:
+                old.close()
+            except BufferError:
+                pass
+    else:
+        _attached_blocks.move_to_end(frame_ref.name)
+    slot_nbytes = int(np.prod(frame_ref.shape))
+    return np.ndarray(frame_ref.shape, dtype=np.uint8, buffer=shm.buf, offset=frame_ref.slot * slot_nbytes)
@@ -1,8 +1,6 @@
 import os
 import argparse
 import warnings
-from analysis import run_analysis
-from visualisation import run_visualisation
 import config
 
 # Suppress Python deprecation warnings.
@@ -12,6 +10,61 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '2'
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # '3' hides INFO, WARNING & ERROR
 
+def load_command(command):
+    """
+    Import the module of a command only when it runs, so e.g. the visualisation does not import the
+    analysis modules and OpenCV. DeepFace and TensorFlow are only loaded by the analysis processes.
+    Args:
+        command (str): 'analysis', 'visualisation', 'plan', 'shard', 'merge', 'serve', 'watch' or 'stream'.
+    Returns:
+        function: run_analysis, run_visualisation or the function of the shard, serve, watch or stream command.
+    """
+    if command == "analysis":
+        from analysis import run_analysis
+        return run_analysis
+    if command == "serve":
+        from daemon import run_daemon
+        return run_daemon
+    if command == "watch":
+        from watcher import run_watch
+        return run_watch
+    if command == "stream":
+        from stream import run_stream
+        return run_stream
+    if command in ("plan", "shard", "merge"):
+        import shards
+        return {"plan": shards.run_plan, "shard": run_shard_command, "merge": shards.merge_shards}[command]
+    from visualisation import run_visualisation
+    return run_visualisation
+
+def run_shard_command(shard_id=None, manifest_path=None, parallel=1, resume=False):
+    """
+    Run one shard of the manifest, or all shards as separate local processes if no shard is given.
+    Exits with code 1 if a shard failed.
+    """
+    import shards
+    manifest_path = manifest_path or shards.MANIFEST_FILE
+    if shard_id is None:
+        ok = shards.run_shards_locally(manifest_path, parallel=parallel, resume=resume)
+    else:
+        ok = shards.run_shard(shard_id, manifest_path, resume=resume)
+    if not ok:
+        raise SystemExit(1)
+
+def run_command(command, profiler=None, **kwargs):
+    """
+    Run a command, optionally under a profiler (see metrics.run_profiled).
+    Args:
+        command (str): 'analysis', 'visualisation', 'plan', 'shard', 'merge', 'serve', 'watch' or 'stream'.
+        profiler (str): None, 'cprofile' or 'pyinstrument'.
+        **kwargs: Arguments of the command's run function.
+    """
+    function = load_command(command)
+    if profiler is None:
+        return function(**kwargs)
+    from metrics import run_profiled
+    return run_profiled(function, profiler, config.METRICS_DIR, command, **kwargs)
+
 def main():
     """
     Main function to run the Video Emotion Analysis and Visualisation Tool.
@@ -22,33 +75,122 @@ def main():
     )
     
     # Command to choose analysis or visualisation.
-    parser.add_argument("command", nargs="?", choices=["analysis", "visualisation"], default=None,
-                        help="Specify whether to run 'analysis', 'visualisation', or leave empty to run both.")
+    parser.add_argument("command", nargs="?", choices=["analysis", "visualisation", "plan", "shard", "merge", "serve", "watch", "stream"],
+                        default=None,
+                        help="Specify whether to run 'analysis', 'visualisation', or leave empty to run both. "
+                             "'plan', 'shard' and 'merge' split the analysis into shards, run them and merge their results. "
+                             "'serve' starts the job service; 'watch' analyses new or changed videos in the videos folder as they arrive; "
+                             "'stream' analyses a live source in real time.")
     
     # Frame step argument for analysis.
     parser.add_argument("--frame_step", type=int, default=config.FRAME_STEP,
                         help="Analyze every n-th frame (default is as set in config.py).")
     
+    # Bypass the analysis cache.
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Analyse all videos again instead of reusing cached results of unchanged videos.")
+    
+    # Resume interrupted analyses.
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue interrupted analyses from their checkpoints instead of starting from the first frame.")
+    
+    # Time range of the analysis.
+    parser.add_argument("--start", type=float, default=None,
+                        help="Only analyse each video from this time on (in seconds).")
+    parser.add_argument("--end", type=float, default=None,
+                        help="Only analyse each video up to this time (in seconds).")
+    
+    # Sharded analysis.
+    parser.add_argument("--shards", type=int, default=2,
+                        help="plan: number of shards to split the videos into (default is 2).")
+    parser.add_argument("--shard_id", type=int, default=None,
+                        help="shard: the shard to run; without it all shards run as separate local processes.")
+    parser.add_argument("--parallel", type=int, default=1,
+                        help="shard: number of shards running at the same time on this machine (default is 1).")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="plan, shard, merge: path of the shard manifest (default is manifest.json in the shard folder).")
+    
+    # Job service.
+    parser.add_argument("--port", type=int, default=None,
+                        help="serve: port of the job API (default is as set in config.py).")
+    
+    # Live stream.
+    parser.add_argument("--source", type=str, default=None,
+                        help="stream: video file, named pipe, stream URL (e.g. rtsp://...) or camera index (e.g. 0).")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="stream: stop after this many seconds (default is to run until the stream ends).")
+    parser.add_argument("--latency", type=float, default=None,
+                        help="stream: latency budget in seconds (default is as set in config.py).")
+    
+    # Adaptive sampling.
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Only analyse frames where the picture has changed and carry the results forward in between (default is as set in config.py).")
+    
+    # Export formats besides the Parquet result files.
+    parser.add_argument("--export", nargs="*", choices=["csv", "excel"], default=None,
+                        help="Also export the results as CSV and/or Excel files (default is as set in config.py); without a value nothing is exported.")
+    
     # Optional argument for visualisation: specify a particular CSV file (sheet).
     parser.add_argument("--sheet", type=str, default="",
-                        help="Optional: specify the analysis CSV file to process (e.g. 'Entrepreneur_emotional_analysis.csv').")
+                        help="Optional: specify the analysis file to process (e.g. 'Entrepreneur_emotional_analysis.parquet').")
+    
+    # Frame rate of the animations.
+    parser.add_argument("--fps", type=float, default=None,
+                        help="Frame rate of the animations (default is as set in config.py); lower values render previews faster.")
+    
+    # Profiling of the main process.
+    parser.add_argument("--profile", nargs="?", choices=["cprofile", "pyinstrument"], const="cprofile", default=None,
+                        help="Profile the run with cProfile (default) or pyinstrument and save the profile in the metrics folder.")
     
     args = parser.parse_args()
 
     if args.command is None:
         print("No command specified. Running both analysis and visualisation...")
         print(f"Starting analysis with a frame step of every {args.frame_step} frame(s)...")
-        run_analysis(frame_step=args.frame_step)
+        run_command("analysis", args.profile, frame_step=args.frame_step, use_cache=not args.no_cache, resume=args.resume,
+                    export_formats=args.export, adaptive=True if args.adaptive else None, start=args.start, end=args.end)
         print("Starting visualisation after analysis...")
-        run_visualisation(sheet=args.sheet)
+        run_command("visualisation", args.profile, sheet=args.sheet, fps=args.fps)
     
     elif args.command == "analysis":
         print(f"Starting analysis with a frame step of every {args.frame_step} frame(s)...")
-        run_analysis(frame_step=args.frame_step)
+        run_command("analysis", args.profile, frame_step=args.frame_step, use_cache=not args.no_cache, resume=args.resume,
+                    export_formats=args.export, adaptive=True if args.adaptive else None, start=args.start, end=args.end)
     
     elif args.command == "visualisation":
         print("Starting visualisation...")
-        run_visualisation(sheet=args.sheet)
+        run_command("visualisation", args.profile, sheet=args.sheet, fps=args.fps)
+    
+    elif args.command == "plan":
+        print(f"Planning {args.shards} shards with a frame step of every {args.frame_step} frame(s)...")
+        kwargs = {'manifest_path': args.manifest} if args.manifest else {}
+        run_command("plan", args.profile, num_shards=args.shards, frame_step=args.frame_step,
+                    adaptive=True if args.adaptive else None, **kwargs)
+    
+    elif args.command == "shard":
+        run_command("shard", args.profile, shard_id=args.shard_id, manifest_path=args.manifest, parallel=args.parallel,
+                    resume=args.resume)
+    
+    elif args.command == "merge":
+        print("Merging the results of the shards...")
+        kwargs = {'manifest_path': args.manifest} if args.manifest else {}
+        run_command("merge", args.profile, export_formats=args.export, **kwargs)
+    
+    elif args.command == "serve":
+        print("Starting the job service...")
+        run_command("serve", args.profile, port=args.port)
+    
+    elif args.command == "watch":
+        print(f"Starting watch mode with a frame step of every {args.frame_step} frame(s)...")
+        run_command("watch", args.profile, frame_step=args.frame_step, use_cache=not args.no_cache,
+                    export_formats=args.export, adaptive=True if args.adaptive else None, fps=args.fps)
+    
+    elif args.command == "stream":
+        if args.source is None:
+            parser.error("stream needs a --source.")
+        print(f"Starting the analysis of {args.source} with a frame step of every {args.frame_step} frame(s)...")
+        run_command("stream", args.profile, source=args.source, frame_step=args.frame_step, duration=args.duration,
+                    latency_budget=args.latency)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+# =============================================================================
+# Run Metrics
+# =============================================================================
+# Collects the timings of the processing stages of one run (decoding, face detection, classification,
+# building the tables, export, rendering, ...), counters and sampled queue depths. The analysis
+# processes measure their stages per batch and send the timings back with their results; everything
+# is summarised with percentiles and written to a JSON file per run in METRICS_DIR.
+
+PERCENTILES = (50, 95, 99)
+
+# Stages that measure overlapping spans per frame or batch (a frame waits while others are analysed),
+# so their sum is no time spent in the run; they are compared by percentile.
+LATENCY_STAGES = ('frame_latency', 'queue_and_transfer')
+
+
+class Metrics:
+    """
+    Timings, counters and gauges of one run. Safe to use from several threads of a process.
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): Name of the run, e.g. 'analysis'; used in the file name.
+        """
+        self.name = name
+        self.started = time.time()
+        self.info = {}
+        self._stages = defaultdict(list)
+        self._counters = Counter()
+        self._gauges = defaultdict(list)
+        self._worker_busy = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """Record one duration of a stage."""
+        with self._lock:
+            self._stages[stage].append(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager that records the duration of its block as one sample of the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def timed(self, iterable, stage):
+        """Yield the items of an iterable and record the time needed to produce each of them."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, n=1):
+        """Increase a counter."""
+        with self._lock:
+            self._counters[name] += n
+
+    def sample(self, name, value):
+        """Record the current value of a gauge, e.g. a queue depth."""
+        with self._lock:
+            self._gauges[name].append(value)
+
+    def add_worker_report(self, report, prefix="worker_"):
+        """
+        Add the timings a worker process measured for one task.
+        Args:
+            report (dict): {'pid': process id, 'busy': seconds the task took, 'timings': {stage: seconds}}.
+            prefix (str): Prefix of the stage names.
+        """
+        for stage, seconds in report['timings'].items():
+            self.record(f"{prefix}{stage}", seconds)
+        with self._lock:
+            self._worker_busy[report['pid']] += report['busy']
+
+    def summary(self):
+        """
+        Summarise the run.
+        Returns:
+            dict: Per stage the number of samples, total, mean, maximum and percentiles (in seconds),
+            the counters, per gauge the mean and maximum, and the busy time of each worker process.
+        """
+        with self._lock:
+            stages = {stage: list(values) for stage, values in self._stages.items()}
+            counters = dict(self._counters)
+            gauges = {name: list(values) for name, values in self._gauges.items()}
+            worker_busy = dict(self._worker_busy)
+        finished = time.time()
+        summary = {
+            'name': self.name,
+            'started': self.started,
+            'finished': finished,
+            'elapsed': finished - self.started,
+            'info': self.info,
+            'stages': {},
+            'counters': counters,
+            'gauges': {},
+            'workers': {str(pid): busy for pid, busy in worker_busy.items()},
+        }
+        for stage, values in sorted(stages.items()):
+            values = np.asarray(values, dtype=float)
+            stats = {'count': int(values.size), 'total': float(values.sum()), 'mean': float(values.mean()), 'max': float(values.max())}
+            for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                stats[f'p{p}'] = float(value)
+            summary['stages'][stage] = stats
+        for name, values in sorted(gauges.items()):
+            values = np.asarray(values, dtype=float)
+            summary['gauges'][name] = {'samples': int(values.size), 'mean': float(values.mean()), 'max': float(values.max())}
+        # Share of the pool's time the worker processes spent on tasks.
+        pool_size = self.info.get('pool_size')
+        pool_time = summary['stages'].get('pool', {}).get('total')
+        if worker_busy and pool_size and pool_time:
+            summary['worker_utilisation'] = sum(worker_busy.values()) / (pool_size * pool_time)
+        return summary
+
+    def write(self, folder):
+        """
+        Write the summary as JSON file.
+        Returns:
+            str: Path of the file.
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"metrics_{self.name}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started))}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=1)
+        return path
+
+    def log_summary(self, log=logging.info):
+        """Log one line per stage with its total time and percentiles, then the gauges and utilisation."""
+        summary = self.summary()
+        for stage, stats in summary['stages'].items():
+            log(
+                f"{self.name} {stage}: {stats['count']}x, total {stats['total']:.2f}s, "
+                f"p50 {stats['p50'] * 1000:.1f}ms, p95 {stats['p95'] * 1000:.1f}ms, p99 {stats['p99'] * 1000:.1f}ms"
+            )
+        for name, stats in summary['gauges'].items():
+            log(f"{self.name} {name}: mean {stats['mean']:.1f}, max {stats['max']:g}")
+        if 'worker_utilisation' in summary:
+            log(f"{self.name} worker utilisation: {summary['worker_utilisation'] * 100:.1f}%")
+
+
+def run_profiled(function, profiler, output_dir, name, **kwargs):
+    """
+    Run a function under a profiler and save the profile.
+    Only the calling process is profiled; for the analysis, the per-stage metrics cover the
+    worker processes.
+    Args:
+        function: The function to run.
+        profiler (str): 'cprofile' (standard library) or 'pyinstrument' (if installed).
+        output_dir (str): Folder of the profile files.
+        name (str): Name of the run, used in the file name.
+        **kwargs: Arguments of the function.
+    Returns:
+        The return value of the function.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, f"profile_{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed (pip install pyinstrument); using cProfile instead.")
+            profiler = 'cprofile'
+        else:
+            profile = Profiler()
+            profile.start()
+            try:
+                return function(**kwargs)
+            finally:
+                profile.stop()
+                with open(f"{stem}.html", "w", encoding="utf-8") as f:
+                    f.write(profile.output_html())
+                print(profile.output_text(unicode=False, color=False))
+                print(f"Profile saved to: {stem}.html")
+
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return function(**kwargs)
+    finally:
+        profile.disable()
+        profile.dump_stats(f"{stem}.prof")
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(25)
+        print(f"Profile saved to: {stem}.prof (open with python -m pstats or snakeviz)")
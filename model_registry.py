@@ -0,0 +1,97 @@
+import os
+import logging
+import numpy as np
+
+# =============================================================================
+# Lazily Loaded Models
+# =============================================================================
+# DeepFace and TensorFlow take seconds to import and the models take seconds to build, so nothing is
+# loaded when a module is imported. Each model is built on first use and then kept for the lifetime
+# of the process. The analysis processes build their models once in the pool initializer, so the
+# main process never has to load TensorFlow and no model is pickled to the workers.
+
+# Built models per (model_name, task).
+_models = {}
+
+# If this environment variable is set, the emotion model is replaced by StubEmotionModel. It is an
+# environment variable so that it also reaches analysis processes that are spawned, not forked.
+STUB_EMOTION_MODEL_VARIABLE = "DEEPFACE_STUB_EMOTION_MODEL"
+
+
+class StubEmotionModel:
+    """
+    Stand-in for the emotion CNN that needs no weights, for benchmarks and offline runs. The scores
+    are derived from the brightness of horizontal bands of the crop, so they are deterministic and
+    change with the face, but they have no meaning.
+    """
+
+    def __call__(self, batch, training=False):
+        """
+        Args:
+            batch (np.ndarray): Crops of shape (n, 48, 48, 1), as passed to the emotion model.
+        Returns:
+            Object whose numpy() returns the (n, 7) scores, like a TensorFlow tensor.
+        """
+        bands = np.array_split(np.asarray(batch, dtype=np.float32).reshape(len(batch), 48, 48), 7, axis=1)
+        logits = np.stack([band.mean(axis=(1, 2)) for band in bands], axis=1) / 16.0
+        scores = np.exp(logits - logits.max(axis=1, keepdims=True))
+        scores /= scores.sum(axis=1, keepdims=True)
+        return _StubTensor(scores)
+
+
+class _StubTensor:
+    """Minimal tensor with the numpy() method used by emotion_engine.classify_faces."""
+
+    def __init__(self, values):
+        self._values = values
+
+    def numpy(self):
+        return self._values
+
+
+class _StubEmotionClient:
+    """Has the 'model' attribute of DeepFace's emotion client."""
+
+    def __init__(self):
+        self.model = StubEmotionModel()
+
+
+def get_model(model_name="Emotion", task="facial_attribute"):
+    """
+    Return a DeepFace model, building it on first use.
+    Args:
+        model_name (str): DeepFace model name, e.g. 'Emotion' or a detector backend such as 'opencv'.
+        task (str): DeepFace task of the model ('facial_attribute', 'face_detector', ...).
+    Returns:
+        The DeepFace model client.
+    """
+    key = (model_name, task)
+    if key not in _models and key == ("Emotion", "facial_attribute") and os.environ.get(STUB_EMOTION_MODEL_VARIABLE):
+        _models[key] = _StubEmotionClient()
+    if key not in _models:
+        from deepface import DeepFace
+        _models[key] = DeepFace.build_model(model_name=model_name, task=task)
+    return _models[key]
+
+
+def is_loaded(model_name="Emotion", task="facial_attribute"):
+    """Return whether the model has already been built in this process."""
+    return (model_name, task) in _models
+
+
+def init_worker(detector_backend="opencv", ready=None):
+    """
+    Initialiser of each analysis process: build the emotion model and the face detector once, before
+    the first frames arrive.
+    Args:
+        detector_backend (str): DeepFace detector backend used by the analysis.
+        ready (multiprocessing.Queue): Optional; receives the process id once the models are loaded.
+    """
+    try:
+        get_model("Emotion", "facial_attribute")
+        get_model(detector_backend, "face_detector")
+    except Exception as e:
+        # The first analysed batch retries and reports the error per frame.
+        logging.error(f"Could not load the analysis models: {e}")
+    if ready is not None:
+        ready.put(os.getpid())
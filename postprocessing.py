@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import config
+
+# =============================================================================
+# Vectorised Post-Processing of Analysis Results
+# =============================================================================
+# The per-frame results of the analysis are turned into the output table in a few array operations:
+# the emotion scores of all frames are read into one matrix, frames below the face confidence
+# threshold are masked with NumPy, and the dominant emotion of every frame is found with argmax.
+
+# Emotion columns of the output files, in the order of the emotion model's outputs.
+EMOTIONS_LIST = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+
+# Unmasked scores of the model (DeepFace's 'emotion' dict), one column per emotion.
+RAW_EMOTION_COLUMNS = [f'raw_{emo}' for emo in EMOTIONS_LIST]
+
+# The face region dict of each frame is flattened into these columns.
+REGION_KEYS = ['x', 'y', 'w', 'h']
+REGION_COLUMNS = [f'region_{key}' for key in REGION_KEYS]
+
+# Labels of frames without a usable emotion.
+NO_FACE_LABEL = 'no face detected'
+NO_EMOTION_LABEL = 'no emotion detected'
+NO_DOMINANT_LABEL = 'no dominant emotion detected'
+
+
+def emotion_score_matrix(raw_output):
+    """
+    Read the emotion scores of all frames into one matrix.
+    Args:
+        raw_output (Series or list): One dict of emotion scores per frame (DeepFace's 'emotion').
+    Returns:
+        np.ndarray: Array of shape (frames, len(EMOTIONS_LIST)); NaN where a frame has no score.
+    """
+    records = [emo if isinstance(emo, dict) else {} for emo in raw_output]
+    scores = pd.DataFrame.from_records(records, columns=EMOTIONS_LIST)
+    return scores.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def label_dominant_emotions(scores, face_ok):
+    """
+    Vectorised version of the dominant emotion rule: frames without a face are 'no face detected',
+    frames without scores 'no emotion detected', and the highest score only counts if it reaches
+    EMOTION_SCORE_THRESHOLD.
+    Args:
+        scores (np.ndarray): Matrix from emotion_score_matrix.
+        face_ok (np.ndarray): Boolean mask of the frames whose face confidence reaches the threshold.
+    Returns:
+        np.ndarray: The dominant emotion label of each frame.
+    """
+    has_emotion = ~np.isnan(scores).all(axis=1)
+    filled = np.where(np.isnan(scores), -np.inf, scores)
+    # argmax returns the first of equal scores, like max() over the emotion dict does.
+    dominant = filled.argmax(axis=1) if len(filled) else np.zeros(0, dtype=int)
+    top_score = filled[np.arange(len(filled)), dominant]
+    labels = np.asarray(EMOTIONS_LIST, dtype=object)[dominant]
+    labels = np.where(top_score >= config.EMOTION_SCORE_THRESHOLD, labels, NO_DOMINANT_LABEL)
+    labels = np.where(has_emotion, labels, NO_EMOTION_LABEL)
+    return np.where(face_ok, labels, NO_FACE_LABEL)
+
+
+def flatten_regions(regions):
+    """
+    Turn the face region dicts of all frames into integer columns.
+    Args:
+        regions (Series or list): One dict with 'x', 'y', 'w' and 'h' per frame.
+    Returns:
+        DataFrame: The columns REGION_COLUMNS; missing values are <NA>.
+    """
+    records = [region if isinstance(region, dict) else {} for region in regions]
+    flat = pd.DataFrame.from_records(records, columns=REGION_KEYS).astype('Int32')
+    flat.columns = REGION_COLUMNS
+    return flat
+
+
+def build_results_dataframe(results):
+    """
+    Turn the per-frame analysis results into the output table.
+    Args:
+        results (list): Analysis dicts with 'emotion', 'face_confidence', 'frame_number' and more.
+    Returns:
+        DataFrame: One row per frame with 'dominant_emotion', one column per emotion (0 for frames
+        below FACE_CONFIDENCE_THRESHOLD), the unmasked scores in RAW_EMOTION_COLUMNS and the face
+        region in REGION_COLUMNS. The original dicts are kept in 'raw_output' and 'region'.
+    """
+    df = pd.DataFrame(results)
+    if 'emotion' in df.columns:
+        df.rename(columns={'emotion': 'raw_output'}, inplace=True)
+
+    scores = emotion_score_matrix(df['raw_output'])
+    face_ok = df['face_confidence'].to_numpy(dtype=np.float64) >= config.FACE_CONFIDENCE_THRESHOLD
+
+    # For each emotion column, if face_confidence is below the threshold, set the value to 0.
+    masked = np.where(face_ok[:, np.newaxis], np.nan_to_num(scores, nan=0.0), 0.0)
+    df[EMOTIONS_LIST] = masked
+    df['dominant_emotion'] = label_dominant_emotions(scores, face_ok)
+    df[RAW_EMOTION_COLUMNS] = scores
+    if 'region' in df.columns:
+        df[REGION_COLUMNS] = flatten_regions(df['region'])
+    return df
+
+
+def carry_forward_results(df, carried_frames):
+    """
+    Add the frames that adaptive sampling did not analyse, with the results of the analysed frame
+    they were carried forward from, and mark each row in the boolean 'sampled' column.
+    Args:
+        df (DataFrame): Results of the analysed frames with a 'frame_number' column.
+        carried_frames (list): (frame_number, carried_from) pairs of the frames that were not analysed.
+    Returns:
+        DataFrame: The analysed frames ('sampled' True) and the carried-forward frames ('sampled'
+        False). Frames carried forward from a frame without results are left out.
+    """
+    df['sampled'] = True
+    if not carried_frames:
+        return df
+    carried = pd.DataFrame(carried_frames, columns=['frame_number', 'carried_from'])
+    copies = carried.merge(df.rename(columns={'frame_number': 'carried_from'}), on='carried_from', how='inner')
+    copies = copies.drop(columns='carried_from')
+    copies['sampled'] = False
+    return pd.concat([df, copies[df.columns]], ignore_index=True)
+
+
+def count_dominant_emotions(df):
+    """
+    Count the frames per dominant emotion.
+    Returns:
+        dict: Number of frames per label, most frequent first.
+    """
+    if 'dominant_emotion' not in df.columns:
+        return {}
+    return df['dominant_emotion'].value_counts().to_dict()
@@ -0,0 +1,199 @@
+import os
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import config
+from postprocessing import EMOTIONS_LIST, RAW_EMOTION_COLUMNS, REGION_COLUMNS
+
+# =============================================================================
+# Columnar Result Store
+# =============================================================================
+# The analysis results are stored as compressed Parquet files with one typed column per value: the
+# emotion scores as floats and the face region as integer columns instead of the text of Python
+# dicts. Every video is written to its own file (partition); the combined file is assembled from the
+# partitions one at a time, so it never has to be held in memory as a whole. CSV and Excel files are
+# exported from the Parquet files when requested. The per-video files also carry the frame rate, the
+# frame step and the frame count of the video in their metadata, so the results can be placed on the
+# time axis of the video. The rows are keyed by (frame_number, face_id); with one face per frame
+# (MAX_FACES = 1) the face ID is 0, or -1 for frames without a face.
+
+# Column types of the result files, in file order.
+RESULT_SCHEMA = pa.schema(
+    [
+        ("frame_number", pa.int64()),
+        ("face_id", pa.int32()),
+        ("source", pa.string()),
+        ("sampled", pa.bool_()),
+        ("dominant_emotion", pa.string()),
+    ]
+    + [(emo, pa.float64()) for emo in EMOTIONS_LIST]
+    + [("face_confidence", pa.float64())]
+    + [(column, pa.int32()) for column in REGION_COLUMNS]
+    + [("region_source", pa.string())]
+    + [(column, pa.float64()) for column in RAW_EMOTION_COLUMNS]
+)
+RESULT_COLUMNS = RESULT_SCHEMA.names
+
+# Key of the video information in the metadata of a result file.
+VIDEO_INFO_KEY = b"video_info"
+
+
+def to_result_frame(df):
+    """
+    Select and order the columns of the result files.
+    Columns that are missing (e.g. 'region_source' in older results) are filled with nulls.
+    Args:
+        df (DataFrame): Output of postprocessing.build_results_dataframe with a 'source' column.
+    Returns:
+        DataFrame: The columns RESULT_COLUMNS.
+    """
+    return df.reindex(columns=RESULT_COLUMNS)
+
+
+def as_result_table(table):
+    """
+    Select and cast the columns of the result files from an Arrow table.
+    Columns that older result files do not have (e.g. 'face_id') are filled with nulls.
+    """
+    for field in RESULT_SCHEMA:
+        if field.name not in table.column_names:
+            table = table.append_column(field, pa.nulls(table.num_rows, field.type))
+    return table.select(RESULT_COLUMNS).cast(RESULT_SCHEMA)
+
+
+def write_results(df, path, video_info=None):
+    """
+    Write the results of one video as a compressed Parquet file.
+    Args:
+        df (DataFrame): Results with the columns RESULT_COLUMNS.
+        path (str): Path of the Parquet file.
+        video_info (dict): Optional information about the video, e.g. {'fps': 30.0, 'frame_step': 1,
+            'frame_count': 900}, stored in the file's metadata.
+    """
+    table = pa.Table.from_pandas(to_result_frame(df), schema=RESULT_SCHEMA, preserve_index=False)
+    if video_info:
+        metadata = dict(table.schema.metadata or {})
+        metadata[VIDEO_INFO_KEY] = json.dumps(video_info).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_path, compression=config.PARQUET_COMPRESSION)
+    os.replace(tmp_path, path)
+
+
+def read_results(path, columns=None):
+    """
+    Read a result file.
+    Args:
+        path (str): Path of the Parquet file.
+        columns (list): Only read these columns; columns the file does not have are skipped.
+    Returns:
+        DataFrame: The results.
+    """
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [column for column in columns if column in available]
+    return pd.read_parquet(path, columns=columns)
+
+
+def read_video_info(path):
+    """
+    Read the video information stored with a result file.
+    Returns:
+        dict or None: The video information, or None for files without it (e.g. the combined file).
+    """
+    metadata = pq.read_schema(path).metadata or {}
+    if VIDEO_INFO_KEY not in metadata:
+        return None
+    return json.loads(metadata[VIDEO_INFO_KEY])
+
+
+def combine_results(paths, combined_path):
+    """
+    Write the combined result file from the per-video files, one file at a time.
+    Args:
+        paths (list): Per-video Parquet files, in the order they should appear.
+        combined_path (str): Path of the combined Parquet file.
+    Returns:
+        int: Number of rows in the combined file.
+    """
+    rows = 0
+    tmp_path = f"{combined_path}.{os.getpid()}.tmp"
+    with pq.ParquetWriter(tmp_path, RESULT_SCHEMA, compression=config.PARQUET_COMPRESSION) as writer:
+        for path in paths:
+            table = as_result_table(pq.read_table(path))
+            writer.write_table(table)
+            rows += table.num_rows
+    os.replace(tmp_path, combined_path)
+    return rows
+
+
+def read_sources(path):
+    """Return the source identifiers of the videos that have rows in a result file."""
+    return {source for source in pc.unique(pq.read_table(path, columns=['source'])['source']).to_pylist()
+            if source is not None}
+
+
+def replace_source(combined_path, path, source):
+    """
+    Update the combined result file with the results of one video: its previous rows are removed and
+    the rows of its per-video file are appended at the end. The other videos are copied one row group
+    at a time, so neither their per-video files nor the whole combined file have to be read at once.
+    Args:
+        combined_path (str): Path of the combined Parquet file; it is created if it does not exist.
+        path (str): Per-video Parquet file of the video, or None to only remove its rows (e.g. once the
+            video was deleted).
+        source (str): Source identifier of the video.
+    Returns:
+        tuple: (number of rows in the combined file, True if the video already had rows in it)
+    """
+    rows = 0
+    replaced = False
+    if path is None and not os.path.exists(combined_path):
+        return rows, replaced
+    tmp_path = f"{combined_path}.{os.getpid()}.tmp"
+    with pq.ParquetWriter(tmp_path, RESULT_SCHEMA, compression=config.PARQUET_COMPRESSION) as writer:
+        if os.path.exists(combined_path):
+            for batch in pq.ParquetFile(combined_path).iter_batches():
+                table = as_result_table(pa.Table.from_batches([batch]))
+                keep = pc.fill_null(pc.not_equal(table['source'], source), True)
+                kept = table.filter(keep)
+                replaced = replaced or kept.num_rows < table.num_rows
+                if kept.num_rows:
+                    writer.write_table(kept)
+                    rows += kept.num_rows
+        if path is not None:
+            table = as_result_table(pq.read_table(path))
+            writer.write_table(table)
+            rows += table.num_rows
+    os.replace(tmp_path, combined_path)
+    return rows, replaced
+
+
+def export_csv(path, csv_path):
+    """Export a result file as CSV, one row group at a time."""
+    parquet_file = pq.ParquetFile(path)
+    header = True
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        for batch in parquet_file.iter_batches():
+            batch.to_pandas().to_csv(f, index=False, header=header)
+            header = False
+        if header:
+            # No rows: write the header only.
+            parquet_file.schema_arrow.empty_table().to_pandas().to_csv(f, index=False)
+
+
+def append_csv(path, csv_path):
+    """Append the rows of a result file to an existing CSV export, one row group at a time."""
+    if not os.path.exists(csv_path):
+        export_csv(path, csv_path)
+        return
+    with open(csv_path, "a", encoding="utf-8", newline="") as f:
+        for batch in pq.ParquetFile(path).iter_batches():
+            batch.to_pandas().to_csv(f, index=False, header=False)
+
+
+def export_excel(path, excel_path):
+    """Export a result file as Excel sheet."""
+    pd.read_parquet(path).to_excel(excel_path, index=False)
@@ -0,0 +1,107 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+
+# =============================================================================
+# Fair Task Scheduling Across Videos
+# =============================================================================
+# All videos of a run share one worker pool. Every video in progress has its own producer thread and
+# task queue; the scheduler hands the tasks to the pool round-robin, one task per video in turn, so a
+# long video cannot starve the short ones. Only a limited number of videos are decoded at the same
+# time; as soon as one of them is decoded completely, the next waiting video is started, so the pool
+# already has work from the next video while the last frames of the previous one are analysed.
+
+
+class FairScheduler:
+    """
+    Iterable of (key, task) pairs for Pool.imap_unordered. A task of None marks the end of a video's
+    tasks; it is passed through so the consumer learns when a video has been decoded completely.
+    """
+
+    def __init__(self, max_active=1):
+        """
+        Args:
+            max_active (int): Number of videos that are decoded at the same time.
+        """
+        self.max_active = max(1, max_active)
+        self._condition = threading.Condition()
+        self._waiting = deque()  # (key, start) of videos that have not been started yet
+        self._queues = OrderedDict()  # Task queue of each started video, in round-robin order
+        self._finished = set()  # Started videos whose producer has put its last task
+        self._closed = False
+
+    def submit(self, key, start):
+        """
+        Add a video. start(put_task) is called once the video may be decoded; it must start the
+        producer, which hands its tasks to put_task and finishes with put_task(None).
+        Args:
+            key: Identifier of the video, returned with each of its tasks.
+            start (function): Starts the video's producer.
+        """
+        with self._condition:
+            self._waiting.append((key, start))
+            self._condition.notify_all()
+
+    def put(self, key, task):
+        """Queue a task of a started video; None marks its last task."""
+        with self._condition:
+            if self._closed:
+                return
+            self._queues[key].append(task)
+            if task is None:
+                self._finished.add(key)
+            self._condition.notify_all()
+
+    def pending(self):
+        """Return the number of queued tasks that have not been handed out yet."""
+        with self._condition:
+            return sum(len(tasks) for tasks in self._queues.values())
+
+    def close(self):
+        """Stop handing out tasks, e.g. after an error; the iteration ends."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _start_waiting(self):
+        """Start waiting videos while fewer than max_active are being decoded. Called with the lock held."""
+        while self._waiting and len(self._queues) - len(self._finished) < self.max_active:
+            key, start = self._waiting.popleft()
+            self._queues[key] = deque()
+            # The producer calls put() from its own thread, so start it without holding the lock.
+            self._condition.release()
+            try:
+                start(lambda task, key=key: self.put(key, task))
+            except Exception as e:
+                logging.error(f"Could not start the analysis of {key}: {e}")
+                self._queues[key].append(None)
+                self._finished.add(key)
+            finally:
+                self._condition.acquire()
+
+    def __iter__(self):
+        with self._condition:
+            while not self._closed:
+                self._start_waiting()
+                item = None
+                # Take the first task of the first video that has one, then move that video to the
+                # back of the round.
+                for key, tasks in self._queues.items():
+                    if tasks:
+                        item = (key, tasks.popleft())
+                        self._queues.move_to_end(key)
+                        if item[1] is None:
+                            # The video is decoded completely; its queue is no longer needed.
+                            del self._queues[key]
+                            self._finished.discard(key)
+                        break
+                if item is not None:
+                    self._condition.release()
+                    try:
+                        yield item
+                    finally:
+                        self._condition.acquire()
+                elif not self._queues and not self._waiting:
+                    return
+                else:
+                    self._condition.wait()
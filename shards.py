@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import time
+import logging
+import subprocess
+import cv2
+import pandas as pd
+import config
+import analysis
+import analysis_cache
+import result_store
+from metrics import Metrics
+from face_tracker import assign_face_ids
+
+# =============================================================================
+# Sharded Analysis
+# =============================================================================
+# A long recording, or a large set of videos, can be analysed on several machines at once. The shard
+# planner cuts the frames of all videos into balanced work units, each a frame range of one video,
+# and groups them into shards. The plan is written to a manifest, so every machine (or process) can
+# run its shard independently and write one result file per unit. The merge step then stitches the
+# units of each video into the per-video result files and the combined file that process_all_videos
+# writes. Range boundaries are multiples of the frame step, so the merged results contain the same
+# frames as an analysis of the whole video. With adaptive sampling they do not: each unit starts with
+# an analysed frame and compares the following frames with it, so around each cut other frames may be
+# analysed than in one run over the whole video. The manifest records this in 'same_frames_as_whole'.
+
+MANIFEST_VERSION = 1
+
+BASE_DIR = os.getcwd()
+SHARD_DIR = os.path.join(BASE_DIR, config.SHARD_DIR)  # Folder of the manifest and the shard results
+SHARD_RESULTS_DIR = os.path.join(SHARD_DIR, "results")  # Result files of the work units
+MANIFEST_FILE = os.path.join(SHARD_DIR, "manifest.json")  # Default manifest
+
+
+def probe_video(video_path):
+    """
+    Read the frame count and frame rate of a video from its container.
+    Returns:
+        tuple: (frame_count, frame_rate); the frame count is 0 if the video cannot be opened.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return 0, config.FRAME_RATE
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_rate = cap.get(cv2.CAP_PROP_FPS) or config.FRAME_RATE
+    cap.release()
+    return frame_count, frame_rate
+
+
+def sampled_frames(start_frame, end_frame, frame_step):
+    """Number of multiples of frame_step in [start_frame, end_frame)."""
+    return max(0, -(-end_frame // frame_step) - -(-start_frame // frame_step))
+
+
+def unit_file(unit):
+    """Return the path of the result file of a work unit."""
+    end = 'end' if unit['end_frame'] is None else unit['end_frame']
+    return os.path.join(SHARD_RESULTS_DIR, f"{unit['source']}_{unit['start_frame']}-{end}_emotional_analysis.parquet")
+
+
+def video_path_of(manifest, source):
+    """Return the full path of a video of the manifest; relative paths are relative to the working directory."""
+    path = manifest['videos'][source]['path']
+    return path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+
+
+def plan_shards(video_paths, num_shards, frame_step=1, adaptive=False):
+    """
+    Split the frames of all videos into balanced shards.
+    The videos are laid out one after another and this timeline is cut into num_shards pieces of
+    about the same number of frames, so each shard has the same amount of work and a video is only
+    split where a cut falls into it. Cuts are moved to the next multiple of frame_step.
+    Args:
+        video_paths (list): Full paths to the video files.
+        num_shards (int): Number of shards.
+        frame_step (int): Analyse every n-th frame.
+        adaptive (bool): Use adaptive sampling in every shard. The first frame of every unit is then
+            analysed, so the merged results may differ from an analysis of the whole video around the cuts.
+    Returns:
+        dict: The manifest with the settings, the videos and per shard its work units
+        ({'source', 'start_frame', 'end_frame', 'frames'}; end_frame is None for the end of a video).
+    """
+    videos = {}
+    for video_path in sorted(video_paths):
+        source = os.path.splitext(os.path.basename(video_path))[0]
+        frame_count, frame_rate = probe_video(video_path)
+        if frame_count <= 0:
+            logging.warning(f"Could not read the frame count of {video_path}; it is not part of the plan.")
+            continue
+        relative = os.path.relpath(video_path, BASE_DIR)
+        videos[source] = {
+            'path': video_path if relative.startswith('..') else relative.replace(os.sep, '/'),
+            'frame_count': frame_count,
+            'fps': frame_rate,
+            'size': os.path.getsize(video_path),
+        }
+
+    total = sum(video['frame_count'] for video in videos.values())
+    num_shards = max(1, min(num_shards, -(-total // frame_step)))
+    shard_frames = total / num_shards
+    shards = [{'shard_id': shard_id, 'units': []} for shard_id in range(num_shards)]
+    offset = 0  # Position of the first frame of the current video in the timeline
+    for source, video in videos.items():
+        frame_count = video['frame_count']
+        start = 0
+        while start < frame_count:
+            shard_id = min(num_shards - 1, int((offset + start) // shard_frames))
+            # End of this shard within the video, moved to the next sampled frame.
+            cut = round((shard_id + 1) * shard_frames) - offset
+            end = min(frame_count, -(-cut // frame_step) * frame_step)
+            if shard_id == num_shards - 1:
+                end = frame_count
+            # The last unit of a video reads to its end, as the container's frame count is an estimate.
+            shards[shard_id]['units'].append({
+                'source': source,
+                'start_frame': start,
+                'end_frame': None if end >= frame_count else end,
+                'frames': sampled_frames(start, end, frame_step),
+            })
+            start = end
+        offset += frame_count
+
+    sources = [unit['source'] for shard in shards for unit in shard['units']]
+    # Adaptive sampling starts again at each cut, so the analysed frames of a split video may differ
+    # from one run over the whole video (see the comment at the top).
+    same_frames = not adaptive or len(sources) == len(set(sources))
+    if not same_frames:
+        logging.warning("With adaptive sampling, the first frame of each frame range is analysed, so the merged "
+                        "results can differ from an analysis of the whole video around the cuts.")
+    return {
+        'version': MANIFEST_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'frame_step': frame_step,
+        'adaptive': adaptive,
+        'same_frames_as_whole': same_frames,
+        'settings': analysis_cache.analysis_parameters(frame_step, adaptive=adaptive),
+        'videos': videos,
+        'shards': shards,
+    }
+
+
+def write_manifest(manifest, path=MANIFEST_FILE):
+    """Write a manifest as JSON file."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(path=MANIFEST_FILE):
+    """
+    Read a manifest.
+    Raises:
+        ValueError: If the file was written by another version of the planner.
+    """
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"{path} has manifest version {manifest.get('version')}, expected {MANIFEST_VERSION}.")
+    return manifest
+
+
+def run_plan(num_shards, frame_step=1, adaptive=None, manifest_path=MANIFEST_FILE):
+    """
+    Plan the shards of all videos in the videos folder and write the manifest.
+    Args:
+        num_shards (int): Number of shards.
+        frame_step (int): Analyse every n-th frame.
+        adaptive (bool): Use adaptive sampling; defaults to ADAPTIVE_SAMPLING in config.py.
+        manifest_path (str): Path of the manifest.
+    """
+    if adaptive is None:
+        adaptive = config.ADAPTIVE_SAMPLING
+    video_files = analysis.find_video_files() if os.path.isdir(analysis.VIDEO_DIR) else []
+    if not video_files:
+        print(f"No video files found in the folder: {analysis.VIDEO_DIR}")
+        return
+    manifest = plan_shards(video_files, num_shards, frame_step, adaptive)
+    write_manifest(manifest, manifest_path)
+    for shard in manifest['shards']:
+        units = ", ".join(
+            f"{unit['source']} {unit['start_frame']}-{'end' if unit['end_frame'] is None else unit['end_frame']}"
+            for unit in shard['units']
+        )
+        print(f"Shard {shard['shard_id']}: {sum(unit['frames'] for unit in shard['units'])} frames ({units})")
+    print(f"Manifest with {len(manifest['shards'])} shards saved to: {manifest_path}")
+
+
+def run_shard(shard_id, manifest_path=MANIFEST_FILE, resume=False):
+    """
+    Analyse the work units of one shard and write one result file per unit to SHARD_RESULTS_DIR.
+    Units whose result file already exists are skipped when resuming.
+    Args:
+        shard_id (int): Number of the shard in the manifest.
+        manifest_path (str): Path of the manifest.
+        resume (bool): Skip finished units and continue interrupted ones from their checkpoints.
+    Returns:
+        bool: True if every unit of the shard was analysed.
+    """
+    manifest = load_manifest(manifest_path)
+    shard = manifest['shards'][shard_id]
+    analysis.prepare_environment()
+    os.makedirs(SHARD_RESULTS_DIR, exist_ok=True)
+    frame_step, adaptive = manifest['frame_step'], manifest['adaptive']
+    cache_params = analysis_cache.analysis_parameters(frame_step, adaptive=adaptive)
+    if cache_params != manifest['settings']:
+        # Another config.py on this machine would give results that do not fit the other shards.
+        logging.warning(f"The analysis settings differ from those of the manifest {manifest_path}.")
+
+    metrics = Metrics(f"shard_{shard_id}")
+    metrics.info.update({'shard_id': shard_id, 'frame_step': frame_step, 'adaptive': adaptive})
+    jobs = {}
+    for index, unit in enumerate(shard['units']):
+        output_file = unit_file(unit)
+        if resume and os.path.exists(output_file):
+            logging.info(f"Skipping finished unit {output_file}.")
+            continue
+        video_path = video_path_of(manifest, unit['source'])
+        frame_range = (unit['start_frame'], unit['end_frame'])
+        checkpoint = analysis.create_checkpoint(video_path, unit['source'], cache_params, frame_range)
+        jobs[index] = analysis.VideoAnalysis(video_path, unit['source'], frame_step, checkpoint, resume, adaptive,
+                                             metrics, frame_range, output_file)
+    logging.info(f"Shard {shard_id}: analysing {len(jobs)} of {len(shard['units'])} units.")
+    dfs = analysis.run_jobs(jobs, metrics)
+    failed = [unit_file(shard['units'][index]) for index in jobs if dfs.get(index) is None]
+    for output_file in failed:
+        logging.error(f"Shard {shard_id}: no results for {output_file}.")
+    metrics.log_summary()
+    metrics.write(analysis.METRICS_DIR)
+    print(f"Shard {shard_id} finished: {len(jobs) - len(failed)} of {len(jobs)} units analysed.")
+    return not failed
+
+
+def run_shards_locally(manifest_path=MANIFEST_FILE, parallel=1, resume=False):
+    """
+    Run every shard of a manifest as a separate process on this machine, as they would run on
+    separate machines.
+    Args:
+        manifest_path (str): Path of the manifest.
+        parallel (int): Number of shards running at the same time; each has its own pool of POOL_SIZE processes.
+        resume (bool): Pass --resume to the shards.
+    Returns:
+        bool: True if every shard succeeded.
+    """
+    manifest = load_manifest(manifest_path)
+    main_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    waiting = [shard['shard_id'] for shard in manifest['shards']]
+    running = {}
+    failed = []
+    while waiting or running:
+        while waiting and len(running) < max(1, parallel):
+            shard_id = waiting.pop(0)
+            command = [sys.executable, main_script, "shard", "--shard_id", str(shard_id), "--manifest", manifest_path]
+            if resume:
+                command.append("--resume")
+            print(f"Starting shard {shard_id}...")
+            running[shard_id] = subprocess.Popen(command, cwd=BASE_DIR)
+        for shard_id, process in list(running.items()):
+            if process.poll() is not None:
+                del running[shard_id]
+                if process.returncode != 0:
+                    failed.append(shard_id)
+                print(f"Shard {shard_id} exited with code {process.returncode}.")
+        time.sleep(0.5)
+    if failed:
+        print(f"Failed shards: {sorted(failed)}; run them again with --resume before merging.")
+    return not failed
+
+
+def merge_shards(manifest_path=MANIFEST_FILE, export_formats=None):
+    """
+    Stitch the unit results of every video into its result file, then write the combined file and
+    the exports as process_all_videos does. Videos with missing units are left out.
+    Args:
+        manifest_path (str): Path of the manifest.
+        export_formats (list): Also export the result files as 'csv' and/or 'excel'; defaults to
+            EXPORT_CSV and EXPORT_EXCEL in config.py.
+    Returns:
+        bool: True if every video of the manifest was merged.
+    """
+    if export_formats is None:
+        export_formats = analysis.default_export_formats()
+    manifest = load_manifest(manifest_path)
+    analysis.prepare_environment()
+    metrics = Metrics("merge")
+    units_per_source = {}
+    for shard in manifest['shards']:
+        for unit in shard['units']:
+            units_per_source.setdefault(unit['source'], []).append(unit)
+
+    sources = []
+    for source, units in units_per_source.items():
+        files = [unit_file(unit) for unit in sorted(units, key=lambda unit: unit['start_frame'])]
+        missing = [path for path in files if not os.path.exists(path)]
+        if missing:
+            logging.error(f"{source} is not merged; missing unit results: {missing}")
+            continue
+        with metrics.timer('merge_video'):
+            df = pd.concat([result_store.read_results(path).assign(unit=i) for i, path in enumerate(files)], ignore_index=True)
+            # A frame is taken from the first unit that has it, with all its faces.
+            df = df[df['unit'] == df.groupby('frame_number')['unit'].transform('min')].drop(columns='unit')
+            # The face IDs of the units are numbered separately, so they are assigned again for the whole video.
+            df['face_id'] = assign_face_ids(df)
+            df = df.sort_values(["frame_number", "face_id"], ignore_index=True)
+            infos = [result_store.read_video_info(path) or {} for path in files]
+            # The unit at the end of the video has seen its real length.
+            video_info = {
+                'fps': manifest['videos'][source]['fps'],
+                'frame_step': manifest['frame_step'],
+                'frame_count': max(info.get('frame_count', 0) for info in infos) or manifest['videos'][source]['frame_count'],
+            }
+            result_store.write_results(df, analysis.results_file(source), video_info)
+        logging.info(f"Merged {len(files)} units of {source} ({len(df)} rows).")
+        sources.append(source)
+
+    analysis.combine_and_export(sources, export_formats, metrics)
+    metrics.log_summary()
+    metrics.write(analysis.METRICS_DIR)
+    return len(sources) == len(units_per_source)
@@ -0,0 +1,116 @@
+import subprocess
+import numpy as np
+from matplotlib.colors import to_rgb
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+###############################################################################
+# Fast timeline renderer
+###############################################################################
+# The frames of an animation only differ in the position of the cursor line. The chart is therefore
+# rasterised once; the cursor is rasterised once as well, as a narrow strip of coverage values. Each
+# frame restores the columns of the previous cursor position from the chart and stamps the cursor at
+# the new position. The raw RGB frames are piped into a single ffmpeg process per output file.
+
+
+class CursorRenderer:
+    """
+    Renders the frames of a chart with a vertical cursor line at a given x value.
+    """
+
+    def __init__(self, fig, ax, dpi=100, color='black', linestyle='--', linewidth=1.5):
+        """
+        Args:
+            fig (matplotlib.figure.Figure): The finished chart, without the cursor line.
+            ax (matplotlib.axes.Axes): Axes the cursor moves along; x values are in its data coordinates.
+            dpi (int): Resolution of the output frames.
+            color, linestyle, linewidth: Style of the cursor line, as for Axes.axvline.
+        """
+        fig.set_dpi(dpi)
+        fig.canvas.draw()
+        chart = np.asarray(fig.canvas.buffer_rgba())[..., :3]
+        # libx264 with yuv420p needs even frame dimensions.
+        self.height = chart.shape[0] - chart.shape[0] % 2
+        self.width = chart.shape[1] - chart.shape[1] % 2
+        self.chart = np.ascontiguousarray(chart[:self.height, :self.width])
+        self.frame = self.chart.copy()
+        self.ax = ax
+        self.x_bounds = ax.get_xlim()
+        self._stamped = None  # (first, last) column of the cursor in self.frame
+
+        # Rasterise the cursor on its own: same figure size, same axes position and limits, only the line.
+        cursor_fig = Figure(figsize=fig.get_size_inches(), dpi=dpi, facecolor='none')
+        FigureCanvasAgg(cursor_fig)
+        cursor_ax = cursor_fig.add_axes(ax.get_position())
+        cursor_ax.set_axis_off()
+        cursor_ax.set_xlim(self.x_bounds)
+        cursor_ax.set_ylim(ax.get_ylim())
+        self.reference_x = sum(self.x_bounds) / 2
+        cursor_ax.axvline(self.reference_x, color=color, linestyle=linestyle, linewidth=linewidth)
+        cursor_fig.canvas.draw()
+        cursor = np.asarray(cursor_fig.canvas.buffer_rgba())[:self.height, :self.width]
+        # On a transparent background, the alpha channel is the coverage of each pixel by the line.
+        coverage = cursor[..., 3].astype(np.float32) / 255
+        columns = np.flatnonzero(coverage.max(axis=0) > 0)
+        self.reference_column = int(round(self._column(self.reference_x)))
+        if columns.size:
+            self.sprite_offset = int(columns[0]) - self.reference_column
+            self.coverage = coverage[:, columns[0]:columns[-1] + 1, np.newaxis]
+        else:
+            self.sprite_offset = 0
+            self.coverage = np.zeros((self.height, 0, 1), dtype=np.float32)
+        x0, x1 = ax.bbox.x0, ax.bbox.x1
+        self.clip_columns = (max(int(round(x0)), 0), min(int(round(x1)), self.width))
+        self.line_color = (np.array(to_rgb(color), dtype=np.float32) * 255).reshape(1, 1, 3)
+
+    def _column(self, x):
+        """Pixel column of an x value of the axes."""
+        return self.ax.transData.transform((x, 0))[0]
+
+    def render(self, x):
+        """
+        Returns the frame with the cursor at x.
+        Returns:
+            np.ndarray: The (height, width, 3) uint8 frame. It is reused by the next call.
+        """
+        if self._stamped is not None:
+            first, last = self._stamped
+            self.frame[:, first:last] = self.chart[:, first:last]
+            self._stamped = None
+        # Like the clipped axvline: outside the x limits the cursor is not drawn.
+        if not min(self.x_bounds) <= x <= max(self.x_bounds) or self.coverage.shape[1] == 0:
+            return self.frame
+        first = int(round(self._column(x))) + self.sprite_offset
+        last = first + self.coverage.shape[1]
+        # The line is clipped to the axes, like the axvline.
+        lo, hi = max(first, self.clip_columns[0]), min(last, self.clip_columns[1])
+        if lo < hi:
+            coverage = self.coverage[:, lo - first:hi - first]
+            chart = self.chart[:, lo:hi].astype(np.float32)
+            self.frame[:, lo:hi] = (chart + (self.line_color - chart) * coverage + 0.5).astype(np.uint8)
+            self._stamped = (lo, hi)
+        return self.frame
+
+
+def open_ffmpeg_pipe(output_path, width, height, fps, codec="libx264", bitrate=1500, extra_args=()):
+    """
+    Starts an ffmpeg process that encodes raw RGB frames from its stdin into a video file.
+    Args:
+        output_path (str): Path of the video file.
+        width, height (int): Frame size in pixels.
+        fps (float): Frame rate of the video.
+        codec (str): Video codec.
+        bitrate (int): Bitrate in kbit/s.
+        extra_args (list): Further output options, e.g. ['-preset', 'fast', '-crf', '23'].
+    Returns:
+        subprocess.Popen: The process; write the frames to its stdin, then close it and wait.
+    """
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-vcodec", "rawvideo",
+        "-s", f"{width}x{height}", "-pix_fmt", "rgb24", "-framerate", str(fps),
+        "-i", "pipe:",
+        "-vcodec", codec, "-b", f"{bitrate}k", *extra_args,
+        output_path,
+    ]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
@@ -0,0 +1,123 @@
+import cv2
+import config
+
+# Width in pixels of the grayscale thumbnails compared by the adaptive sampler.
+SIGNATURE_WIDTH = 64
+
+# =============================================================================
+# Sampling Video Reader
+# =============================================================================
+def read_sampled_frames(cap, frame_step, stats, seek_step=None, start_frame=0, end_frame=None):
+    """
+    Yields every n-th frame of an opened video without paying for the frames in between.
+    Skipped frames are only grabbed, which advances the stream without converting and copying them
+    to a BGR image; retrieve() is called for the sampled frames alone. For steps of at least
+    seek_step frames the reader seeks directly to the next sampled frame, so the frames in between
+    are not decoded at all. If the backend cannot seek, the reader falls back to grabbing.
+    With a frame range, the reader seeks directly to its first sampled frame. The sampled frames are
+    the multiples of frame_step, as in a run over the whole video, so the results of several ranges
+    fit together.
+    Args:
+        cap (cv2.VideoCapture): The opened video.
+        frame_step (int): Yield every n-th frame.
+        stats (dict): Receives the number of frames in the video ('total_frames'), or up to end_frame.
+        seek_step (int): Minimum frame step for seeking; defaults to config.SEEK_FRAME_STEP, 0 disables seeking.
+        start_frame (int): First frame of the range.
+        end_frame (int): End of the range (exclusive); None reads to the end of the video.
+    Yields:
+        tuple: (frame_number, frame)
+    """
+    if seek_step is None:
+        seek_step = config.SEEK_FRAME_STEP
+    seek = 0 < seek_step <= frame_step
+    seeked = False
+    frame_number = 0
+    first = -(-start_frame // frame_step) * frame_step
+    if first > 0:
+        if cap.set(cv2.CAP_PROP_POS_FRAMES, first) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == first:
+            frame_number = first
+            stats['total_frames'] = first
+        else:
+            # Seeking is not supported (or not exact) for this video: grab up to the range instead.
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    while (end_frame is None or frame_number < end_frame) and cap.grab():
+        stats['total_frames'] = frame_number + 1
+        if frame_number % frame_step == 0 and frame_number >= first:
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            yield frame_number, frame
+            if seek:
+                target = frame_number + frame_step
+                if cap.set(cv2.CAP_PROP_POS_FRAMES, target) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == target:
+                    frame_number = target
+                    seeked = True
+                    continue
+                # Seeking is not supported (or not exact) for this video: continue by grabbing.
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number + 1)
+                seek = False
+        frame_number += 1
+    if seeked:
+        # The frames after the last sample were skipped, so the container metadata has the final say.
+        if end_frame is not None:
+            frame_number = min(frame_number, end_frame)
+        stats['total_frames'] = max(stats['total_frames'], min(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), frame_number))
+
+
+# =============================================================================
+# Adaptive Sampling
+# =============================================================================
+# While nothing moves in the picture, consecutive frames give the same analysis results. The adaptive
+# sampler compares each frame with the frame that was last analysed, using small grayscale thumbnails,
+# and only selects it for the analysis once the picture has changed enough. The other frames take over
+# the results of the last analysed frame (they are carried forward).
+def frame_signature(frame, width=SIGNATURE_WIDTH):
+    """
+    Returns a small grayscale thumbnail of a frame for the change metric.
+    Args:
+        frame (np.ndarray): BGR frame.
+        width (int): Width of the thumbnail; the height keeps the aspect ratio.
+    """
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+
+def select_changed_frames(frames, min_interval, max_interval, threshold):
+    """
+    Decides for each frame whether it is analysed or carried forward.
+    A frame is analysed if at least max_interval frames have passed since the last analysed frame,
+    or if at least min_interval frames have passed and the mean absolute difference between its
+    thumbnail and that of the last analysed frame reaches the threshold. The first frame is always
+    analysed.
+    Args:
+        frames (iterable): (frame_number, frame) pairs, e.g. from read_sampled_frames.
+        min_interval (int): Minimum distance in frames between two analysed frames.
+        max_interval (int): Maximum distance in frames between two analysed frames.
+        threshold (float): Mean absolute grayscale difference (0-255) that counts as a change.
+    Yields:
+        tuple: (frame_number, frame, carried_from). carried_from is None for frames to analyse;
+        for the other frames it is the number of the analysed frame whose results they take over,
+        and frame is None.
+    """
+    last_sampled = None
+    reference = None
+    for frame_number, frame in frames:
+        signature = None
+        if last_sampled is None:
+            sample = True
+        else:
+            distance = frame_number - last_sampled
+            if distance < min_interval:
+                sample = False
+            elif distance >= max_interval:
+                sample = True
+            else:
+                signature = frame_signature(frame)
+                sample = signature.shape != reference.shape or cv2.absdiff(signature, reference).mean() >= threshold
+        if sample:
+            reference = signature if signature is not None else frame_signature(frame)
+            last_sampled = frame_number
+            yield frame_number, frame, None
+        else:
+            yield frame_number, None, last_sampled
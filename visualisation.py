@@ -1,18 +1,24 @@
 import os
 import glob
+import math
 import multiprocessing
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 import numpy as np
 import pandas as pd
+from matplotlib.collections import PolyCollection
 from matplotlib.ticker import FuncFormatter
+import shutil
 import subprocess
 import time
 from datetime import datetime
 import warnings
 import config
+import result_store
+from metrics import Metrics
+from face_tracker import NO_FACE_ID
+from timeline_renderer import CursorRenderer, open_ffmpeg_pipe
 
 # Suppress Python deprecation warnings.
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -21,20 +27,28 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 BASE_DIR = os.getcwd()
 ANALYSIS_DIR = os.path.join(BASE_DIR, config.ANALYSIS_DIR)
 CSV_DIR = os.path.join(ANALYSIS_DIR, config.CSV_DIR)
+PARQUET_DIR = os.path.join(ANALYSIS_DIR, config.PARQUET_DIR)
+METRICS_DIR = os.path.join(BASE_DIR, config.METRICS_DIR)
 PLOTS_DIR = os.path.join(BASE_DIR, config.PLOTS_DIR)
 ANIMATIONS_DIR = os.path.join(BASE_DIR, config.ANIMATIONS_DIR)
-os.makedirs(PLOTS_DIR, exist_ok=True)
-os.makedirs(ANIMATIONS_DIR, exist_ok=True)
 
 # Parameters from config.
 FRAME_RATE = config.FRAME_RATE
+ANIMATION_FPS = config.ANIMATION_FPS
 CONFIDENCE_THRESHOLD = config.CONFIDENCE_THRESHOLD
 PLOT_WIDTH = config.PLOT_WIDTH
 PLOT_HEIGHT = config.PLOT_HEIGHT
 PLOT_DPI = config.PLOT_DPI
+CHART_AGGREGATION = config.CHART_AGGREGATION
 NUM_SEGMENTS = config.NUM_SEGMENTS
 POOL_SIZE = config.POOL_SIZE
 
+# Encoder settings of the animation segments. All segments are encoded with the same settings and each
+# one starts with a keyframe, so they are joined by copying the streams instead of encoding them again.
+SEGMENT_CODEC = "libx264"
+SEGMENT_BITRATE = 1500
+SEGMENT_ENCODER_ARGS = ['-preset', 'fast', '-pix_fmt', 'yuv420p', '-crf', '20']
+
 # Emotion color mapping and renaming.
 emotions_colors = {
     'happy':     'orange',
@@ -55,6 +69,9 @@ emotion_rename_map = {
     'neutral':   'neutrality'
 }
 
+# Width of the bar of one analysed frame in seconds.
+BAR_WIDTH = 0.1
+
 ###############################################################################
 # Formatter for time ticks on the x-axis.
 ###############################################################################
@@ -64,135 +81,299 @@ def time_formatter_in_seconds(x, pos):
     seconds = int(x % 60)
     return f"{minutes}:{seconds:02d}"
 
+###############################################################################
+# EMOTION BARS of the Charts
+###############################################################################
+# A long video has hundreds of thousands of analysed frames, far more than the chart has pixels, and
+# drawing one bar per frame makes Matplotlib very slow. The scores are therefore combined into time bins
+# one pixel wide, and each emotion is drawn as a single PolyCollection with at most one rectangle per
+# bin, so the drawing time and memory no longer grow with the length of the video.
+def bin_emotion_scores(times, scores, duration, num_bins, aggregation="max"):
+    """
+    Combines the scores of one emotion above the confidence threshold into time bins.
+    Every score counts for all bins its bar (BAR_WIDTH wide) covers.
+    Args:
+        times (np.ndarray): Time of each analysed frame in seconds.
+        scores (np.ndarray): Score of each analysed frame.
+        duration (float): End of the time axis in seconds; the bins cover 0..duration.
+        num_bins (int): Number of bins.
+        aggregation (str): "max" or "mean" of the scores in a bin.
+    Returns:
+        np.ndarray: The value of each bin, NaN where no bar is drawn.
+    """
+    bin_width = duration / num_bins
+    keep = scores >= CONFIDENCE_THRESHOLD
+    times, scores = times[keep], scores[keep]
+    # First and last bin of each bar.
+    first = np.clip(np.floor((times - BAR_WIDTH / 2) / bin_width), 0, num_bins - 1).astype(np.int64)
+    last = np.clip(np.floor((times + BAR_WIDTH / 2) / bin_width), 0, num_bins - 1).astype(np.int64)
+    # One entry per bar and covered bin. A bar covers more than one bin only when there are few
+    # frames per bin, so the number of entries stays small.
+    spans = last - first + 1
+    starts = np.repeat(np.cumsum(spans) - spans, spans)
+    bins = np.repeat(first, spans) + np.arange(spans.sum()) - starts
+    values = np.repeat(scores, spans)
+
+    counts = np.bincount(bins, minlength=num_bins)
+    if aggregation == "mean":
+        binned = np.bincount(bins, weights=values, minlength=num_bins) / np.maximum(counts, 1)
+    else:
+        binned = np.zeros(num_bins)
+        np.maximum.at(binned, bins, values)
+    binned[counts == 0] = np.nan
+    return binned
+
+
+def draw_emotion_bars(ax, df, duration):
+    """
+    Draws the scores above the confidence threshold of each emotion as bars.
+    With CHART_AGGREGATION "none" every analysed frame gets its own bar; otherwise the frames are
+    combined into bins one pixel wide (see bin_emotion_scores).
+    Args:
+        ax (matplotlib.axes.Axes): Axis to draw on; its y-limits start at the confidence threshold.
+        df (DataFrame): Results with a 'time_sec' column.
+        duration (float): End of the time axis in seconds.
+    """
+    x = df['time_sec'].values
+    # At most one bin per pixel of the figure's width.
+    num_bins = max(1, int(ax.figure.get_figwidth() * ax.figure.dpi))
+    bin_edges = np.linspace(0, duration, num_bins + 1)
+    for emo, color in emotions_colors.items():
+        if emo not in df.columns:
+            continue
+        label = emotion_rename_map.get(emo, emo)
+        if CHART_AGGREGATION == "none" or duration <= 0:
+            y = df[emo].where(df[emo] >= CONFIDENCE_THRESHOLD)
+            valid_mask = y.notna()
+            if valid_mask.any():
+                ax.bar(x[valid_mask], y[valid_mask],
+                       width=BAR_WIDTH, color=color, alpha=0.5,
+                       edgecolor='none', linewidth=0,
+                       label=label)
+            continue
+
+        binned = bin_emotion_scores(x, df[emo].to_numpy(dtype=float, na_value=np.nan), duration, num_bins, CHART_AGGREGATION)
+        filled = np.flatnonzero(~np.isnan(binned))
+        if filled.size == 0:
+            continue
+        # One rectangle per filled bin, from the bottom of the axis up to the bin's value.
+        left, right, top = bin_edges[filled], bin_edges[filled + 1], binned[filled]
+        bottom = np.full(filled.size, CONFIDENCE_THRESHOLD, dtype=float)
+        vertices = np.stack([
+            np.column_stack([left, bottom]), np.column_stack([left, top]),
+            np.column_stack([right, top]), np.column_stack([right, bottom]),
+        ], axis=1)
+        ax.add_collection(PolyCollection(vertices, facecolors=color, alpha=0.5,
+                                         edgecolors='none', linewidths=0, label=label),
+                          autolim=False)
+
+###############################################################################
+# TIMELINE CHART of the Animation
+###############################################################################
+def create_timeline_figure(df, title_str, duration):
+    """
+    Creates the chart of the animation: the emotions above the confidence threshold over the whole
+    video, without the cursor line.
+    Args:
+        df (DataFrame): Results with a 'time_sec' column.
+        title_str (str): Title of the chart.
+        duration (float): Length of the video in seconds.
+    Returns:
+        tuple: (figure, axis)
+    """
+    # Create figure and axis
+    fig, ax = plt.subplots(figsize=(PLOT_WIDTH, PLOT_HEIGHT), dpi=PLOT_DPI, constrained_layout=True)
+    ax.set_title(f"{title_str}", fontsize=12, style='italic', pad=6)
+    ax.set_ylabel("Confidence (%)")
+    ax.set_ylim(CONFIDENCE_THRESHOLD, 100)
+    ax.set_xlim(0, duration)
+    ax.xaxis.set_major_formatter(FuncFormatter(time_formatter_in_seconds))
+    ax.set_xlabel("Time (MM:SS)", fontsize=8)
+
+    # Draw bars for each emotion
+    draw_emotion_bars(ax, df, duration)
+
+    # Add legend
+    handles, labels = ax.get_legend_handles_labels()
+    if handles:
+        ax.legend(loc='upper left', bbox_to_anchor=(1.0, 1), borderaxespad=0, frameon=False, fontsize=8)
+
+    return fig, ax
+
 ###############################################################################
 # PER-SEGMENT FUNCTION for Animation
 ###############################################################################
-def produce_segment(seg_index, segment_start_frame, segment_end_frame, total_frames, all_data):
+def produce_segment(seg_index, segment_start_frame, segment_end_frame, duration, all_data, seg_dir, fps=ANIMATION_FPS):
     """
     Creates one animation segment with local progress tracking.
+    Args:
+        seg_index (int): Number of the segment, starting at 1.
+        segment_start_frame, segment_end_frame (int): Animation frames of the segment (end exclusive).
+        duration (float): Length of the video in seconds.
+        all_data (list): [(DataFrame, title)] of the analysis file.
+        seg_dir (str): Folder of the segments of this analysis file.
+        fps (float): Frame rate of the animation.
+    Returns:
+        dict: 'ok' (True if the segment was saved), 'frames' (number of animation frames) and
+        'timings' with the seconds spent on the chart, rendering the frames, ffmpeg and in total.
     """
     start_time = time.time()
+    timings = {'chart': 0.0, 'render': 0.0, 'ffmpeg': 0.0}
     try:
         # Generate frame indices for the segment
         segment_frames = np.arange(segment_start_frame, segment_end_frame)
-        times = segment_frames / FRAME_RATE
 
-        # Create figure and axis
-        fig, ax = plt.subplots(figsize=(PLOT_WIDTH, PLOT_HEIGHT), dpi=PLOT_DPI, constrained_layout=True)
+        # Create the chart of the whole video
         df, title_str = all_data[0]
-        ax.set_title(f"{title_str}", fontsize=12, style='italic', pad=6)
-        ax.set_ylabel("Confidence (%)")
-        ax.set_ylim(CONFIDENCE_THRESHOLD, 100)
-        ax.set_xlim(0, total_frames / FRAME_RATE)
-        ax.xaxis.set_major_formatter(FuncFormatter(time_formatter_in_seconds))
-        ax.set_xlabel("Time (MM:SS)", fontsize=8)
-
-        # Draw bars for each emotion
-        bar_containers = []
-        x = df['time_sec'].values
-        for emo, color in emotions_colors.items():
-            if emo in df.columns:
-                y = df[emo].where(df[emo] >= CONFIDENCE_THRESHOLD)
-                valid_mask = y.notna()
-                if valid_mask.any():
-                    bars = ax.bar(x[valid_mask], y[valid_mask],
-                                  width=0.1, color=color, alpha=0.5,
-                                  edgecolor='none', linewidth=0,
-                                  label=emotion_rename_map.get(emo, emo))
-                    bar_containers.append(bars)
-
-        # Add legend
-        handles, labels = ax.get_legend_handles_labels()
-        if handles:
-            ax.legend(loc='upper left', bbox_to_anchor=(1.0, 1), borderaxespad=0, frameon=False, fontsize=8)
-
-        # Animation setup
-        vline = ax.axvline(times[0], color='black', linestyle='--', linewidth=1.5)
+        stage_start = time.perf_counter()
+        fig, ax = create_timeline_figure(df, title_str, duration)
+
+        # Animation setup: the chart is rasterised once and only the cursor line is drawn per frame.
+        renderer = CursorRenderer(fig, ax, dpi=100, color='black', linestyle='--', linewidth=1.5)
+        timings['chart'] = time.perf_counter() - stage_start
         seg_filename = f"segment_{seg_index}.mp4"
-        seg_path = os.path.join(ANIMATIONS_DIR, seg_filename)
+        seg_path = os.path.join(seg_dir, seg_filename)
         if os.path.exists(seg_path):
             os.remove(seg_path)
 
-        writer = animation.FFMpegWriter(
-            fps=FRAME_RATE,
-            codec="libx264",
-            bitrate=1500,
-            extra_args=['-preset', 'fast', '-pix_fmt', 'yuv420p', '-crf', '23']
+        # The raw frames are streamed into one ffmpeg process.
+        ffmpeg_process = open_ffmpeg_pipe(
+            seg_path, renderer.width, renderer.height, fps,
+            codec=SEGMENT_CODEC,
+            bitrate=SEGMENT_BITRATE,
+            extra_args=SEGMENT_ENCODER_ARGS
         )
-
-        # Manual frame generation
-        with writer.saving(fig, seg_path, dpi=100):
-            fig.canvas.draw()
-            background = fig.canvas.copy_from_bbox(fig.bbox)
-
+        try:
             for frame_idx, frame in enumerate(segment_frames):
-                t = frame / FRAME_RATE  # Convert frame index to timestamp
+                t = frame / fps  # Convert frame index to timestamp
 
                 # Print local progress every 10% of the segment
                 if frame_idx % max(1, len(segment_frames) // 10) == 0:
                     elapsed_time = time.time() - start_time
                     progress = frame_idx / len(segment_frames) * 100
-                    print(f"\rSegment {seg_index}: {progress:.1f}% complete, Elapsed Time: {elapsed_time:.1f}s", end="")
-
-                # Update vertical line
-                vline.set_xdata([t, t])
-
-                # Restore background and redraw
-                fig.canvas.restore_region(background)
-                ax.draw_artist(vline)
-                fig.canvas.blit(fig.bbox)
-                writer.grab_frame()
+                    print(f"\r{title_str} segment {seg_index}: {progress:.1f}% complete, Elapsed Time: {elapsed_time:.1f}s", end="")
+
+                stage_start = time.perf_counter()
+                image = renderer.render(t)
+                written = time.perf_counter()
+                timings['render'] += written - stage_start
+                # Writing blocks while ffmpeg is busy, so this is the time spent waiting for the encoder.
+                ffmpeg_process.stdin.write(image.data)
+                timings['ffmpeg'] += time.perf_counter() - written
+        finally:
+            stage_start = time.perf_counter()
+            ffmpeg_process.stdin.close()
+            return_code = ffmpeg_process.wait()
+            timings['ffmpeg'] += time.perf_counter() - stage_start
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg exited with code {return_code}")
 
         plt.close(fig)
         elapsed = time.time() - start_time
-        print(f"\n✅ Segment {seg_index} saved ({elapsed:.1f}s)")
-        return True
+        print(f"\n✅ {title_str} segment {seg_index} saved ({elapsed:.1f}s)")
+        timings['total'] = elapsed
+        return {'ok': True, 'frames': len(segment_frames), 'timings': timings}
     except Exception as e:
         elapsed = time.time() - start_time
-        print(f"\n❌ Segment {seg_index} failed after {elapsed:.1f}s: {str(e)}")
+        print(f"\n❌ Segment {seg_index} of {seg_dir} failed after {elapsed:.1f}s: {str(e)}")
         if 'fig' in locals():
             plt.close(fig)
-        return False
+        timings['total'] = elapsed
+        return {'ok': False, 'frames': 0, 'timings': timings}
 
 ###############################################################################
-# STATIC PLOT FUNCTION
+# LOADING OF THE ANALYSIS RESULTS
 ###############################################################################
-def create_static_plot_for_file(csv_file):
+def load_results_file(results_file):
     """
-    Reads an individual analysis CSV file and creates a static bar plot.
-    The x-axis is formatted as M:SS.
-    Saves the plot as a PNG in the PLOTS_DIR.
+    Reads the columns needed for the plots from an analysis result file (Parquet, or CSV of
+    older analyses) and adds the time of each frame.
+    Files without video information (CSV files and older analyses) are assumed to have the default
+    FRAME_RATE and to end after their last analysed frame.
+    Returns:
+        tuple or None: (DataFrame sorted by frame_number, video information with 'fps', 'frame_step'
+        and 'frame_count'), or None if the file cannot be used.
     """
+    columns = ['frame_number', 'face_id'] + list(emotions_colors)
+    video_info = None
     try:
-        df = pd.read_csv(csv_file)
+        if results_file.endswith(".parquet"):
+            df = result_store.read_results(results_file, columns=columns)
+            video_info = result_store.read_video_info(results_file)
+        else:
+            df = pd.read_csv(results_file, usecols=lambda column: column in columns)
     except Exception as e:
-        print(f"Error reading {csv_file}: {e}")
-        return
+        print(f"Error reading {results_file}: {e}")
+        return None
     if 'frame_number' not in df.columns:
-        print(f"'frame_number' column missing in {csv_file}, skipping.")
-        return
+        print(f"'frame_number' column missing in {results_file}, skipping.")
+        return None
     df.sort_values("frame_number", inplace=True)
-    df['time_sec'] = df['frame_number'] / FRAME_RATE
-    base_name = os.path.splitext(os.path.basename(csv_file))[0]
+    if not video_info:
+        steps = df['frame_number'].drop_duplicates().diff()
+        frame_step = max(1, int(steps.min())) if steps.notna().any() else 1
+        last_frame = int(df['frame_number'].max()) if len(df) else -1
+        video_info = {'fps': FRAME_RATE, 'frame_step': frame_step, 'frame_count': last_frame + frame_step}
+    df['time_sec'] = df['frame_number'] / video_info['fps']
+    return df, video_info
+
+
+def split_faces(df, base_name):
+    """
+    Splits the results of an analysis file into one timeline per face.
+    The rows of frames without a face (NO_FACE_ID) are left out; they have no scores to draw. Files
+    with a single face (or without face IDs, from older analyses) keep one timeline under their own
+    name; otherwise every face gets its own timeline named after its ID.
+    Returns:
+        list: (DataFrame, name) per timeline.
+    """
+    if 'face_id' not in df.columns:
+        return [(df, base_name)]
+    face_ids = sorted(int(face_id) for face_id in df['face_id'].dropna().unique() if face_id != NO_FACE_ID)
+    if len(face_ids) <= 1:
+        return [(df[df['face_id'] != NO_FACE_ID] if face_ids else df, base_name)]
+    return [(df[df['face_id'] == face_id], f"{base_name}_face{face_id}") for face_id in face_ids]
+
+
+def find_results_files(sheet=""):
+    """
+    Returns the analysis result files to visualise: the given sheet, or all per-video files.
+    Parquet files are preferred; the CSV files are used for analyses without Parquet files.
+    """
+    if sheet:
+        stem = os.path.splitext(sheet)[0]
+        parquet_file = os.path.join(PARQUET_DIR, f"{stem}.parquet")
+        return [parquet_file if os.path.exists(parquet_file) else os.path.join(CSV_DIR, sheet)]
+    for folder, extension in ((PARQUET_DIR, "parquet"), (CSV_DIR, "csv")):
+        files = glob.glob(os.path.join(folder, f"*_emotional_analysis.{extension}"))
+        combined_file = os.path.join(folder, f"combined_emotional_analysis.{extension}")
+        if combined_file in files:
+            files.remove(combined_file)
+        if files:
+            return files
+    return []
+
+###############################################################################
+# STATIC PLOT FUNCTION
+###############################################################################
+def create_static_plot(df, base_name, duration=None):
+    """
+    Creates a static bar plot of the results of one analysis file or face.
+    The x-axis is formatted as M:SS and ends at the given duration (default: the last analysed frame).
+    Saves the plot as a PNG in the PLOTS_DIR.
+    """
     title = base_name.replace("_emotional_analysis", "")
+    duration = duration if duration is not None else df['time_sec'].max()
     fig, ax = plt.subplots(figsize=(PLOT_WIDTH, PLOT_HEIGHT), dpi=PLOT_DPI, constrained_layout=True)
     ax.set_title(f"{title}", fontsize=12, style='italic', pad=6)
     ax.set_ylabel("Confidence (%)")
     ax.set_ylim(CONFIDENCE_THRESHOLD, 100)
-    ax.set_xlim(0, df['time_sec'].max())
+    ax.set_xlim(0, duration)
     ax.xaxis.set_major_formatter(FuncFormatter(time_formatter_in_seconds))
     ax.set_xlabel("Time (MM:SS)", fontsize=8)
     ax.xaxis.labelpad = 0
     ax.xaxis.set_label_coords(0.5, -0.05)
-    for emo, color in emotions_colors.items():
-        if emo in df.columns:
-            y = df[emo].where(df[emo] >= CONFIDENCE_THRESHOLD)
-            valid_mask = y.notna()
-            if valid_mask.any():
-                ax.bar(df['time_sec'][valid_mask], y[valid_mask],
-                       width=0.1, color=color, alpha=0.5,
-                       edgecolor='none', linewidth=0,
-                       label=emotion_rename_map.get(emo, emo))
+    draw_emotion_bars(ax, df, duration)
     handles, labels = ax.get_legend_handles_labels()
     if handles:
         ax.legend(loc='upper left', bbox_to_anchor=(1.0, 1), borderaxespad=0, frameon=False, fontsize=8)
@@ -203,110 +384,157 @@ def create_static_plot_for_file(csv_file):
     plt.close(fig)
     print(f"Static plot saved to: {static_plot_path}")
 
+###############################################################################
+# CONCATENATION of the Segments
+###############################################################################
+def concat_segments(seg_paths, output_path, concat_file_path):
+    """
+    Joins the segments of an animation into one video file without encoding them again.
+    Returns:
+        bool: True if the animation was written.
+    """
+    with open(concat_file_path, "w", encoding="utf-8") as f:
+        for seg_path in seg_paths:
+            f.write(f"file '{seg_path}'\n")
+
+    ffmpeg_cmd = [
+        "ffmpeg",
+        "-y",
+        "-loglevel", "error",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", concat_file_path,
+        "-c", "copy",
+        "-movflags", "+faststart",
+        output_path
+    ]
+
+    try:
+        print("Starting FFmpeg concatenation...")
+        subprocess.run(ffmpeg_cmd, check=True)
+        print(f"Final animation saved to: {output_path}")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"FFmpeg error: {e}")
+    except FileNotFoundError:
+        print("FFmpeg could not find any files to combine.")
+    return False
+
 ###############################################################################
 # MAIN VISUALISATION FUNCTION
 ###############################################################################
-def run_visualisation(sheet=""):
+def run_visualisation(sheet="", fps=None):
+    """
+    Creates the static plot and the animation of each analysis result file; files with several
+    faces get a static plot and an animation per face (see split_faces).
+    The timings of the stages are printed at the end and written to a JSON file in METRICS_DIR.
+    Args:
+        sheet (str): Only visualise this analysis file; all per-video files if empty.
+        fps (float): Frame rate of the animations; ANIMATION_FPS if not given.
+    Returns:
+        list: Paths of the animations that were written, one per file or per face (see split_faces).
+    """
+    fps = fps or ANIMATION_FPS
     # Start the global timer for the visualization process
     overall_start = time.time()
-    if sheet:
-        csv_files = [os.path.join(CSV_DIR, sheet)]
-    else:
-        csv_files = glob.glob(os.path.join(CSV_DIR, "*_emotional_analysis.csv"))
-        combined_file = os.path.join(CSV_DIR, "combined_emotional_analysis.csv")
-        if combined_file in csv_files:
-            csv_files.remove(combined_file)
-
-    if not csv_files:
-        print("No analysis CSV files found in the analysis folder.")
-        return
-
-    for csv_file in csv_files:
-        print(f"Processing file: {csv_file}")
-
-        # Create static plot
-        create_static_plot_for_file(csv_file)
-
-        # Create animation for each file
-        try:
-            df = pd.read_csv(csv_file)
-        except Exception as e:
-            print(f"Error reading {csv_file}: {e}")
-            continue
-        if 'frame_number' not in df.columns:
-            print(f"'frame_number' missing in {csv_file}, skipping animation.")
-            continue
-        df.sort_values("frame_number", inplace=True)
-        df['time_sec'] = df['frame_number'] / FRAME_RATE
-        base_name = os.path.splitext(os.path.basename(csv_file))[0]
-        title = base_name.replace("_emotional_analysis", "")
-        all_data = [(df, title)]
-        total_frames = len(df)
-        print(f"For file {csv_file}, total frames: {total_frames}")
-
-        # Set up segmentation for animation
-        segment_length_frames = total_frames // NUM_SEGMENTS
-        segments = []
-        current_start_frame = 0
-
-        for i in range(NUM_SEGMENTS):
-            seg_index = i + 1
-            seg_end_frame = current_start_frame + segment_length_frames
-            if seg_index == NUM_SEGMENTS:  # Last segment
-                seg_end_frame = total_frames
-            segments.append((seg_index, current_start_frame, seg_end_frame, total_frames, all_data))
-            current_start_frame = seg_end_frame
-
-        print("\nSegments:")
-        for seg_tuple in segments:
-            seg_idx, s_start, s_end, _, _ = seg_tuple
-            print(f"Segment {seg_idx}: Frames {s_start}..{s_end}")
-
-        print(f"Creating animation for {csv_file} in {NUM_SEGMENTS} segments.")
-        start_processing = time.time()
-
-        pool = multiprocessing.Pool(processes=POOL_SIZE)
-        results = pool.starmap(produce_segment, [(seg_index, s_start, s_end, total_frames, all_data)
-                                                 for seg_index, s_start, s_end, _, _ in segments])
+    metrics = Metrics("visualisation")
+    metrics.info.update({'fps': fps, 'pool_size': POOL_SIZE, 'segments': NUM_SEGMENTS})
+    # The output folders are created when the visualisation runs, not when the module is imported.
+    os.makedirs(PLOTS_DIR, exist_ok=True)
+    os.makedirs(ANIMATIONS_DIR, exist_ok=True)
+    results_files = find_results_files(sheet)
+
+    if not results_files:
+        print("No analysis result files found in the analysis folder.")
+        return []
+
+    # The segments of all files are rendered in one pool, so the next file is already rendered while
+    # the last segments of the previous one are finishing.
+    animations = []
+    written = []
+    pool = multiprocessing.Pool(processes=POOL_SIZE)
+    try:
+        for results_file in results_files:
+            print(f"Processing file: {results_file}")
+
+            # The file is read once for both the static plot and the animation.
+            with metrics.timer('load'):
+                loaded = load_results_file(results_file)
+            if loaded is None:
+                continue
+            df, video_info = loaded
+            # Animation length follows the duration of the video, not the number of analysed frames,
+            # so it stays in sync with the video for every frame step.
+            duration = video_info['frame_count'] / video_info['fps']
+            total_frames = max(1, math.ceil(duration * fps))
+            static_duration = df['time_sec'].max()
+            print(f"For file {results_file}, duration: {duration:.1f}s, animation frames: {total_frames} at {fps:g} FPS")
+
+            # Every face of the file gets its own timeline.
+            for face_df, base_name in split_faces(df, os.path.splitext(os.path.basename(results_file))[0]):
+                title = base_name.replace("_emotional_analysis", "")
+
+                # Create static plot
+                with metrics.timer('static_plot'):
+                    create_static_plot(face_df, base_name, static_duration)
+
+                all_data = [(face_df, title)]
+
+                # Every timeline has its own segment folder, so segments of different files cannot collide.
+                seg_dir = os.path.join(ANIMATIONS_DIR, f"{base_name}_segments")
+                os.makedirs(seg_dir, exist_ok=True)
+
+                # Set up segmentation for animation
+                segment_length_frames = total_frames // NUM_SEGMENTS
+                segments = []
+                current_start_frame = 0
+
+                for i in range(NUM_SEGMENTS):
+                    seg_index = i + 1
+                    seg_end_frame = current_start_frame + segment_length_frames
+                    if seg_index == NUM_SEGMENTS:  # Last segment
+                        seg_end_frame = total_frames
+                    if seg_end_frame > current_start_frame:  # Short files have fewer segments
+                        segments.append((seg_index, current_start_frame, seg_end_frame))
+                    current_start_frame = seg_end_frame
+
+                print("\nSegments:")
+                for seg_idx, s_start, s_end in segments:
+                    print(f"Segment {seg_idx}: Frames {s_start}..{s_end}")
+
+                print(f"Creating animation for {title} in {len(segments)} segments.")
+                pending = [pool.apply_async(produce_segment, (seg_index, s_start, s_end, duration, all_data, seg_dir, fps))
+                           for seg_index, s_start, s_end in segments]
+                animations.append((title, base_name, seg_dir, segments, pending, time.time()))
+
+        for results_file, base_name, seg_dir, segments, pending, start_processing in animations:
+            results = [result.get() for result in pending]
+            for result in results:
+                for stage, seconds in result['timings'].items():
+                    metrics.record(f"segment_{stage}", seconds)
+                metrics.count('animation_frames', result['frames'])
+            success_count = sum(result['ok'] for result in results)
+            total_time = time.time() - start_processing
+            print(f"\nAnimation for {results_file} processed in {total_time:.1f} seconds, success {success_count}/{len(segments)}")
+            if success_count < len(segments):
+                print(f"Segments are missing, the animation of {results_file} is not combined.\n")
+                continue
+
+            # FFmpeg concatenation
+            seg_paths = [os.path.join(seg_dir, f"segment_{seg_index}.mp4") for seg_index, _, _ in segments]
+            concat_file_path = os.path.join(seg_dir, "concat_list.txt")
+            final_merged_path = os.path.join(ANIMATIONS_DIR, f"{base_name}_animation.mp4")
+            with metrics.timer('concat'):
+                concatenated = concat_segments(seg_paths, final_merged_path, concat_file_path)
+            if concatenated:
+                shutil.rmtree(seg_dir, ignore_errors=True)
+                written.append(final_merged_path)
+
+            print("Animation creation complete for this file.\n")
+    finally:
         pool.close()
         pool.join()
 
-        success_count = sum(results)
-        failed_segments = [i + 1 for i, success in enumerate(results) if not success]
-        total_time = time.time() - start_processing
-        print(f"\nAnimation for {csv_file} processed in {total_time:.1f} seconds, success {success_count}/{NUM_SEGMENTS}")
-
-        # FFmpeg concatenation
-        concat_file_path = os.path.join(ANIMATIONS_DIR, f"{base_name}_concat_list.txt")
-        with open(concat_file_path, "w", encoding="utf-8") as f:
-            for i in range(1, NUM_SEGMENTS + 1):
-                seg_path = os.path.join(ANIMATIONS_DIR, f"segment_{i}.mp4")
-                f.write(f"file '{seg_path}'\n")
-
-        final_merged_path = os.path.join(ANIMATIONS_DIR, f"{base_name}_animation.mp4")
-        ffmpeg_cmd = [
-            "ffmpeg",
-            "-y",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", concat_file_path,
-            "-c:v", "libx264",
-            "-crf", "20",
-            "-pix_fmt", "yuv420p",
-            final_merged_path
-        ]
-
-        try:
-            print("Starting FFmpeg concatenation...")
-            subprocess.run(ffmpeg_cmd, check=True)
-            print(f"Final animation saved to: {final_merged_path}")
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg error: {e}")
-        except FileNotFoundError:
-            print("FFmpeg could not find any files to combine.")
-
-        print("Animation creation complete for this file.\n")
-
         # Stop the global timer for the visualization process
     overall_end = time.time()
     overall_duration = overall_end - overall_start
@@ -315,6 +543,9 @@ def run_visualisation(sheet=""):
         f"(started at {datetime.fromtimestamp(overall_start).strftime('%Y-%m-%d %H:%M:%S')}, "
         f"finished at {datetime.fromtimestamp(overall_end).strftime('%Y-%m-%d %H:%M:%S')})."
     )
+    metrics.log_summary(log=print)
+    print(f"Metrics saved to: {metrics.write(METRICS_DIR)}")
+    return written
         
 
 if __name__ == "__main__":
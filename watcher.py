@@ -0,0 +1,200 @@
+import os
+import time
+import logging
+import config
+import analysis
+import result_store
+from metrics import Metrics
+
+# =============================================================================
+# Watch Folder
+# =============================================================================
+# In watch mode the videos folder is scanned every WATCH_POLL_SECONDS for new and changed videos. A
+# video is only analysed once its size and modification time have stayed the same for
+# WATCH_STABLE_CHECKS scans in a row, so a video that is still being copied is not read half-written.
+# The folder is polled rather than watched with file system events, which works the same on every
+# platform and on network drives. The analysis processes are started once for the whole session. After
+# each video, its rows replace its previous rows in the combined result file (see
+# analysis.add_to_combined) instead of combining all videos again, and its plot and animation are created.
+# The rows of a video that is deleted from the folder are removed from the combined file again.
+
+
+def file_signature(path):
+    """Return (size, modification time in ns) of a file."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def has_current_results(video_path):
+    """Return True if the result file of a video exists and is newer than the video."""
+    source = os.path.splitext(os.path.basename(video_path))[0]
+    result_file = analysis.results_file(source)
+    return os.path.exists(result_file) and os.path.getmtime(result_file) >= os.path.getmtime(video_path)
+
+
+class FolderWatcher:
+    """
+    Finds the videos of a folder that are new or changed and have stopped growing.
+    """
+
+    def __init__(self, folder, stable_checks=2, seen=None):
+        """
+        Args:
+            folder (str): The folder with the videos.
+            stable_checks (int): Number of scans in a row in which a video must be unchanged.
+            seen (dict): Signature (see file_signature) of the videos that are already analysed.
+        """
+        self.folder = folder
+        self.stable_checks = max(1, stable_checks)
+        self.seen = dict(seen or {})
+        self._pending = {}  # Signature of each new or changed video and the number of scans it was unchanged
+
+    def scan(self):
+        """
+        Scan the folder once.
+        Returns:
+            tuple: (paths of the videos that are new or changed since they were last returned and have not
+            changed for stable_checks scans, paths of the returned videos that have been removed since),
+            both sorted by name.
+        """
+        ready = []
+        present = set()
+        for path in analysis.find_video_files(self.folder):
+            try:
+                signature = file_signature(path)
+            except OSError:
+                continue  # Removed or renamed since the folder was listed.
+            present.add(path)
+            # Empty files are usually still being created.
+            if signature[0] == 0 or self.seen.get(path) == signature:
+                self._pending.pop(path, None)
+                continue
+            previous, count = self._pending.get(path, (None, 0))
+            count = count + 1 if signature == previous else 1
+            if count >= self.stable_checks:
+                self._pending.pop(path, None)
+                self.seen[path] = signature
+                ready.append(path)
+            else:
+                self._pending[path] = (signature, count)
+        # A video that was removed counts as new if it is added again.
+        removed = sorted(set(self.seen) - present)
+        for path in removed:
+            del self.seen[path]
+        for path in set(self._pending) - present:
+            del self._pending[path]
+        return sorted(ready), removed
+
+
+def process_new_videos(video_paths, pool, frame_step, use_cache, export_formats, adaptive, visualise, fps):
+    """
+    Analyse new or changed videos with the running pool, add them to the combined result file and
+    create their plots and animations.
+    Returns:
+        list: Source identifiers of the videos that were analysed successfully.
+    """
+    metrics = Metrics("watch")
+    metrics.info.update({'frame_step': frame_step, 'videos': len(video_paths)})
+    message = f"New or changed video(s): {[os.path.basename(path) for path in video_paths]}"
+    print(message)
+    logging.info(message)
+    # The checkpoints only match an unchanged video, so an analysis interrupted by stopping the watch is resumed.
+    dfs = analysis.analyse_videos(video_paths, frame_step, use_cache, resume=True, adaptive=adaptive, metrics=metrics,
+                                  pool=pool)
+    sources = []
+    for video_path in video_paths:
+        source = os.path.splitext(os.path.basename(video_path))[0]
+        if dfs.get(video_path) is None:
+            message = f"The analysis of {video_path} failed; it is analysed again once the file changes."
+            print(message)
+            logging.error(message)
+            continue
+        analysis.add_to_combined(source, export_formats, metrics)
+        sources.append(source)
+    del dfs
+
+    if visualise and sources:
+        import visualisation
+        for source in sources:
+            sheet = os.path.basename(analysis.results_file(source))
+            try:
+                with metrics.timer('visualisation'):
+                    visualisation.run_visualisation(sheet=sheet, fps=fps)
+            except Exception as e:
+                logging.error(f"The visualisation of {sheet} failed: {e}")
+                print(f"The visualisation of {sheet} failed: {e}")
+    metrics.log_summary()
+    metrics.write(analysis.METRICS_DIR)
+    return sources
+
+
+def remove_deleted_videos(sources, export_formats):
+    """
+    Remove the rows of deleted videos from the combined result file.
+    Args:
+        sources (list): Source identifiers of the deleted videos.
+        export_formats (list): Any of 'csv' and 'excel'.
+    """
+    message = f"Removed video(s): {sources}"
+    print(message)
+    logging.info(message)
+    metrics = Metrics("watch")
+    for source in sources:
+        analysis.remove_from_combined(source, export_formats, metrics)
+
+
+def run_watch(frame_step=1, use_cache=True, export_formats=None, adaptive=None, visualise=None, fps=None,
+              poll_seconds=None):
+    """
+    Watch the videos folder and analyse every new or changed video until interrupted.
+    Videos whose result file is newer than the video are not analysed again at the start.
+    Args:
+        frame_step (int): Analyse every n-th frame.
+        use_cache (bool): Reuse cached results of videos whose content was already analysed.
+        export_formats (list): Also export the result files as 'csv' and/or 'excel'; defaults to
+            EXPORT_CSV and EXPORT_EXCEL in config.py.
+        adaptive (bool): Use adaptive sampling; defaults to ADAPTIVE_SAMPLING in config.py.
+        visualise (bool): Create the plot and animation of each video; defaults to WATCH_VISUALISE.
+        fps (float): Frame rate of the animations; defaults to ANIMATION_FPS in config.py.
+        poll_seconds (float): Seconds between two scans; defaults to WATCH_POLL_SECONDS.
+    """
+    analysis.prepare_environment()
+    if export_formats is None:
+        export_formats = analysis.default_export_formats()
+    if visualise is None:
+        visualise = config.WATCH_VISUALISE
+    poll_seconds = poll_seconds or config.WATCH_POLL_SECONDS
+
+    video_paths = analysis.find_video_files()
+    analysed = {path: file_signature(path) for path in video_paths if has_current_results(path)}
+    if analysed and not os.path.exists(analysis.COMBINED_FILE):
+        sources = sorted(os.path.splitext(os.path.basename(path))[0] for path in analysed)
+        analysis.combine_and_export(sources, export_formats, Metrics("watch"))
+    elif os.path.exists(analysis.COMBINED_FILE):
+        # Videos deleted while the watch was not running.
+        present = {os.path.splitext(os.path.basename(path))[0] for path in video_paths}
+        deleted = sorted(result_store.read_sources(analysis.COMBINED_FILE) - present)
+        if deleted:
+            remove_deleted_videos(deleted, export_formats)
+    watcher = FolderWatcher(analysis.VIDEO_DIR, config.WATCH_STABLE_CHECKS, seen=analysed)
+    logging.info(f"Watching {analysis.VIDEO_DIR}; {len(analysed)} video(s) are already analysed.")
+    print(f"Watching {analysis.VIDEO_DIR} for new or changed videos every {poll_seconds} seconds (stop with Ctrl+C)...")
+
+    # The processes load the models once and are shared by all videos of the session.
+    pool = analysis.create_pool()
+    try:
+        while True:
+            video_paths, removed = watcher.scan()
+            if removed:
+                remove_deleted_videos(sorted(os.path.splitext(os.path.basename(path))[0] for path in removed),
+                                      export_formats)
+            if video_paths:
+                process_new_videos(video_paths, pool, frame_step, use_cache, export_formats, adaptive, visualise, fps)
+                print(f"Watching {analysis.VIDEO_DIR} for new or changed videos...")
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        analysis.stop_running_jobs()
+        pool.terminate()
+        pool.join()